@@ -0,0 +1,345 @@
+# pyret benchmarks - timings that guard pyret against performance regressions
+#
+#   ---------------------------------------------------------------------------
+#
+#   usage:
+#
+#       python bench_pyret.py import [--budget SECONDS]
+#       python bench_pyret.py functions [--sizes 10 1000 ...] [--types list ndarray pyarrow polars ...] [--functions margin ...]
+#                                       [--save results.json] [--baseline baseline.json] [--tolerance 0.25]
+#       python bench_pyret.py server [--clients 64] [--requests 20000] [--formula margin] [--max-delay 0.001] [--tcp]
+#       python bench_pyret.py threads [--size 10000000] [--functions margin ...] [--threads 1 2 4 ...]
+#
+#   ---------------------------------------------------------------------------
+#
+#   function bench_import(repeat=5):
+#      'Measures cold start time of import pyret and heavy modules it loads.'
+#
+#   function bench_functions(sizes=SIZES, types=TYPES, functions=None, repeat=3):
+#      'Measures time and peak memory of every public function for every input type and size.'
+#
+#   function compare(results, baseline, tolerance=0.25):
+#      'Compares results with baseline, returns results slower or using more memory than baseline by more than tolerance.'
+#
+#   function bench_server(clients=64, requests=20000, formula='margin', max_delay=0.001, max_batch=4096, tcp=False):
+#      'Measures throughput and latency of pyret pricing server under load of concurrent clients sending one request at a time.'
+#
+#   function bench_threads(size=10000000, functions=THREAD_FUNCTIONS, threads=None, repeat=3):
+#      'Measures time and speedup of elementwise formulas calculated into preallocated result by 1 to N threads.'
+#
+#   ---------------------------------------------------------------------------
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+import numpy as np
+
+# modules pyret should never load at import time
+HEAVY_MODULES = ['matplotlib', 'sklearn', 'pandas', 'scipy']
+
+# input sizes and types of bench_functions
+SIZES = [10, 1000, 100000, 10000000]
+TYPES = ['list', 'ndarray', 'Series', 'DataFrame']
+
+# input types of optional libraries, benchmarked when asked with --types
+ARROW_TYPES = ['pyarrow', 'polars']
+
+# rows in every chunk of generated pyarrow ChunkedArrays
+ARROW_CHUNK = 65536
+
+# formulas of bench_threads: cheap (memory bound) and expensive (more arithmetic per element)
+THREAD_FUNCTIONS = ['margin', 'newret_mrgn', 'breakeven_ret', 'elast_arc']
+
+# arguments of every benchmarked function built from columns of generated data
+CASES = {
+    'margin': lambda d: (d['cost'], d['retail']),
+    'margin_weighted': lambda d: (d['cost'], d['retail'], d['units']),
+    'markup': lambda d: (d['cost'], d['retail']),
+    'markup_weighted': lambda d: (d['cost'], d['retail'], d['units']),
+    'newret_mrgn': lambda d: (d['cost'], d['margin']),
+    'newret_mkup': lambda d: (d['cost'], d['markup']),
+    'cost_mrgn': lambda d: (d['retail'], d['margin']),
+    'cost_mkup': lambda d: (d['retail'], d['markup']),
+    'change_newret': lambda d: (d['retail'], d['new_retail']),
+    'newret_change': lambda d: (d['retail'], d['change']),
+    'priceindex': lambda d: (d['base_retail'], d['retail']),
+    'priceindex_weighted': lambda d: (d['base_retail'], d['retail'], d['units']),
+    'retail_units_corr': lambda d: (d['retail'], d['units']),
+    'elast_arc': lambda d: (d['units'], d['new_units'], d['retail'], d['new_retail']),
+    'elast_pt': lambda d: (d['units'], d['new_units'], d['retail'], d['new_retail']),
+    'elast': lambda d: (d['retail'], d['units']),
+    'opt_retail': lambda d: (d['retail'], d['units'], d['elast_coef']),
+    'breakeven_ret': lambda d: (d['cost'], d['retail'], d['discount']),
+    'breakeven_mkup': lambda d: (d['markup'], d['discount']),
+    'breakeven_mrgn': lambda d: (d['margin'], d['discount']),
+    'retail_distr': lambda d: (d['retail'],),
+    'show_depend': lambda d: (d['retail'], d['units']),
+    'smart_round': lambda d: (d['retail'], '*.(49,99)'),
+}
+
+# environment of subprocesses importing pyret from this directory
+def _env():
+    'Returns environment of subprocesses importing pyret from this directory.'
+    return dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.dirname(os.path.abspath(__file__)), os.environ.get('PYTHONPATH', '')]))
+
+# measures cold start time of import pyret and heavy modules it loads
+def bench_import(repeat=5):
+    'Measures cold start time of import pyret and heavy modules it loads.'
+    t_code = ('import sys, time; t_start = time.perf_counter(); import pyret; t_time = time.perf_counter() - t_start; '
+              'print(t_time); print(",".join(i for i in %r if i in sys.modules))' % HEAVY_MODULES)
+    t_env = _env()
+
+    t_times = []
+    t_loaded = set()
+    for i in range(repeat):
+        t_out = subprocess.run([sys.executable, '-c', t_code], env=t_env, check=True, capture_output=True, text=True).stdout.split('\n')
+        t_times.append(float(t_out[0]))
+        t_loaded.update(i for i in t_out[1].split(',') if i)
+
+    return {'min': min(t_times), 'max': max(t_times), 'heavy_modules': sorted(t_loaded)}
+
+# generates columns of retail data in the given container
+def make_data(size, kind, seed=0):
+    'Generates columns of retail data as list, ndarray, pd.Series, pd.DataFrame, pyarrow ChunkedArray or polars Series.'
+    t_rng = np.random.default_rng(seed)
+    t_cost = t_rng.uniform(0.5, 20, size)
+    t_retail = t_cost * t_rng.uniform(1.1, 2.5, size)
+    t_units = t_rng.integers(1, 200, size).astype(float)
+    t_data = {
+        'cost': t_cost,
+        'retail': t_retail,
+        'base_retail': t_retail * t_rng.uniform(0.8, 1.2, size),
+        'new_retail': t_retail * t_rng.uniform(0.8, 0.95, size),
+        'units': t_units,
+        'new_units': t_units * t_rng.uniform(1.05, 1.5, size),
+        'margin': t_rng.uniform(0.1, 0.6, size),
+        'markup': t_rng.uniform(0.1, 1.5, size),
+        'change': t_rng.uniform(-0.2, 0.2, size),
+        'discount': t_rng.uniform(0.05, 0.08, size),
+        'elast_coef': t_rng.uniform(-3, -0.1, size),
+    }
+    if kind == 'list':
+        return {i: t_data[i].tolist() for i in t_data}
+    if kind in ('Series', 'DataFrame'):
+        import pandas as pd
+
+        return {i: pd.Series(t_data[i]) if kind == 'Series' else pd.DataFrame({i: t_data[i]}) for i in t_data}
+    if kind == 'pyarrow':
+        import pyarrow as pa
+
+        return {i: pa.chunked_array([t_data[i][j:j + ARROW_CHUNK] for j in range(0, size, ARROW_CHUNK)]) for i in t_data}
+    if kind == 'polars':
+        import polars as pl
+
+        return {i: pl.Series(i, t_data[i]) for i in t_data}
+    return t_data
+
+# measures time and peak memory of every public function for every input type and size
+def bench_functions(sizes=SIZES, types=TYPES, functions=None, repeat=3):
+    'Measures time and peak memory of every public function for every input type and size.'
+    import pyret
+
+    if 'retail_distr' in (functions or CASES) or 'show_depend' in (functions or CASES):
+        import matplotlib
+
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+
+    t_results = []
+    for t_size in sizes:
+        for t_kind in types:
+            t_data = make_data(t_size, t_kind)
+            for t_case in functions or CASES:
+                t_func = getattr(pyret, t_case.replace('_weighted', ''))
+                t_args = CASES[t_case](t_data)
+
+                def t_call():
+                    t_func(*t_args)
+                    if t_case in ('retail_distr', 'show_depend'):
+                        plt.close('all')
+
+                t_record = {'function': t_case, 'type': t_kind, 'size': t_size}
+                try:
+                    t_start = time.perf_counter()
+                    t_call()
+                    t_number = max(1, min(10000, int(0.05 / max(time.perf_counter() - t_start, 1e-9))))
+                    t_record['seconds'] = min(timeit.repeat(t_call, number=t_number, repeat=repeat)) / t_number
+
+                    tracemalloc.start()
+                    t_call()
+                    t_record['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                except Exception as t_error:
+                    tracemalloc.stop()
+                    t_record['error'] = '%s: %s' % (type(t_error).__name__, t_error)
+                t_results.append(t_record)
+            del t_data
+    return t_results
+
+# compares results with baseline
+def compare(results, baseline, tolerance=0.25):
+    'Compares results with baseline, returns results slower or using more memory than baseline by more than tolerance.'
+    t_base = {(i['function'], i['type'], i['size']): i for i in baseline}
+    t_regressions = []
+    for t_record in results:
+        t_old = t_base.get((t_record['function'], t_record['type'], t_record['size']))
+        if t_old is None:
+            continue
+        for t_metric in ('seconds', 'peak_bytes'):
+            if t_metric in t_record and t_metric in t_old and t_record[t_metric] > t_old[t_metric] * (1 + tolerance) + (0 if t_metric == 'seconds' else 4096):
+                t_regressions.append(dict(t_record, metric=t_metric, baseline=t_old[t_metric], ratio=t_record[t_metric] / max(t_old[t_metric], 1e-12)))
+        if 'error' in t_record and 'error' not in t_old:
+            t_regressions.append(dict(t_record, metric='error'))
+    return t_regressions
+
+# measures throughput and latency of pricing server
+def bench_server(clients=64, requests=20000, formula='margin', max_delay=0.001, max_batch=4096, tcp=False):
+    'Measures throughput and latency of pyret pricing server under load of concurrent clients sending one request at a time.'
+    import pyret
+
+    # every request has as many arguments as the formula takes
+    if formula not in pyret._FORMULAS:
+        raise ValueError('Unsupported formula %r, options available: %s.' % (formula, ', '.join(pyret._FORMULAS)))
+    t_arity = pyret._FORMULAS[formula].__code__.co_argcount
+    t_dir = tempfile.mkdtemp()
+    if tcp:
+        with socket.socket() as t_socket:
+            t_socket.bind(('127.0.0.1', 0))
+            t_address = {'port': t_socket.getsockname()[1]}
+    else:
+        t_address = {'path': os.path.join(t_dir, 'pyret.sock')}
+    t_server = subprocess.Popen([sys.executable, '-c', 'import pyret; pyret.serve(max_delay=%r, max_batch=%r, **%r)' % (max_delay, max_batch, t_address)], env=_env())
+
+    async def connect():
+        if tcp:
+            return await asyncio.open_connection('127.0.0.1', t_address['port'])
+        return await asyncio.open_unix_connection(t_address['path'])
+
+    async def client(t_count, t_latencies):
+        t_reader, t_writer = await connect()
+        t_rng = np.random.default_rng(len(t_latencies))
+        for t_args in t_rng.uniform(1, 10, (t_count, t_arity)).tolist():
+            t_start = time.perf_counter()
+            t_writer.write((json.dumps({'formula': formula, 'args': t_args}) + '\n').encode())
+            await t_writer.drain()
+            if 'result' not in json.loads(await t_reader.readline()):
+                raise RuntimeError('Server returned error.')
+            t_latencies.append(time.perf_counter() - t_start)
+        t_writer.close()
+
+    async def run():
+        # waits for the server to start listening
+        for i in range(500):
+            try:
+                t_writer = (await connect())[1]
+                t_writer.close()
+                break
+            except OSError:
+                await asyncio.sleep(0.01)
+        t_latencies = []
+        t_start = time.perf_counter()
+        await asyncio.gather(*[client(requests // clients + (i < requests % clients), t_latencies) for i in range(clients)])
+        return time.perf_counter() - t_start, np.array(t_latencies)
+
+    try:
+        t_seconds, t_latencies = asyncio.run(run())
+    finally:
+        t_server.terminate()
+        t_server.wait()
+    return {'requests': t_latencies.size, 'seconds': t_seconds, 'rps': t_latencies.size / t_seconds,
+            'p50': float(np.percentile(t_latencies, 50)), 'p99': float(np.percentile(t_latencies, 99))}
+
+# measures scaling of chunked evaluation with the number of threads
+def bench_threads(size=10000000, functions=THREAD_FUNCTIONS, threads=None, repeat=3):
+    'Measures time and speedup of elementwise formulas calculated into preallocated result by 1 to N threads.'
+    import pyret
+
+    t_threads = threads or [i for i in (1, 2, 4, 8, 16, 32, 64) if i <= (os.cpu_count() or 1)]
+    t_data = make_data(size, 'ndarray')
+    t_out = np.empty(size)
+    t_results = []
+    for t_name in functions:
+        t_func = getattr(pyret, t_name)
+        t_args = CASES[t_name](t_data)
+        t_single = None
+        for t_count in t_threads:
+            t_seconds = min(timeit.repeat(lambda: t_func(*t_args, out=t_out, threads=t_count), number=1, repeat=repeat))
+            t_single = t_single or t_seconds
+            t_results.append({'function': t_name, 'size': size, 'threads': t_count, 'seconds': t_seconds,
+                              'speedup': t_single / t_seconds, 'gb_per_second': (len(t_args) + 1) * t_out.nbytes / t_seconds / 1e9})
+    return t_results
+
+# runs benchmarks from the command line, returns non-zero exit code on regression
+def main(argv=None):
+    'Runs benchmarks from the command line, returns non-zero exit code on regression.'
+    t_parser = argparse.ArgumentParser(description='pyret benchmarks')
+    t_sub = t_parser.add_subparsers(dest='bench', required=True)
+    t_import = t_sub.add_parser('import', help='cold start time of import pyret')
+    t_import.add_argument('--budget', type=float, default=0.5, help='max import time in seconds')
+    t_import.add_argument('--repeat', type=int, default=5)
+    t_functions = t_sub.add_parser('functions', help='time and peak memory of every public function')
+    t_functions.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    t_functions.add_argument('--types', nargs='+', default=TYPES, choices=TYPES + ARROW_TYPES)
+    t_functions.add_argument('--functions', nargs='+', default=None, choices=list(CASES))
+    t_functions.add_argument('--repeat', type=int, default=3)
+    t_functions.add_argument('--save', help='save results to JSON file')
+    t_functions.add_argument('--baseline', help='compare results with JSON file saved before')
+    t_functions.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown or memory growth versus baseline')
+    t_server = t_sub.add_parser('server', help='throughput and latency of pricing server')
+    t_server.add_argument('--clients', type=int, default=64)
+    t_server.add_argument('--requests', type=int, default=20000)
+    t_server.add_argument('--formula', default='margin')
+    t_server.add_argument('--max-delay', type=float, default=0.001, help='latency budget of batch in seconds')
+    t_server.add_argument('--max-batch', type=int, default=4096)
+    t_server.add_argument('--tcp', action='store_true', help='TCP instead of Unix socket')
+    t_threads = t_sub.add_parser('threads', help='scaling of chunked evaluation from 1 to N threads')
+    t_threads.add_argument('--size', type=int, default=10000000)
+    t_threads.add_argument('--functions', nargs='+', default=THREAD_FUNCTIONS, choices=[i for i in CASES if not i.endswith('_weighted')])
+    t_threads.add_argument('--threads', type=int, nargs='+', default=None, help='numbers of threads (powers of 2 up to the number of CPUs by default)')
+    t_threads.add_argument('--repeat', type=int, default=3)
+    t_args = t_parser.parse_args(argv)
+
+    if t_args.bench == 'import':
+        t_res = bench_import(t_args.repeat)
+        print('import pyret: min %.4fs, max %.4fs, heavy modules loaded: %s' % (t_res['min'], t_res['max'], ', '.join(t_res['heavy_modules']) or 'none'))
+        if t_res['heavy_modules'] or t_res['min'] > t_args.budget:
+            print('REGRESSION: import pyret should load none of %s and take less than %.2fs.' % (', '.join(HEAVY_MODULES), t_args.budget))
+            return 1
+
+    elif t_args.bench == 'functions':
+        t_res = bench_functions(t_args.sizes, t_args.types, t_args.functions, t_args.repeat)
+        for i in t_res:
+            print('%-20s %-10s %10d  %s' % (i['function'], i['type'], i['size'],
+                                             i['error'] if 'error' in i else '%12.3fus %12d bytes' % (i['seconds'] * 1e6, i['peak_bytes'])))
+        if t_args.save:
+            with open(t_args.save, 'w') as t_file:
+                json.dump({'python': sys.version, 'numpy': np.__version__, 'results': t_res}, t_file, indent=1)
+        if t_args.baseline:
+            with open(t_args.baseline) as t_file:
+                t_regressions = compare(t_res, json.load(t_file)['results'], t_args.tolerance)
+            for i in t_regressions:
+                print('REGRESSION: %s %s %d %s %s' % (i['function'], i['type'], i['size'], i['metric'], 'x%.2f' % i['ratio'] if 'ratio' in i else i.get('error')))
+            if t_regressions:
+                return 1
+
+    elif t_args.bench == 'server':
+        t_res = bench_server(t_args.clients, t_args.requests, t_args.formula, t_args.max_delay, t_args.max_batch, t_args.tcp)
+        print('%d requests from %d clients: %.0f requests/s, latency p50 %.3fms, p99 %.3fms' % (
+            t_res['requests'], t_args.clients, t_res['rps'], t_res['p50'] * 1e3, t_res['p99'] * 1e3))
+
+    elif t_args.bench == 'threads':
+        for i in bench_threads(t_args.size, t_args.functions, t_args.threads, t_args.repeat):
+            print('%-20s %10d %3d threads %10.3fms  x%.2f  %6.2f GB/s' % (i['function'], i['size'], i['threads'], i['seconds'] * 1e3, i['speedup'], i['gb_per_second']))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
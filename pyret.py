@@ -1,68 +1,179 @@
 # pyret module - basic python functions for retail application
 #
+#   requires numpy only: pandas objects are supported when pandas is installed, matplotlib (retail_distr, show_depend, render_charts)
+#   and scikit-learn (elast) are imported on first use
+#
+#   elementwise formulas (margin, markup, newret_*, cost_*, change_newret, priceindex, elast_arc, elast_pt, breakeven_*) also accept tuples,
+#   pyarrow arrays and polars Series and return the result in the container of the input (pd.Series and pd.DataFrame keep their index),
+#   weighted metrics raise ValueError if lengths of values and units differ
+#
+#   rows of pandas arguments with different indexes are aligned by labels on the union of indexes as pandas arithmetic does (identical
+#   indexes and DataFrame columns are matched by positions; evaluate and scenario_grid align all their pandas inputs the same way,
+#   ValueError is raised if different indexes have duplicate labels),
+#   weighted metrics of pandas objects skip NaN products as pd.Series.sum() does
+#
+#   pyarrow arrays and polars Series are viewed as ndarrays without copying (nulls become NaN), pyarrow ChunkedArrays are calculated
+#   chunk by chunk (formulas return ChunkedArray of the same chunks, weighted metrics sum chunks) without concatenation or pandas
+#
+#   with out= or dtype= elementwise formulas are calculated chunk by chunk with ufuncs writing into the result (temporaries are limited
+#   to a few chunks of 16384 values), out= takes a preallocated ndarray (one of the inputs for in place calculation) and is returned,
+#   dtype=np.float32 halves memory and bandwidth of the result at lower precision, threads= splits chunks between threads of a shared
+#   pool with a thread for every CPU writing into the same result (numpy ufuncs release GIL), small inputs stay in the calling thread
+#
+#   enable_cents() switches on fixed-point prices: retails and costs are int64 cents (or 1/scale), newret_*, cost_* and newret_change
+#   round results half up into int64 chunk by chunk (in evaluate, scenario_grid and serve as well), smart_round finds endings by integer
+#   modulo arithmetic and returns int64 prices, % formulas take integer prices as they are (margin(436, 545) is exactly 0.2)
+#
 #   ---------------------------------------------------------------------------
 #
 #   list of functions: 
 #
 #   ---------------------------------------------------------------------------
 #
-#   function margin(cost, retail, units=[]):
+#   function margin(cost, retail, units=[], by=None, out=None, dtype=None, threads=None):
 #      'Calculates % margin based on cost and retail. Calculares weighted % margin based on cost, retail, unit sales.'
 #    
-#   function markup(cost, retail, units=[]):
+#   function markup(cost, retail, units=[], by=None, out=None, dtype=None, threads=None):
 #      'Calculates % markup based on cost and retail. Calculares weighted % markup based on cost, retail, unit sales.'
 #    
-#   function newret_mrgn(cost, margin):
+#   function newret_mrgn(cost, margin, out=None, dtype=None, threads=None):
 #      'Calculates new retail based on cost and target % margin.'
 #    
-#   function newret_mkup(cost, markup):
+#   function newret_mkup(cost, markup, out=None, dtype=None, threads=None):
 #      'Calculates new retail based on cost and target % markup.'
 #    
-#   function cost_mrgn(retail, margin):
+#   function cost_mrgn(retail, margin, out=None, dtype=None, threads=None):
 #      'Calculates cost based on retail and % margin.'
 #    
-#   function cost_mkup(retail, markup):
+#   function cost_mkup(retail, markup, out=None, dtype=None, threads=None):
 #      'Calculates cost based on retail and % markup.'
 #    
-#   function change_newret(old_retail, new_retail):
+#   function change_newret(old_retail, new_retail, out=None, dtype=None, threads=None):
 #      'Calculates retail % change based on current retail and target (new) retail.'
 #    
-#   function newret_change(retail, change):
+#   function newret_change(retail, change, out=None, dtype=None, threads=None):
 #      'Calculates new retail based on current retail and % change.'
 #    
-#   function priceindex(base_retail, retail, units=[]):
+#   function priceindex(base_retail, retail, units=[], by=None, out=None, dtype=None, threads=None):
 #      'Calculates Price Index for retail versus base_retail. Calculates weighted Price Index for retails versus base_retails based on unit sales.'
 #    
-#   function retail_units_corr(retail, units):
-#      'Calculates correlation coefficient between price and unit sold.'
+#   function retail_units_corr(retail, units, by=None):
+#      'Calculates correlation coefficient between price and unit sold. Calculates correlation coefficients for every group.'
 #    
-#   function elast_arc(old_volume, new_volume, old_retail, new_retail):
+#   class CorrStats():
+#      'Count, means and centered sums of squares and products of retail and units (Welford), updated chunk by chunk and merged.'
+#    
+#   function elast_arc(old_volume, new_volume, old_retail, new_retail, out=None, dtype=None, threads=None):
 #      'Calculates arc price elasticity of demand based on old volume, new volume, old retail, new retail.'
 #    
-#   function elast_pt(old_volume, new_volume, old_retail, new_retail):
+#   function elast_pt(old_volume, new_volume, old_retail, new_retail, out=None, dtype=None, threads=None):
 #      'Calculates point price elasticity of demand based on old volume, new volume, old retail, new retail.'
 #    
 #   function elast(retail, units, segment_begin, segment_end):
 #      'Calculates coefficient and intercept for linear regression model.'
 #    
+#   function elast_group(retail, units, keys, segment_begin=0, segment_end=0):
+#      'Calculates coefficient and intercept for linear regression model in the segment for every group of long-format data at once.'
+#    
+#   function elast_breaks(retail, units, breakpoints=1, candidates=100, min_size=5):
+#      'Finds retail breakpoints of piecewise linear regression and calculates elast statistics of every segment.'
+#    
+#   class RollingElast():
+#      'Sums behind linear regression of units on retail for every SKU (n, sum(x), sum(y), sum(xy), sum(x^2), sum(y^2)), observations are added and dropped in O(1).'
+#    
+#   class PriceSeries(retail, units):
+#      'Retails and unit sales sorted by retail once with prefix sums, every segment query (elast, count, units, average retail) is answered in O(log n).'
+#    
 #   function opt_retail(retail, units, elast_coef, range=0.1):
 #      'Calculates opimal retails (max dollar sales) based on current retails, unit sales, elastisity.'
 #    
-#   function breakeven_ret(cost, retail, discount):
+#   function opt_retail_batch(retail, units, elast_coef, range=0.1, chunk_size=1000000):
+#      'Calculates opimal retails (max dollar sales) and $ sales at these retails for all SKUs at once based on current retails, unit sales, elastisity.'
+#    
+#   function opt_portfolio(retail, cost, units, elast_coef, lower=None, upper=None, range=0.1, min_margin=None, base_retail=None, max_index=None, temp=None, iterations=100):
+#      'Calculates retails of all SKUs that deliver max margin dollars of the assortment within price bounds, minimum % margin and max weighted Price Index.'
+#    
+#   function breakeven_ret(cost, retail, discount, out=None, dtype=None, threads=None):
 #      'Calculates % break even based on cost, retail and % discount.'
 #    
-#   function breakeven_mkup(markup, discount):
+#   function breakeven_mkup(markup, discount, out=None, dtype=None, threads=None):
 #      'Calculates % break even based on % markup and % discount.'
 #    
-#   function breakeven_mrgn(margin, discount):
+#   function breakeven_mrgn(margin, discount, out=None, dtype=None, threads=None):
 #      'Calculates % break even based on % margin and % discount.'
 #    
-#   function retail_distr(retail, precision=1):
+#   function scenario_grid(formula, skus, scenarios, reduce=None, k=10, dtype=None, max_bytes=64 * 2 ** 20):
+#      'Calculates elementwise formula for every SKU (rows) under every scenario of its last argument (columns) in tiles of bounded memory, optionally reduced over SKUs on the fly.'
+#    
+#   function lazy(formula, *args):
+#      'Builds deferred call of elementwise formula (function or its name) on scalars, arrays or other deferred calls.'
+#    
+#   function evaluate(*exprs, chunk_size=16384):
+#      'Calculates deferred calls of elementwise formulas chunk by chunk, only final results are materialized.'
+#    
+#   function elast_parallel(retail, units, keys, segment_begin=0, segment_end=0, workers=None, chunk_size=1000):
+#      'Calculates coefficient and intercept for linear regression model in the segment for every group in a process pool.'
+#    
+#   function opt_retail_parallel(retail, units, elast_coef, keys, range=0.1, workers=None, chunk_size=1000):
+#      'Calculates opimal retails (max dollar sales) and $ sales at these retails for blocks of groups in a process pool.'
+#    
+#   class WeightedSums():
+#      'Running sums behind weighted metrics: sum(units * retail), sum(units * cost), sum(units * base_retail).'
+#    
+#   function iter_chunks(path, columns, chunk_size=1000000):
+#      'Reads columns of CSV or Parquet file chunk by chunk, yields dict of ndarrays.'
+#    
+#   function iter_weighted(path, units='units', retail='retail', cost=None, base_retail=None, chunk_size=1000000):
+#      'Calculates running sums behind weighted metrics of CSV or Parquet transaction file chunk by chunk, yields WeightedSums after every chunk.'
+#    
+#   function stream_weighted(path, units='units', retail='retail', cost=None, base_retail=None, chunk_size=1000000):
+#      'Calculates running sums behind weighted metrics of CSV or Parquet transaction file holding one chunk in memory at a time.'
+#    
+#   function write_book(path, columns, group=None):
+#      'Writes columns (dict of arrays or pd.DataFrame) into price book file: typed columns and header describing them, rows sorted by group column.'
+#    
+#   function open_book(path):
+#      'Opens price book file written by write_book with np.memmap: nothing is read until columns are used, processes share OS page cache.'
+#    
+#   class BatchServer(max_delay=0.001, max_batch=4096, limit=2 ** 16):
+#      'Asyncio server of elementwise formulas over TCP or Unix socket, concurrent scalar requests of the same formula are calculated as one vectorized batch.'
+#    
+#   function serve(host='127.0.0.1', port=8765, path=None, max_delay=0.001, max_batch=4096, limit=2 ** 16):
+#      'Runs asyncio pricing server of elementwise formulas over TCP or Unix socket until interrupted, concurrent requests are calculated in vectorized batches.'
+#    
+#   function enable_cache(max_bytes=256 * 2 ** 20, path=None):
+#      'Switches on cache of elast, elast_group and opt_retail_batch results, returns FitCache.'
+#    
+#   function disable_cache():
+#      'Switches off cache of elast, elast_group and opt_retail_batch results.'
+#    
+#   function enable_metrics(buckets=Metrics.BUCKETS):
+#      'Switches on call counts, latency histograms and element counts of pyret functions, returns Metrics.'
+#    
+#   function disable_metrics():
+#      'Switches off metrics of pyret functions, original functions are restored.'
+#    
+#   function enable_cents(scale=100):
+#      'Switches on fixed-point prices: retails and costs are int64 numbers of 1/scale (cents), calculated retails and costs are rounded to int64, smart_round works in integers.'
+#    
+#   function disable_cents():
+#      'Switches off fixed-point prices, retails and costs are floats.'
+#    
+#   function retail_hist(retail, precision=1):
+#      'Calculates histogram of retails: number of cases in every retail price segment of the size precision.'
+#    
+#   function depend_grid(retail, units, bins=100):
+#      'Calculates 2D density grid of retails and units: number of cases in every cell of retail x units grid.'
+#    
+#   function retail_distr(retail, precision=1, path=None):
 #      'Creates and show retails distribution.'
 #    
-#   function show_depend(retail, units):
+#   function show_depend(retail, units, gridsize=50, path=None):
 #      'Creates and show price/units dependency scatter.'
 #    
+#   function render_charts(retail, keys, path, units=None, precision=1, gridsize=50, format='png'):
+#      'Renders retails distribution (price/units dependency if units are given) of every group of long-format data into files with non-interactive backend.'
+#    
 #   function smart_round(retail, temp='*.**', align='fair'):
 #      'Smart rounding: number of decimals, ending digits.'
 #
@@ -72,7 +183,7 @@
 # 
 #   ---------------------------------------------------------------------------
 #
-#   function margin(cost, retail, units=[])
+#   function margin(cost, retail, units=[], by=None, out=None, dtype=None, threads=None)
 #
 #       Calculates % margin based on cost and retail. Calculares weighted % margin based on cost, retail, unit sales.
 #
@@ -81,12 +192,18 @@
 #           cost - scalar value, list, ndarray, pd.Series or pd.DataFrame with cost(s) in int or float format
 #           retail - scalar value, list, ndarray, pd.Series or pd.DataFrame with retail(s) in int or float format
 #           units - list, ndarray, pd.Series or pd.DataFrame with units sold in int or float format, length of units should be equal to the length of cost and retail
+#           by - list, ndarray or pd.Series with group keys (e.g. store) or tuple of them (e.g. (store, category)), weighted result is calculated for every group (units are 1 if not given)
+#           out - ndarray of the result shape to write the result into, can be one of the inputs to calculate in place
+#           dtype - dtype of the result, e.g. np.float32 to halve memory and bandwidth at lower precision (if None then dtype of out or float64)
+#           threads - number of threads calculating blocks of chunks of the result (0 - all CPUs, at most the number of CPUs), numpy releases GIL
+#                     so large inputs use several cores, inputs of less than 4 chunks of 16384 rows per thread use fewer threads
 #
 #       Returns:
 #
 #           % margin as float,
 #           list, ndarray, pd.Series, pd.DataFrame of % margins as floats
 #           weighted % margin as float
+#           weighted % margins of groups as pd.Series (if any input is pandas object) or tuple of sorted unique keys and ndarray
 #
 #       Samples:
 #
@@ -99,9 +216,12 @@
 #           >>> margin([2.35, 4.36], [4.70, 5.45], units=[100, 300])
 #           out: 0.2669833729216152
 #
+#           >>> margin([2.35, 4.36, 2.35], [4.70, 5.45, 4.70], units=[100, 300, 100], by=['a', 'a', 'b'])
+#           out: (array(['a', 'b']), array([ 0.26698337,  0.5       ]))
+#
 #   ---------------------------------------------------------------------------
 #
-#   function markup(cost, retail, units=[]) 
+#   function markup(cost, retail, units=[], by=None, out=None, dtype=None, threads=None)
 #           
 #       Calculates % markup based on cost and retail. Calculares weighted % markup based on cost, retail, unit sales.
 #
@@ -110,12 +230,18 @@
 #           cost - scalar value, list, ndarray, pd.Series or pd.DataFrame with cost(s) in int or float format
 #           retail - scalar value, list, ndarray, pd.Series or pd.DataFrame with retail(s) in int or float format
 #           units - list, ndarray, pd.Series or pd.DataFrame with units sold in int or float format, length of units should be equal to the length of cost and retail
+#           by - list, ndarray or pd.Series with group keys (e.g. store) or tuple of them (e.g. (store, category)), weighted result is calculated for every group (units are 1 if not given)
+#           out - ndarray of the result shape to write the result into, can be one of the inputs to calculate in place
+#           dtype - dtype of the result, e.g. np.float32 to halve memory and bandwidth at lower precision (if None then dtype of out or float64)
+#           threads - number of threads calculating blocks of chunks of the result (0 - all CPUs, at most the number of CPUs), numpy releases GIL
+#                     so large inputs use several cores, inputs of less than 4 chunks of 16384 rows per thread use fewer threads
 #
 #       Returns:
 #
 #           % markup as float,
 #           list, ndarray, pd.Series, pd.DataFrame of % markups as floats
 #           weighted % markup as float
+#           weighted % markups of groups as pd.Series (if any input is pandas object) or tuple of sorted unique keys and ndarray
 #
 #       Samples:
 #
@@ -130,7 +256,7 @@
 #
 #   ---------------------------------------------------------------------------
 #
-#   function newret_mrgn(cost, markup):
+#   function newret_mrgn(cost, markup, out=None, dtype=None, threads=None):
 #       
 #       Calculates new retail based on cost and target % margin.
 #
@@ -138,6 +264,10 @@
 #
 #           cost - scalar value, list, ndarray, pd.Series or pd.DataFrame with cost(s) in int or float format
 #           markup - scalar value, list, ndarray, pd.Series or pd.DataFrame with % markup(s) in int or float format
+#           out - ndarray of the result shape to write the result into, can be one of the inputs to calculate in place
+#           dtype - dtype of the result, e.g. np.float32 to halve memory and bandwidth at lower precision (if None then dtype of out or float64)
+#           threads - number of threads calculating blocks of chunks of the result (0 - all CPUs, at most the number of CPUs), numpy releases GIL
+#                     so large inputs use several cores, inputs of less than 4 chunks of 16384 rows per thread use fewer threads
 #
 #       Returns:
 #
@@ -154,7 +284,7 @@
 #
 #   ---------------------------------------------------------------------------
 #
-#   function newret_mkup(cost, markup):
+#   function newret_mkup(cost, markup, out=None, dtype=None, threads=None):
 #       
 #       Calculates new retail based on cost and target % markup.
 #
@@ -162,6 +292,10 @@
 #
 #           cost - scalar value, list, ndarray, pd.Series or pd.DataFrame with cost(s) in int or float format
 #           markup - scalar value, list, ndarray, pd.Series or pd.DataFrame with % markup(s) in int or float format
+#           out - ndarray of the result shape to write the result into, can be one of the inputs to calculate in place
+#           dtype - dtype of the result, e.g. np.float32 to halve memory and bandwidth at lower precision (if None then dtype of out or float64)
+#           threads - number of threads calculating blocks of chunks of the result (0 - all CPUs, at most the number of CPUs), numpy releases GIL
+#                     so large inputs use several cores, inputs of less than 4 chunks of 16384 rows per thread use fewer threads
 #
 #       Returns:
 #
@@ -178,7 +312,7 @@
 #
 #   ---------------------------------------------------------------------------
 #
-#   function cost_mrgn(retail, margin):
+#   function cost_mrgn(retail, margin, out=None, dtype=None, threads=None):
 #    
 #       Calculates cost based on retail and % margin.
 #
@@ -186,6 +320,10 @@
 #
 #           retail - scalar value, list, ndarray, pd.Series or pd.DataFrame with retail(s) in int or float format
 #           margin - scalar value, list, ndarray, pd.Series or pd.DataFrame with % margin(s) in int or float format
+#           out - ndarray of the result shape to write the result into, can be one of the inputs to calculate in place
+#           dtype - dtype of the result, e.g. np.float32 to halve memory and bandwidth at lower precision (if None then dtype of out or float64)
+#           threads - number of threads calculating blocks of chunks of the result (0 - all CPUs, at most the number of CPUs), numpy releases GIL
+#                     so large inputs use several cores, inputs of less than 4 chunks of 16384 rows per thread use fewer threads
 #
 #       Returns:
 #
@@ -202,7 +340,7 @@
 #
 #   ---------------------------------------------------------------------------
 #
-#   function cost_mkup(retail, markup):
+#   function cost_mkup(retail, markup, out=None, dtype=None, threads=None):
 #    
 #       Calculates cost based on retail and % markup.
 #
@@ -210,6 +348,10 @@
 #
 #           retail - scalar value, list, ndarray, pd.Series or pd.DataFrame with retail(s) in int or float format
 #           markup - scalar value, list, ndarray, pd.Series or pd.DataFrame with % markup(s) in int or float format
+#           out - ndarray of the result shape to write the result into, can be one of the inputs to calculate in place
+#           dtype - dtype of the result, e.g. np.float32 to halve memory and bandwidth at lower precision (if None then dtype of out or float64)
+#           threads - number of threads calculating blocks of chunks of the result (0 - all CPUs, at most the number of CPUs), numpy releases GIL
+#                     so large inputs use several cores, inputs of less than 4 chunks of 16384 rows per thread use fewer threads
 #
 #       Returns:
 #
@@ -226,7 +368,7 @@
 #
 #   ---------------------------------------------------------------------------
 #
-#   function change_newret(old_retail, new_retail):
+#   function change_newret(old_retail, new_retail, out=None, dtype=None, threads=None):
 #
 #       Calculates % change based on current retail and target (new) retail.
 #
@@ -234,6 +376,10 @@
 #
 #           old_retail - scalar value, list, ndarray, pd.Series or pd.DataFrame with old (current) retail(s) in int or float format
 #           new_retail - scalar value, list, ndarray, pd.Series or pd.DataFrame with new (target) retail(s) in int or float format
+#           out - ndarray of the result shape to write the result into, can be one of the inputs to calculate in place
+#           dtype - dtype of the result, e.g. np.float32 to halve memory and bandwidth at lower precision (if None then dtype of out or float64)
+#           threads - number of threads calculating blocks of chunks of the result (0 - all CPUs, at most the number of CPUs), numpy releases GIL
+#                     so large inputs use several cores, inputs of less than 4 chunks of 16384 rows per thread use fewer threads
 #
 #       Returns:
 #
@@ -250,7 +396,7 @@
 #
 #   ---------------------------------------------------------------------------
 #
-#   function newret_change(retail, change):
+#   function newret_change(retail, change, out=None, dtype=None, threads=None):
 #
 #       Calculates new retail based on current retail and % change.
 #
@@ -258,6 +404,10 @@
 #
 #           retail - scalar value, list, ndarray, pd.Series or pd.DataFrame with old (current) retail(s) in int or float format
 #           change - scalar value, list, ndarray, pd.Series or pd.DataFrame with % change(s) in int or float format
+#           out - ndarray of the result shape to write the result into, can be one of the inputs to calculate in place
+#           dtype - dtype of the result, e.g. np.float32 to halve memory and bandwidth at lower precision (if None then dtype of out or float64)
+#           threads - number of threads calculating blocks of chunks of the result (0 - all CPUs, at most the number of CPUs), numpy releases GIL
+#                     so large inputs use several cores, inputs of less than 4 chunks of 16384 rows per thread use fewer threads
 #
 #       Returns:
 #
@@ -274,7 +424,7 @@
 #
 #   ---------------------------------------------------------------------------
 #
-#   function priceindex(base_retail, retail, units=[]):
+#   function priceindex(base_retail, retail, units=[], by=None, out=None, dtype=None, threads=None):
 #
 #       Calculates Price Index for retail versus base_retail. Calculates weighted Price Index for retails versus base_retails based on unit sales.
 #
@@ -283,12 +433,18 @@
 #           base_retail - scalar value, list, ndarray, pd.Series or pd.DataFrame with retails used as a base in int or float format
 #           retail - scalar value, list, ndarray, pd.Series or pd.DataFrame with retail(s) in int or float format
 #           units - list, ndarray, pd.Series or pd.DataFrame with units sold in int or float format, length of units should be equal to the length of base_retail and retail
+#           by - list, ndarray or pd.Series with group keys (e.g. store) or tuple of them (e.g. (store, category)), weighted result is calculated for every group (units are 1 if not given)
+#           out - ndarray of the result shape to write the result into, can be one of the inputs to calculate in place
+#           dtype - dtype of the result, e.g. np.float32 to halve memory and bandwidth at lower precision (if None then dtype of out or float64)
+#           threads - number of threads calculating blocks of chunks of the result (0 - all CPUs, at most the number of CPUs), numpy releases GIL
+#                     so large inputs use several cores, inputs of less than 4 chunks of 16384 rows per thread use fewer threads
 #
 #       Returns:
 #
 #           priceindex as float,
 #           list, ndarray, pd.Series, pd.DataFrame of priceindexes as floats
 #           weighted priceindex as float
+#           weighted priceindexs of groups as pd.Series (if any input is pandas object) or tuple of sorted unique keys and ndarray
 #
 #       Samples:
 #
@@ -303,27 +459,54 @@
 #
 #   ---------------------------------------------------------------------------
 #
-#   function retail_units_corr(retail, units):
+#   function retail_units_corr(retail, units, by=None):
 #
-#       Calculates correlation coefficient between price and unit sold.
+#       Calculates correlation coefficient between price and unit sold. Calculates correlation coefficients for every group.
 #
 #       Arguments:
 #
 #           retail - list, ndarray, pd.Series or pd.DataFrame with retails in int or float format
 #           units - list, ndarray, pd.Series or pd.DataFrame with unit sales in int or float format
+#           by - list, ndarray or pd.Series with group keys (e.g. SKU) or tuple of them, correlation is calculated for every group in one pass
 #
 #       Returns:
 #
 #           correlation coefficient as float
+#           correlation coefficients of groups as pd.Series (if any input is pandas object) or tuple of sorted unique keys and ndarray
 #
 #       Samples:
 #
 #           >>> retail_units_corr([1.99, 2.49, 2.99, 3.99], [50, 40, 30, 20])
 #           out: -0.98270762982399062
 #
+#           >>> retail_units_corr([1.99, 2.49, 2.99, 1.99, 2.49, 2.99], [50, 40, 30, 40, 41, 39], by=['a', 'a', 'a', 'b', 'b', 'b'])
+#           out: (array(['a', 'b']), array([-1. , -0.5]))
+#
+#   ---------------------------------------------------------------------------
+#
+#   class CorrStats():
+#
+#       Count, means and centered sums of squares and products of retail and units (Welford), updated chunk by chunk and merged.
+#       Correlation of data larger than memory is calculated with one chunk in memory at a time.
+#
+#       Methods:
+#
+#           update(retail, units) - adds chunk of retails and unit sales
+#           merge(other) - adds statistics of other CorrStats (e.g. calculated for another file or in another process)
+#           corr() - correlation coefficient between price and unit sold
+#
+#       Attributes:
+#
+#           n, retail_mean, units_mean, sxx, syy, sxy
+#
+#       Samples:
+#
+#           >>> CorrStats().update([1.99, 2.49], [50, 40]).update([2.99, 3.99], [30, 20]).corr()
+#           out: -0.9827076298239907
+#
 #   ---------------------------------------------------------------------------
 #
-#   function elast_arc(old_unit, new_unit, old_retail, new_retail):
+#   function elast_arc(old_unit, new_unit, old_retail, new_retail, out=None, dtype=None, threads=None):
 #
 #       Calculates arc price elasticity of demand based on old unit sales, new unit sales, old retail, new retail.
 #
@@ -333,6 +516,10 @@
 #           new_unit - scalar value, list, ndarray, pd.Series or pd.DataFrame with new unit sales in int or float format
 #           old_retail - scalar value, list, ndarray, pd.Series or pd.DataFrame with old (current) retail(s) in int or float format
 #           new_retail - scalar value, list, ndarray, pd.Series or pd.DataFrame with new retail(s) in int or float format
+#           out - ndarray of the result shape to write the result into, can be one of the inputs to calculate in place
+#           dtype - dtype of the result, e.g. np.float32 to halve memory and bandwidth at lower precision (if None then dtype of out or float64)
+#           threads - number of threads calculating blocks of chunks of the result (0 - all CPUs, at most the number of CPUs), numpy releases GIL
+#                     so large inputs use several cores, inputs of less than 4 chunks of 16384 rows per thread use fewer threads
 #
 #       Returns:
 #
@@ -349,7 +536,7 @@
 #
 #   ---------------------------------------------------------------------------
 #
-#   function elast_pt(old_unit, new_unit, old_retail, new_retail):
+#   function elast_pt(old_unit, new_unit, old_retail, new_retail, out=None, dtype=None, threads=None):
 #
 #       Calculates point price elasticity of demand based on old unit sales, new unit sales, old retail, new retail.
 #
@@ -359,6 +546,10 @@
 #           new_unit - scalar value, list, ndarray, pd.Series or pd.DataFrame with new unit sales in int or float format
 #           old_retail - scalar value, list, ndarray, pd.Series or pd.DataFrame with old (current) retail(s) in int or float format
 #           new_retail - scalar value, list, ndarray, pd.Series or pd.DataFrame with new retail(s) in int or float format
+#           out - ndarray of the result shape to write the result into, can be one of the inputs to calculate in place
+#           dtype - dtype of the result, e.g. np.float32 to halve memory and bandwidth at lower precision (if None then dtype of out or float64)
+#           threads - number of threads calculating blocks of chunks of the result (0 - all CPUs, at most the number of CPUs), numpy releases GIL
+#                     so large inputs use several cores, inputs of less than 4 chunks of 16384 rows per thread use fewer threads
 #
 #       Returns:
 #
@@ -413,6 +604,146 @@
 #
 #   ---------------------------------------------------------------------------
 # 
+#   function elast_group(retail, units, keys, segment_begin=0, segment_end=0):
+#
+#       Calculates coefficient and intercept for linear regression model in the segment for every group of long-format data at once.
+#       Every group gets the same statistics as elast, computed from per-group sums in one pass (no sklearn, no loop over groups).
+#
+#       Arguments:
+#
+#           retail - list, ndarray, pd.Series or pd.DataFrame with retails in int or float format
+#           units - list, ndarray, pd.Series or pd.DataFrame with unit sales in int or float format
+#           keys - list, ndarray, pd.Series or pd.DataFrame with group keys (e.g. SKU), length of keys should be equal to the length of retail and units
+#           segment_begin - scalar value or ndarray (one value per group, in the order of sorted keys) with beginning point of price segment (if 0 then min(retail) of the group)
+#           segment_end - scalar value or ndarray (one value per group, in the order of sorted keys) with ending point of price segment (if 0 then max(retail) of the group)
+#
+#       Returns:
+#
+#           tuple of ndarrays with one value per group contains:
+#           - sorted unique group keys
+#           - regression coefficients
+#           - regression intercepts
+#           - R^2 (nan for groups of 1 or 2 observations in the segment, as F-statistics)
+#           - F-statistics
+#           - DW-statistics
+#
+#       Samples:
+#
+#           >>> elast_group([2.49, 2.99, 3.99, 1.99, 2.49, 2.99, 3.49], [40, 30, 20, 52, 41, 30, 22], ['a', 'a', 'a', 'b', 'b', 'b', 'b'])
+#           out: (array(['a', 'b']),
+#                 array([ -12.85714286,  -20.2       ]),
+#                 array([  70.58571429,   91.598     ]),
+#                 array([   0.96428571,    0.99473428]),
+#                 array([  27.        ,  377.81481481]),
+#                 array([   2.92857143,    2.23333333]))
+#
+#   ---------------------------------------------------------------------------
+# 
+#   function elast_breaks(retail, units, breakpoints=1, candidates=100, min_size=5):
+#
+#       Finds retail breakpoints where demand slope changes (e.g. price thresholds) and fits linear regression model in every segment.
+#       Data is sorted by retail once, prefix sums of x, y, x^2, xy, y^2 give residual sum of squares of any segment in O(1),
+#       so all candidates (or all pairs of candidates for 2 breakpoints) are scored at once without refitting.
+#
+#       Arguments:
+#
+#           retail - list, ndarray, pd.Series or pd.DataFrame with retails in int or float format
+#           units - list, ndarray, pd.Series or pd.DataFrame with unit sales in int or float format
+#           breakpoints - 1, 2 or 'auto' (0, 1 or 2 breakpoints, the one with the lowest BIC)
+#           candidates - max number of candidate breakpoints evenly spaced by rows among distinct retails (if None then every distinct retail, 2 breakpoints take candidates^2 memory)
+#           min_size - min number of rows in every segment
+#
+#       Returns:
+#
+#           tuple of ndarrays with one value per segment contains:
+#           - segments as rows of [segment_begin, segment_end] retails (the same as elast takes)
+#           - regression coefficients
+#           - regression intercepts
+#           - R^2
+#           - F-statistics
+#           - DW-statistics
+#
+#       Samples:
+#
+#           >>> elast_breaks([1.99, 2.49, 2.99, 3.49, 3.99, 4.49, 4.99, 5.49], [60, 52, 45, 38, 20, 18, 15, 13], min_size=3)
+#           out: (array([[1.99, 3.49],
+#                        [3.99, 5.49]]),
+#                 array([-14.6      ,  -4.8      ]),
+#                 array([ 88.754    ,  39.252    ]),
+#                 array([  0.99887535,   0.99310345]),
+#                 array([1776.33333333,  288.        ]),
+#                 array([  2.23333333,   3.4       ]))
+#
+#   ---------------------------------------------------------------------------
+# 
+#   class RollingElast():
+#
+#       Sums behind linear regression of units on retail for every SKU (n, sum(x), sum(y), sum(xy), sum(x^2), sum(y^2)), observations are added and dropped in O(1).
+#       Rolling window (e.g. 52 weeks) is kept by adding the new week and dropping the oldest one instead of refitting elast.
+#
+#       Methods:
+#
+#           add(keys, retail, units) - adds observations (e.g. a new week) of SKUs
+#           drop(keys, retail, units) - drops observations (e.g. the oldest week of the window) of SKUs, they should be added before (KeyError otherwise)
+#           fit() - the same tuple of ndarrays as elast_group returns (SKUs in the order they were first added), DW-statistic needs residuals and is nan
+#           save(path) - saves sums of every SKU to .npz file
+#           RollingElast.load(path) - loads sums of every SKU saved by save()
+#
+#       Attributes:
+#
+#           keys - list of SKUs
+#           sums - ndarray with a row of sums for every SKU, values are shifted by the first observation of the SKU
+#           shift - ndarray with the first retail and unit sales of every SKU, subtracted before summing to keep precision at high prices
+#
+#       Samples:
+#
+#           >>> RollingElast().add(['a', 'a', 'a', 'a'], [1.99, 2.49, 2.99, 3.99], [50, 40, 30, 20]).drop(['a'], [1.99], [50]).fit()
+#           out: (array(['a']),
+#                 array([-12.85714286]),
+#                 array([ 70.58571429]),
+#                 array([ 0.96428571]),
+#                 array([ 27.]),
+#                 array([ nan]))
+#
+#   ---------------------------------------------------------------------------
+# 
+#   class PriceSeries(retail, units):
+#
+#       Price history of a SKU prepared for many segment queries: inputs are converted and sorted by retail once, prefix sums of n, x, y, xy, x^2, y^2 are kept.
+#       Every query finds the segment by searchsorted and takes differences of prefix sums in O(log n) instead of masking all observations as elast does.
+#
+#       Arguments:
+#
+#           retail - list, ndarray, pd.Series or pd.DataFrame with retails in int or float format
+#           units - list, ndarray, pd.Series or pd.DataFrame with unit sales in int or float format
+#
+#       Methods (segment_begin and segment_end are scalar values or ndarrays of many segments, 0 means min or max retail as in elast):
+#
+#           elast(segment_begin=0, segment_end=0, durbin_watson=False) - the same tuple as elast returns, DW-statistic needs residuals of the segment in input order and is nan unless durbin_watson
+#           count(segment_begin=0, segment_end=0) - number of observations in the segment
+#           total_units(segment_begin=0, segment_end=0) - unit sales in the segment
+#           avg_retail(segment_begin=0, segment_end=0) - average retail weighted by unit sales in the segment
+#
+#       Attributes:
+#
+#           retail, units - ndarrays sorted by retail
+#           order - ndarray with input positions of sorted observations
+#           sums - ndarray with prefix sums of centered values
+#
+#       Samples:
+#
+#           >>> PriceSeries([2.49, 2.99, 3.99, 1.99, 2.49, 2.99, 3.49], [40, 30, 20, 52, 41, 30, 22]).elast(2.49, 3.99, durbin_watson=True)
+#           out: (-14.487804878048781, 75.02585365853659, 0.9350017489744646, 57.54011741682943, 1.7231158417259336)
+#
+#           >>> PriceSeries([2.49, 2.99, 3.99, 1.99, 2.49, 2.99, 3.49], [40, 30, 20, 52, 41, 30, 22]).elast([0, 2.49], [2.99, 0])
+#           out: (array([-21.85714286, -14.48780488]),
+#                 array([ 95.21      ,  75.02585366]),
+#                 array([  0.99765598,   0.93500175]),
+#                 array([1276.85454545,   57.54011742]),
+#                 array([ nan,  nan]))
+#
+#   ---------------------------------------------------------------------------
+# 
 #   function opt_retail(retail, units, elast_coef, range=0.1):
 #
 #       Calculates opimal (max dollar sales) retails based on current retails, unit sales, elastisity.
@@ -435,7 +766,73 @@
 #
 #   ---------------------------------------------------------------------------
 # 
-#   function breakeven_ret(cost, retail, discount):
+#   function opt_retail_batch(retail, units, elast_coef, range=0.1, chunk_size=1000000):
+#
+#       Calculates opimal retails (max dollar sales) and $ sales at these retails for all SKUs at once based on current retails, unit sales, elastisity.
+#       Retails are the same as opt_retail finds by scanning retails in 0.01 steps, but every SKU is solved in closed form
+#       (linear demand gives $ sales quadratic in retail), so there is no loop over the retail grid.
+#
+#       Arguments:
+#
+#           retail - scalar value, list, ndarray, pd.Series or pd.DataFrame with retails in int or float format
+#           units - scalar value, list, ndarray, pd.Series or pd.DataFrame with unit sales in int or float format
+#           elast_coef - scalar value, list, ndarray, pd.Series or pd.DataFrame with elasticity coefficients in int or float format
+#           range - scalar value, list, ndarray, pd.Series or pd.DataFrame with % range of possible retail change in int or float format
+#           chunk_size - scalar value with the number of SKUs solved together, limits the size of temporary arrays
+#
+#       Returns:
+#
+#           tuple contains:
+#           - ndarray of retails that deliver maximum $ sales in float format
+#           - ndarray of $ sales at these retails in float format
+#
+#       Samples:
+#
+#           >>> opt_retail_batch([2.5, 4.0], [50, 20], [-.5, -2.0], range=0.1)
+#           out: (array([ 2.74,  3.6 ]), array([ 130.424,   86.4  ]))
+#
+#   ---------------------------------------------------------------------------
+#    
+#   function opt_portfolio(retail, cost, units, elast_coef, lower=None, upper=None, range=0.1, min_margin=None, base_retail=None, max_index=None, temp=None, iterations=100):
+#
+#       Calculates retails of all SKUs that deliver max margin dollars of the assortment within price bounds, minimum % margin and max weighted Price Index.
+#       Unit sales follow the linear demand of opt_retail: units * (1 + elast_coef * (new_retail / retail - 1)), so margin dollars of SKU are a parabola
+#       of its retail. Without Price Index constraint every SKU is solved in closed form. Weighted Price Index sum(units * new_retail) / sum(units * base_retail)
+#       couples SKUs, its Lagrange multiplier is found by bisection, so 1M SKUs are solved in about a second.
+#
+#       Arguments:
+#
+#           retail - list, ndarray or pd.Series with current retails in int or float format
+#           cost - scalar value, list, ndarray or pd.Series with costs in int or float format
+#           units - scalar value, list, ndarray or pd.Series with unit sales at current retails in int or float format
+#           elast_coef - scalar value, list, ndarray or pd.Series with elasticity coefficients in int or float format
+#           lower, upper - scalar value, list, ndarray or pd.Series with bounds of retails (if None then retail * (1 - range), retail * (1 + range))
+#           range - scalar value, list, ndarray or pd.Series with % range of possible retail change used for bounds which are not given
+#           min_margin - scalar value, list, ndarray or pd.Series with minimum % margin, raises lower bounds (and upper bounds below them)
+#           base_retail - list, ndarray or pd.Series with base (e.g. competitor) retails of weighted Price Index
+#           max_index - scalar value with max weighted Price Index of new retails versus base_retail, ValueError is raised if it cannot be met within bounds (with retails of temp if given)
+#           temp - smart_round template (e.g. '*.(49,99)'), if given every retail is snapped to the better allowed retail below or above within bounds
+#                  (SKUs without allowed retail within bounds keep the retail), SKUs losing the least margin dollars are snapped down while Price Index is above max_index
+#           iterations - scalar value with max number of bisection steps
+#
+#       Returns:
+#
+#           tuple contains:
+#           - ndarray of retails that deliver max margin dollars of the assortment in float format
+#           - ndarray of margin dollars of every SKU at these retails in float format
+#           - weighted Price Index of these retails versus base_retail (nan if base_retail is not given)
+#
+#       Samples:
+#
+#           >>> opt_portfolio([2.5, 4.0, 3.2], [1.5, 2.6, 1.9], [50, 20, 30], [-1.5, -2.0, -1.2], base_retail=[2.6, 3.9, 3.3], max_index=0.98, min_margin=0.3)
+#           out: (array([ 2.47836066,  3.87403279,  3.31537705]), array([ 49.55316528,  27.08551933,  40.62416367]), 0.9799999999999276)
+#
+#           >>> opt_portfolio([2.5, 4.0, 3.2], [1.5, 2.6, 1.9], [50, 20, 30], [-1.5, -2.0, -1.2], base_retail=[2.6, 3.9, 3.3], max_index=0.98, min_margin=0.3, temp='*.(49,99)')
+#           out: (array([ 2.49,  3.99,  2.99]), array([ 49.797   ,  27.939   ,  35.275125]), 0.9576547231270358)
+#
+#   ---------------------------------------------------------------------------
+# 
+#   function breakeven_ret(cost, retail, discount, out=None, dtype=None, threads=None):
 #
 #       Calculates % break even based on cost, retail and % discount.
 #
@@ -444,6 +841,10 @@
 #           cost - scalar value, list, ndarray, pd.Series or pd.DataFrame with costs in int or float format
 #           retail - scalar value, list, ndarray, pd.Series or pd.DataFrame with retails in int or float format
 #           discount - scalar value, list, ndarray, pd.Series or pd.DataFrame with % discount in int or float format
+#           out - ndarray of the result shape to write the result into, can be one of the inputs to calculate in place
+#           dtype - dtype of the result, e.g. np.float32 to halve memory and bandwidth at lower precision (if None then dtype of out or float64)
+#           threads - number of threads calculating blocks of chunks of the result (0 - all CPUs, at most the number of CPUs), numpy releases GIL
+#                     so large inputs use several cores, inputs of less than 4 chunks of 16384 rows per thread use fewer threads
 #
 #       Returns:
 #
@@ -456,7 +857,7 @@
 #
 #   ---------------------------------------------------------------------------
 #   
-#   function breakeven_mkup(markup, discount):
+#   function breakeven_mkup(markup, discount, out=None, dtype=None, threads=None):
 #
 #       Calculates % break even based on % markup and % discount.
 #
@@ -464,6 +865,10 @@
 #
 #           markup - scalar value, list, ndarray, pd.Series or pd.DataFrame with % markup in int or float format
 #           discount - scalar value, list, ndarray, pd.Series or pd.DataFrame with % discount in int or float format
+#           out - ndarray of the result shape to write the result into, can be one of the inputs to calculate in place
+#           dtype - dtype of the result, e.g. np.float32 to halve memory and bandwidth at lower precision (if None then dtype of out or float64)
+#           threads - number of threads calculating blocks of chunks of the result (0 - all CPUs, at most the number of CPUs), numpy releases GIL
+#                     so large inputs use several cores, inputs of less than 4 chunks of 16384 rows per thread use fewer threads
 #
 #       Returns:
 #
@@ -476,7 +881,7 @@
 #
 #   ---------------------------------------------------------------------------
 #  
-#   function breakeven_mrgn(margin, discount):
+#   function breakeven_mrgn(margin, discount, out=None, dtype=None, threads=None):
 #
 #       Calculates % break even based on % margin and % discount.
 #
@@ -484,6 +889,10 @@
 #
 #           margin - scalar value, list, ndarray, pd.Series or pd.DataFrame with % margin in int or float format
 #           discount - scalar value, list, ndarray, pd.Series or pd.DataFrame with % discount in int or float format
+#           out - ndarray of the result shape to write the result into, can be one of the inputs to calculate in place
+#           dtype - dtype of the result, e.g. np.float32 to halve memory and bandwidth at lower precision (if None then dtype of out or float64)
+#           threads - number of threads calculating blocks of chunks of the result (0 - all CPUs, at most the number of CPUs), numpy releases GIL
+#                     so large inputs use several cores, inputs of less than 4 chunks of 16384 rows per thread use fewer threads
 #
 #       Returns:
 #
@@ -496,280 +905,1457 @@
 #
 #   ---------------------------------------------------------------------------
 #    
-#   function retail_distr(retail, precision=1):
+#   function scenario_grid(formula, skus, scenarios, reduce=None, k=10, dtype=None, max_bytes=64 * 2 ** 20):
 #
-#       Creates and show retails distribution.
+#       Calculates elementwise formula for every SKU (rows) under every scenario of its last argument (columns) in tiles of bounded memory, optionally reduced over SKUs on the fly.
+#       SKU arguments are broadcast against scenarios tile by tile: the same ufunc kernels as out= of the formulas write every tile into the result
+#       (or into scratch tile when reduced), so neither a Python loop over scenarios nor the full matrix of a reduction is needed.
 #
 #       Arguments:
 #
-#           retail - list, ndarray, pd.Series or pd.DataFrame with retails in int or float format
-#           precision - scalar value with the size of bin
+#           formula - elementwise function or its name whose last argument varies by scenario, e.g. breakeven_ret, breakeven_mkup, breakeven_mrgn, newret_change
+#           skus - tuple of the other arguments of formula: scalar values, lists, ndarrays or pd.Series with value of every SKU (e.g. (cost, retail))
+#           scenarios - list or ndarray of values of the last argument (e.g. discounts)
+#           reduce - reduction over SKUs for every scenario: None (full matrix), 'min', 'max', 'mean' (NaN are skipped),
+#                    'smallest' or 'largest' (k SKUs with the smallest or largest values)
+#           k - scalar value with the number of SKUs of 'smallest' and 'largest'
+#           dtype - dtype of calculation, e.g. np.float32 halves memory of tiles and of the full matrix (if None then float64,
+#                   int64 for retails and costs rounded half up in fixed-point mode of enable_cents)
+#           max_bytes - scalar value with memory budget of tiles and temporaries in bytes
 #
 #       Returns:
 #
-#           histogram with prices divided into bins
+#           ndarray of SKUs x scenarios (pd.DataFrame with index of SKUs and scenarios as columns if SKU argument is pd.Series) if reduce is None
+#           ndarray of values for every scenario if reduce is 'min', 'max' or 'mean'
+#           tuple of ndarrays k x scenarios with row numbers of SKUs and their values, the best first, if reduce is 'smallest' or 'largest'
+#
+#       Samples:
+#
+#           >>> scenario_grid('breakeven_ret', ([1.00, 2.50, 0.80], [2.00, 3.99, 1.49]), [0.10, 0.20, 0.30])
+#           out: array([[ 0.25      ,  0.66666667,  1.5       ],
+#                       [ 0.36571952,  1.15317919,  4.08532423],
+#                       [ 0.2754159 ,  0.76020408,  1.83950617]])
+#
+#           >>> scenario_grid('breakeven_ret', ([1.00, 2.50, 0.80], [2.00, 3.99, 1.49]), [0.10, 0.20, 0.30], reduce='smallest', k=2)
+#           out: (array([[0, 0, 0], [2, 2, 2]]), array([[ 0.25      ,  0.66666667,  1.5       ], [ 0.2754159 ,  0.76020408,  1.83950617]]))
 #
 #   ---------------------------------------------------------------------------
 #    
-#   function show_depend(retail, units):
+#   function lazy(formula, *args):
 #
-#       Creates and show price/units dependency scatter.
+#       Builds deferred call of elementwise formula (function or its name) on scalars, arrays or other deferred calls.
+#       Nothing is calculated until evaluate() is called.
 #
 #       Arguments:
 #
-#           retail - list, ndarray, pd.Series or pd.DataFrame with retails in int or float format
-#           units - list, ndarray, pd.Series or pd.DataFrame with units in int or float format
+#           formula - elementwise function (margin, markup, newret_mrgn, newret_mkup, cost_mrgn, cost_mkup, change_newret, newret_change,
+#                     priceindex, elast_arc, elast_pt, breakeven_ret, breakeven_mkup, breakeven_mrgn) or its name
+#           args - arguments of the function: scalar values, lists, ndarrays, pd.Series, pd.DataFrames or deferred calls
 #
 #       Returns:
 #
-#           scatter with retail prices on the x axis and units sold on the y axis
+#           deferred call (Expr)
+#
+#       Samples:
+#
+#           >>> lazy(margin, cost, lazy(newret_change, lazy(newret_mkup, cost, mk), chg))
+#           out: margin(ndarray, newret_change(newret_mkup(ndarray, ndarray), ndarray))
 #
 #   ---------------------------------------------------------------------------
-#   
-#   function smart_round(retail, temp='*.**', align='fair'):
+#    
+#   function evaluate(*exprs, chunk_size=16384):
 #
-#       Smart rounding: number of decimals, ending digits.
+#       Calculates deferred calls of elementwise formulas chunk by chunk, only final results are materialized.
+#       Equal calls on the same inputs are calculated once, all formulas of a chunk run on chunk_size rows that stay in CPU cache,
+#       so memory peak is the size of the results instead of one temporary array per call.
 #
 #       Arguments:
 #
-#           retail - list, ndarray, pd.Series or pd.DataFrame with retails in int or float format
-#           temp - template that describes amount of decimals and ending digits
-#           align - general approach to the alignment in case of ending digits, options available: 'down', 'fair', 'up'
+#           exprs - deferred calls built by lazy()
+#           chunk_size - scalar value with the number of rows calculated together
 #
 #       Returns:
 #
-#           ndarray with rounded retails
+#           result of every deferred call in the container of the input (as elementwise function returns it),
+#           tuple of results if several deferred calls are given
 #
 #       Samples:
 #
-#           >>> smart_round([12.567, 3.421])
-#           out: array([ 12.57,   3.42])
+#           >>> evaluate(lazy(margin, [2.35, 4.36], lazy(newret_mkup, [2.35, 4.36], [1.00, 0.25])))
+#           out: [0.5, 0.19999999999999996]
 #
-#           >>> smart_round([12.456], temp='*.*9')
-#           out: array([ 12.49])
+#           >>> evaluate(lazy(newret_mkup, [2.35, 4.36], [1.00, 0.25]), lazy(newret_mrgn, [2.35, 4.36], [0.50, 0.20]))
+#           out: ([4.7, 5.45], [4.7, 5.45])
 #
-#           >>> smart_round([12.567, 3.40], temp='*.95', align='down')
-#           out: array([ 11.95,   2.95])
+#   ---------------------------------------------------------------------------
+#    
+#   function elast_parallel(retail, units, keys, segment_begin=0, segment_end=0, workers=None, chunk_size=1000):
 #
-#           >>> smart_round([12.567, 3.40], temp='*.95', align='up')
-#           out: array([ 12.95,   3.95])
+#       Calculates coefficient and intercept for linear regression model in the segment for every group in a process pool.
+#       Data is sorted by group key once and placed in shared memory (multiprocessing.shared_memory), so arrays are not pickled;
+#       every worker calculates elast_group for a block of chunk_size whole groups.
+#
+#       Arguments:
+#
+#           retail, units, keys, segment_begin, segment_end - the same as in elast_group
+#           workers - scalar value with the number of worker processes (if None then number of CPUs)
+#           chunk_size - scalar value with the number of groups in a task of a worker
+#
+#       Returns:
+#
+#           the same as elast_group, groups come in the order of sorted unique keys for any number of workers
 #
 #   ---------------------------------------------------------------------------
-
-import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-from sklearn import linear_model
-
-# calculates % margin based on cost and retail
-def margin(cost, retail, units=[]):
-    'Calculates % margin based on cost and retail. Calculares weighted % margin based on cost, retail, unit sales.'
-    if len(units) != 0:
-        if (isinstance(cost, list) and isinstance(retail, list) and isinstance(units, list)):
-            if len(cost) == len (retail) and len(cost) == len(units):
-                t_list_1 = [retail[i] * units[i] for i in range(len(cost))]
-                t_list_2 = [cost[i] * units[i] for i in range(len(cost))]
-                t_list = (sum(t_list_1) - sum(t_list_2)) / sum(t_list_1)
-                return float(t_list)
-            else:
-                print('Cost, retail and units lists should have the same length.')
-        elif (isinstance(cost, pd.core.series.Series) or isinstance(cost, pd.core.frame.DataFrame)) and (isinstance(retail, pd.core.series.Series) or isinstance(retail, pd.core.frame.DataFrame)) and (isinstance(units, pd.core.series.Series) or isinstance(units, pd.core.frame.DataFrame)):
-            t_var = ((units * retail).sum() - (units * cost).sum()) / (units * retail).sum()
-            return float(t_var)
-        elif (isinstance(cost, np.ndarray) and isinstance(retail, np.ndarray) and isinstance(units, np.ndarray)):
-            t_var = ((units * retail).sum() - (units * cost).sum()) / (units * retail).sum()
-            return float(t_var)
-        elif (isinstance(cost,int) or isinstance(cost,float)) and (isinstance(retail,int) or isinstance(retail,float)):
-            t_var = (retail - cost) / retail
-            return float(t_var)
-        else:
-            print('Unsupported data type or combination of data types.')
-    else:
-        if type(cost) == list and type(retail) == list:
-            t_list = [(retail[i] - cost[i]) / retail[i] for i in range(len(cost))]
-            return t_list
-        else:
-            t_var = (retail - cost) / retail
-            return t_var
-
-# calculates % markup based on cost and retail
-def markup(cost, retail, units=[]):
-    'Calculates % markup based on cost and retail. Calculares weighted % markup based on cost, retail, unit sales.'
-    if len(units) != 0:
-        if (isinstance(cost, list) and isinstance(retail, list) and isinstance(units, list)):
-            if len(cost) == len (retail) and len(cost) == len(units):
-                t_list_1 = [retail[i] * units[i] for i in range(len(cost))]
-                t_list_2 = [cost[i] * units[i] for i in range(len(cost))]
-                t_list = (sum(t_list_1) - sum(t_list_2)) / sum(t_list_2)
-                return float(t_list)
-            else:
-                print('Cost, retail and units lists should have the same length.')
-        elif (isinstance(cost, pd.core.series.Series) or isinstance(cost, pd.core.frame.DataFrame)) and (isinstance(retail, pd.core.series.Series) or isinstance(retail, pd.core.frame.DataFrame)) and (isinstance(units, pd.core.series.Series) or isinstance(units, pd.core.frame.DataFrame)):
-            t_var = ((units * retail).sum() - (units * cost).sum()) / (units * cost).sum()
-            return float(t_var)
-        elif (isinstance(cost, np.ndarray) and isinstance(retail, np.ndarray) and isinstance(units, np.ndarray)):
-            t_var = ((units * retail).sum() - (units * cost).sum()) / (units * cost).sum()
-            return float(t_var)
-        elif (isinstance(cost,int) or isinstance(cost,float)) and (isinstance(retail,int) or isinstance(retail,float)):
-            t_var = (retail - cost) / cost
-            return float(t_var)
-        else:
-            print('Unsupported data type or combination of data types.')
-    else:
-        if type(cost) == list and type(retail) == list:
-            t_list = [(retail[i] - cost[i]) / cost[i] for i in range(len(cost))]
-            return t_list
-        else:
-            t_var = (retail - cost) / cost
-            return t_var
-
-# calculates new retail based on target % margin
-def newret_mrgn(cost, margin):
-    'Calculates new retail based on cost and target % margin.'
-    if type(cost) == list and type(margin) == list:
-        t_list = [cost[i] / (1 - margin[i]) for i in range(len(cost))] 
-        return t_list    
-    else:
-        t_var = cost / (1 - margin)
-        return t_var
-    
-# calculates new retail based on cost and target % markup
-def newret_mkup(cost, markup):
-    'Calculates new retail based on cost and target % markup.'
-    if type(cost) == list and type(markup) == list:
-        t_list = [cost[i] * (1 + markup[i]) for i in range(len(cost))] 
-        return t_list  
-    else:
-        t_var = cost * (1 + markup)
-        return t_var
-    
-# Calculates cost based on retail and % margin.
-def cost_mrgn(retail, margin):
-    'Calculates cost based on retail and % margin.'
-    if isinstance(retail, list) and isinstance(margin, list):
-        t_list = [retail[i] * (1 - margin[i]) for i in range(len(retail))] 
-        return t_list   
-    else:
-        t_var = retail * (1 - margin)
-        return t_var
-        
-# Calculates cost based on retail and % markup.
-def cost_mkup(retail, markup):
-    'Calculates cost based on retail and % markup.'
-    if isinstance(retail, list) and isinstance(markup, list):
-        t_list = [retail[i] / (1 + markup[i]) for i in range(len(retail))] 
-        return t_list   
-    else:
-        t_var = retail / (1 + markup)
-        return t_var
-    
-# calculates % change based on current retail and target (new) retail
-def change_newret(old_retail, new_retail):
-    'Calculates retail % change based on current retail and target (new) retail.'
-    if type(old_retail) == list and type(new_retail) == list:
-        t_list = [(new_retail[i] - old_retail[i]) / old_retail[i] for i in range(len(old_retail))]
-        return t_list
-    else:
-        t_var = (new_retail - old_retail) / old_retail
-        return t_var
-    
-# calculates new retail based on current retail and % change
-def newret_change(retail, change):
-    'Calculates new retail based on current retail and % change.'
-    if type(retail) == list and type(change) == list:
-        t_list = [retail[i] * (1 + change[i]) for i in range(len(retail))] 
-        return t_list   
-    else:
-        t_var = retail * (1 + change)
-        return t_var
-
-# calculates price index and weighted price index
-def priceindex(base_retail, retail, units=[]):
-    'Calculates Price Index for retail versus base_retail. Calculates weighted Price Index for retails versus base_retails based on unit sales.'
-    if len(units) != 0:
-        if (isinstance(base_retail, list) and isinstance(retail, list) and isinstance(units, list)):
-            if len(base_retail) == len (retail) and len(base_retail) == len(units):
-                t_list_1 = [retail[i] * units[i] for i in range(len(retail))]
-                t_list_2 = [base_retail[i] * units[i] for i in range(len(base_retail))]
-                t_list = sum(t_list_1) / sum(t_list_2)
-                return float(t_list)
-            else:
-                print('Cost, retail and units lists should have the same length.')
-        elif (isinstance(base_retail, pd.core.series.Series) or isinstance(base_retail, pd.core.frame.DataFrame)) and (isinstance(retail, pd.core.series.Series) or isinstance(retail, pd.core.frame.DataFrame)) and (isinstance(units, pd.core.series.Series) or isinstance(units, pd.core.frame.DataFrame)):
-            t_var = (units * retail).sum() / (units * base_retail).sum()
-            return float(t_var)
-        elif (isinstance(base_retail, np.ndarray) and isinstance(retail, np.ndarray) and isinstance(units, np.ndarray)):
-            t_var = (units * retail).sum() / (units * base_retail).sum()
-            return float(t_var)
-        elif (isinstance(base_retail,int) or isinstance(base_retail,float)) and (isinstance(retail,int) or isinstance(retail,float)):
-            t_var = retail / base_retail
-            return float(t_var)
-        else:
-            print('Unsupported data type or combination of data types.')
-    else:
-        if type(base_retail) == list and type(retail) == list:
-            t_list = [retail[i] / base_retail[i] for i in range(len(retail))]
-            return t_list
-        else:
-            t_var = retail / base_retail
-            return t_var
-    
-# calculates correlation between price and unit sold
-def retail_units_corr(retail, units):
-    'Calculates correlation coefficient between price and unit sold.'
-    t_retail = np.array(retail).flatten()
-    t_units = np.array(units).flatten()
-    return np.corrcoef(t_retail, t_units)[0][1]
-     
-# calculates arc price elasticity of demand based on old volume, new volume, old retail, new retail
-def elast_arc(old_volume, new_volume, old_retail, new_retail):
-    'Calculates arc price elasticity of demand based on old volume, new volume, old retail, new retail.'
-    if type(old_volume) == list and type(new_volume) == list and type(old_retail) == list and type(new_retail) == list:
-        t_list = [((new_volume[i] - old_volume[i]) / (new_retail[i] - old_retail[i])) * (((new_retail[i] + old_retail[i]) / 2) / ((new_volume[i] + old_volume[i]) / 2)) for i in range(len(old_volume))]
-        return t_list
-    else:
-        t_var = ((new_volume - old_volume) / (new_retail - old_retail)) * (((new_retail + old_retail) / 2) / ((new_volume + old_volume) / 2))
-        return t_var      
-
-# calculates point price elasticity of demand based on old volume, new volume, old retail, new retail
-def elast_pt(old_volume, new_volume, old_retail, new_retail):
-    'Calculates point price elasticity of demand based on old volume, new volume, old retail, new retail.'
-    if type(old_volume) == list and type(new_volume) == list and type(old_retail) == list and type(new_retail) == list:
-        t_list = [((new_volume[i] - old_volume[i]) * old_retail[i]) / ((new_retail[i] - old_retail[i]) * old_volume[i]) for i in range(len(old_volume))]
-        return t_list
-    else:
-        t_var = ((new_volume - old_volume) * old_retail) / ((new_retail - old_retail) * old_volume)
-        return t_var
-
-# linear regression in the segment
-def elast(retail, units, segment_begin=0, segment_end=0):
-    'Calculates coefficient and intercept for linear regression model in the segment.'
-
-    def F_test(r_sq, obs_num, param_num):
-        return (r_sq / (1 - r_sq)) * ((obs_num - param_num - 1) / param_num)
-    
-    def Durbin_Watson_stat(t_resid):
-        t_len = t_resid.size
-        t_sum = 0
-        t_et = 0
-        for i in range(t_len):
-            if i > 0: t_sum = t_sum + (t_resid[i] - t_resid[i - 1])**2
-            t_et = t_et + t_resid[i]**2
-        # return test value
-        return t_sum / t_et
-
-    t_retail = np.array(retail)
-    t_units = np.array(units)
-
-    if segment_begin == 0: segment_begin = t_retail.min()
-    if segment_end == 0: segment_end = t_retail.max()
-    
-    t_units = t_units[(t_retail >= segment_begin)&(t_retail <= segment_end)]
+#    
+#   function opt_retail_parallel(retail, units, elast_coef, keys, range=0.1, workers=None, chunk_size=1000):
+#
+#       Calculates opimal retails (max dollar sales) and $ sales at these retails for blocks of groups in a process pool.
+#       Data is placed in shared memory the same way as in elast_parallel, every worker calculates opt_retail_batch for a block of groups.
+#
+#       Arguments:
+#
+#           retail, units, elast_coef, range - the same as in opt_retail_batch
+#           keys - list, ndarray, pd.Series or pd.DataFrame with group keys (e.g. category), length of keys should be equal to the length of retail
+#           workers - scalar value with the number of worker processes (if None then number of CPUs)
+#           chunk_size - scalar value with the number of groups in a task of a worker
+#
+#       Returns:
+#
+#           the same as opt_retail_batch, in the order of input rows
+#
+#   ---------------------------------------------------------------------------
+#    
+#   class WeightedSums():
+#
+#       Running sums behind weighted metrics: sum(units * retail), sum(units * cost), sum(units * base_retail).
+#       Weighted margin, markup and priceindex are calculated from the sums, so data can be added chunk by chunk.
+#
+#       Methods:
+#
+#           update(units, retail=None, cost=None, base_retail=None) - adds chunk of unit sales with retails, costs and base retails (any of them can be skipped)
+#           merge(other) - adds running sums of other WeightedSums (e.g. calculated for another file or in another process)
+#           margin() - weighted % margin
+#           markup() - weighted % markup
+#           priceindex() - weighted Price Index
+#
+#       Attributes:
+#
+#           rows, units, sales (sum(units * retail)), cost (sum(units * cost)), base_sales (sum(units * base_retail))
+#
+#       Samples:
+#
+#           >>> WeightedSums().update([100], [4.70], [2.35]).update([300], [5.45], [4.36]).margin()
+#           out: 0.2669833729216152
+#
+#   ---------------------------------------------------------------------------
+#    
+#   function iter_chunks(path, columns, chunk_size=1000000):
+#
+#       Reads columns of CSV or Parquet file chunk by chunk, yields dict of ndarrays.
+#       CSV files are read with pandas, Parquet files (.parquet, .pq) with pyarrow.
+#
+#       Arguments:
+#
+#           path - path to CSV or Parquet file
+#           columns - list of column names
+#           chunk_size - scalar value with the number of rows in a chunk
+#
+#       Returns:
+#
+#           generator of dicts {column name: ndarray}
+#
+#   ---------------------------------------------------------------------------
+#    
+#   function iter_weighted(path, units='units', retail='retail', cost=None, base_retail=None, chunk_size=1000000):
+#
+#       Calculates running sums behind weighted metrics of CSV or Parquet transaction file chunk by chunk, yields WeightedSums after every chunk.
+#
+#       Arguments:
+#
+#           path - path to CSV or Parquet file
+#           units, retail, cost, base_retail - names of columns with unit sales, retails, costs, base retails (None skips the column)
+#           chunk_size - scalar value with the number of rows in a chunk
+#
+#       Returns:
+#
+#           generator of WeightedSums with intermediate results (the same object updated after every chunk)
+#
+#       Samples:
+#
+#           >>> [i.margin() for i in iter_weighted('transactions.csv', cost='cost', chunk_size=100000)]
+#           out: [0.548769, 0.548492, 0.548937]
+#
+#   ---------------------------------------------------------------------------
+#    
+#   function stream_weighted(path, units='units', retail='retail', cost=None, base_retail=None, chunk_size=1000000):
+#
+#       Calculates running sums behind weighted metrics of CSV or Parquet transaction file holding one chunk in memory at a time.
+#
+#       Arguments:
+#
+#           path - path to CSV or Parquet file
+#           units, retail, cost, base_retail - names of columns with unit sales, retails, costs, base retails (None skips the column)
+#           chunk_size - scalar value with the number of rows in a chunk
+#
+#       Returns:
+#
+#           WeightedSums with final results
+#
+#       Samples:
+#
+#           >>> stream_weighted('transactions.parquet', cost='cost', base_retail='base').margin()
+#           out: 0.5489368340666038
+#
+#   ---------------------------------------------------------------------------
+#    
+#   function write_book(path, columns, group=None):
+#
+#       Writes columns (dict of arrays or pd.DataFrame) into price book file: typed columns and header describing them, rows sorted by group column.
+#       File layout: 8 bytes magic 'PYRETBK1', 8 bytes length of JSON header (rows, dtype and offset of every column, group column with its sorted
+#       keys and first rows), then raw columns aligned to 64 bytes. Strings are stored as fixed width unicode columns.
+#
+#       Arguments:
+#
+#           path - file name of price book
+#           columns - dict of lists, ndarrays or pd.Series of the same length, or pd.DataFrame (object columns are stored as strings and should not have None or NaN,
+#                     datetime64 and timedelta64 columns are stored as int64 with their unit in the header and read back as they were)
+#           group - name of group column (e.g. 'category'), rows are stably sorted by it so every group is a contiguous slice of the file
+#
+#       Returns:
+#
+#           path
+#
+#       Samples:
+#
+#           >>> write_book('prices.pyret', pd.read_csv('prices.csv'), group='category')
+#           out: 'prices.pyret'
+#
+#   ---------------------------------------------------------------------------
+#    
+#   function open_book(path):
+#
+#       Opens price book file written by write_book with np.memmap: nothing is read until columns are used, processes share OS page cache.
+#       Columns are read-only ndarray views of the file, so every pyret function takes them as they are without copying or parsing.
+#
+#       Arguments:
+#
+#           path - file name of price book
+#
+#       Returns:
+#
+#           PriceBook with book[name] (column), book.group(key) (dict of columns of the group), book.columns, book.group_column, book.group_keys, len(book)
+#
+#       Samples:
+#
+#           >>> book = open_book('prices.pyret')
+#           >>> margin(book['cost'], book['retail'], book['units'], by=book['category'])
+#           out: (array(['bakery', 'dairy', 'produce'], dtype='<U7'), array([ 0.57126937,  0.57133138,  0.57107099]))
+#
+#           >>> dairy = book.group('dairy'); elast(dairy['retail'], dairy['units'])
+#
+#   ---------------------------------------------------------------------------
+#    
+#   function serve(host='127.0.0.1', port=8765, path=None, max_delay=0.001, max_batch=4096, limit=2 ** 16):
+#
+#       Runs asyncio pricing server of elementwise formulas over TCP or Unix socket until interrupted, concurrent requests are calculated in vectorized batches.
+#       Protocol is JSON lines: request {"id": 1, "formula": "margin", "args": [2.35, 4.70]}, response {"id": 1, "result": 0.5} or {"id": 1, "error": "..."},
+#       responses of a connection come in the order of its requests. Scalar requests of the same formula from all connections are queued for up to
+#       max_delay seconds (or until max_batch requests) and calculated as one call on ndarrays, so results follow ndarray arithmetic (division by zero
+#       gives nan or inf, sent as null). An error of the batch is the error response of every its request. Requests with lists are calculated at once.
+#       A request line longer than limit gets an error response and closes the connection. BatchServer(max_delay, max_batch, limit).start(host, port, path)
+#       runs the server in a running event loop. bench_pyret.py server measures throughput and latency under load.
+#
+#       Arguments:
+#
+#           host, port - TCP address to listen on
+#           path - Unix socket path to listen on instead of TCP address
+#           max_delay - scalar value with latency budget of batch in seconds
+#           max_batch - scalar value with max number of requests in batch
+#           limit - scalar value with max length of request line in bytes
+#
+#       Samples:
+#
+#           >>> serve(path='/tmp/pyret.sock')
+#           $ echo '{"id": 1, "formula": "newret_mrgn", "args": [2.35, 0.5]}' | nc -U /tmp/pyret.sock
+#           out: {"result": 4.7, "id": 1}
+#
+#   ---------------------------------------------------------------------------
+#    
+#   function enable_cache(max_bytes=256 * 2 ** 20, path=None):
+#
+#       Switches on cache of elast, elast_group and opt_retail_batch results (opt_retail, elast_parallel and opt_retail_parallel use it too), returns FitCache.
+#       Results are keyed by blake2b hash of function name and arguments (bytes, dtype and shape of arrays, values of scalars),
+#       unchanged SKU histories are not refitted. Least recently used results are evicted when max_bytes is exceeded.
+#       With path every result is also saved to the directory, so later processes start with a warm cache (the directory is not limited).
+#
+#       Arguments:
+#
+#           max_bytes - scalar value with memory budget of cached results in bytes
+#           path - directory for cached results (if None then results are kept in memory only)
+#
+#       Returns:
+#
+#           FitCache with attributes hits, misses, nbytes and method clear()
+#
+#       Samples:
+#
+#           >>> cache = enable_cache(path='.pyret_cache')
+#           >>> elast([2.49, 2.99, 3.99], [40, 30, 20]); elast([2.49, 2.99, 3.99], [40, 30, 20]); cache
+#           out: FitCache(items=1, nbytes=144, hits=1, misses=1)
+#
+#   ---------------------------------------------------------------------------
+#    
+#   function disable_cache():
+#
+#       Switches off cache of elast, elast_group and opt_retail_batch results.
+#
+#   ---------------------------------------------------------------------------
+#    
+#   function enable_metrics(buckets=Metrics.BUCKETS):
+#
+#       Switches on call counts, latency histograms and element counts of pyret functions, returns Metrics.
+#       Metrics are kept per function and input type path: container of the input ('scalar', 'small_list' - lists up to 32 values,
+#       'list', 'pyarrow', 'polars', 'ndarray', 'Series', 'DataFrame'), with '/weighted' or '/by' for weighted metrics and groups and '/into'
+#       for out=, dtype=, threads= and cents mode. The path is recorded by the branch the call actually takes (the first one if it takes several),
+#       functions which do not dispatch on containers (elast, opt_retail, smart_round, ...) are recorded by the container of the highest rank
+#       among their array arguments, calls without array arguments are recorded as 'other'.
+#       Public functions of the module are replaced by instrumented ones, disable_metrics restores them, so functions cost nothing
+#       extra while metrics are switched off (call them as pyret.margin(...): names imported with from pyret import ... are not instrumented).
+#       Only the outermost call is recorded: opt_retail calling opt_retail_batch counts as one call of opt_retail.
+#
+#       Arguments:
+#
+#           buckets - list of upper bounds of latency buckets in seconds (1, 2.5, 5 per decade from 1us to 10s by default)
+#
+#       Returns:
+#
+#           Metrics with methods to_dict(), to_prometheus(prefix='pyret') and clear()
+#
+#       Samples:
+#
+#           >>> metrics = enable_metrics()
+#           >>> pyret.margin([1.2, 3.5], [2.99, 4.99]); pyret.margin(np.array([1.2, 3.5]), np.array([2.99, 4.99]), [10, 20]); metrics.to_dict()['margin']['ndarray/weighted']['calls']
+#           out: 1
+#
+#           >>> print(metrics.to_prometheus())
+#           out: # HELP pyret_calls_total Calls of pyret functions.
+#                # TYPE pyret_calls_total counter
+#                pyret_calls_total{function="margin",path="ndarray/weighted"} 1
+#                pyret_calls_total{function="margin",path="small_list"} 1
+#                ...
+#                pyret_call_seconds_bucket{function="margin",path="small_list",le="1e-06"} 0
+#                pyret_call_seconds_bucket{function="margin",path="small_list",le="2.5e-06"} 1
+#                ...
+#
+#   ---------------------------------------------------------------------------
+#    
+#   function disable_metrics():
+#
+#       Switches off metrics of pyret functions, original functions are restored.
+#
+#   ---------------------------------------------------------------------------
+#    
+#   function enable_cents(scale=100):
+#
+#       Switches on fixed-point prices: retails and costs are int64 numbers of 1/scale (cents by default) instead of floats.
+#       newret_mrgn, newret_mkup, cost_mrgn, cost_mkup and newret_change calculate chunks in float and round them half up into int64 results
+#       (ValueError is raised for nan or infinite prices, e.g. margin of 1),
+#       smart_round takes and returns int64 prices and finds ending digits by integer division and modulo without float drift.
+#       % formulas take integer prices as they are, opt_retail, opt_retail_batch and opt_portfolio search retails in whole cents and return int64 retails.
+#
+#       Arguments:
+#
+#           scale - power of 10, number of price units in 1 (100 for cents, 1000 for tenths of cents)
+#
+#       Returns:
+#
+#           scale
+#
+#       Samples:
+#
+#           >>> enable_cents()
+#           >>> newret_mrgn([199, 250], [0.5, 0.2])
+#           out: [398, 313]
+#
+#           >>> smart_round([1257, 342], '*.(49,99)')
+#           out: array([1249,  349])
+#
+#   ---------------------------------------------------------------------------
+#    
+#   function disable_cents():
+#
+#       Switches off fixed-point prices, retails and costs are floats.
+#
+#   ---------------------------------------------------------------------------
+#    
+#   function retail_hist(retail, precision=1):
+#
+#       Calculates histogram of retails: number of cases in every retail price segment of the size precision.
+#       Segments are the bins retail_distr draws, counts are calculated with np.bincount (NaN retails are skipped).
+#
+#       Arguments:
+#
+#           retail - list, ndarray, pd.Series or pd.DataFrame with retails in int or float format
+#           precision - scalar value with the size of bin
+#
+#       Returns:
+#
+#           tuple contains:
+#           - ndarray with number of cases in every bin
+#           - ndarray with edges of bins (one more than bins, the last bin includes its right edge)
+#
+#       Samples:
+#
+#           >>> retail_hist([1.2, 3.4, 2.2, 3.0])
+#           out: (array([1, 1, 2]), array([ 1.,  2.,  3.,  4.]))
+#
+#   ---------------------------------------------------------------------------
+#    
+#   function depend_grid(retail, units, bins=100):
+#
+#       Calculates 2D density grid of retails and units: number of cases in every cell of retail x units grid.
+#       Grid is calculated with np.histogram2d, so its size does not depend on the number of cases (NaN values are skipped).
+#
+#       Arguments:
+#
+#           retail - list, ndarray, pd.Series or pd.DataFrame with retails in int or float format
+#           units - list, ndarray, pd.Series or pd.DataFrame with units in int or float format
+#           bins - scalar value with the number of bins of both axes, pair of them or pair of arrays with edges (as in np.histogram2d)
+#
+#       Returns:
+#
+#           tuple contains:
+#           - ndarray with number of cases in every cell, retails on the first axis
+#           - ndarray with edges of retail bins
+#           - ndarray with edges of units bins
+#
+#       Samples:
+#
+#           >>> depend_grid([2.49, 2.99, 3.99], [40, 30, 20], bins=2)
+#           out: (array([[0, 2], [1, 0]]), array([ 2.49,  3.24,  3.99]), array([ 20.,  30.,  40.]))
+#
+#   ---------------------------------------------------------------------------
+#    
+#   function retail_distr(retail, precision=1, path=None):
+#
+#       Creates and show retails distribution.
+#       Histogram is drawn from retail_hist counts, so the figure holds bins only, not the retails.
+#
+#       Arguments:
+#
+#           retail - list, ndarray, pd.Series or pd.DataFrame with retails in int or float format
+#           precision - scalar value with the size of bin
+#           path - file name (e.g. 'distr.png'), if given the chart is rendered into the file with non-interactive Agg backend instead of being shown
+#
+#       Returns:
+#
+#           histogram with prices divided into bins
+#           path if the chart is rendered into the file
+#
+#   ---------------------------------------------------------------------------
+#    
+#   function show_depend(retail, units, gridsize=50, path=None):
+#
+#       Creates and show price/units dependency scatter.
+#       Above 10000 cases hexbin density is drawn instead, from depend_grid cells (4 times finer than hexagons), not from the cases.
+#
+#       Arguments:
+#
+#           retail - list, ndarray, pd.Series or pd.DataFrame with retails in int or float format
+#           units - list, ndarray, pd.Series or pd.DataFrame with units in int or float format
+#           gridsize - scalar value with the number of hexagons along the x axis of hexbin density
+#           path - file name (e.g. 'depend.png'), if given the chart is rendered into the file with non-interactive Agg backend instead of being shown
+#
+#       Returns:
+#
+#           scatter (hexbin density with log color scale) with retail prices on the x axis and units sold on the y axis
+#           path if the chart is rendered into the file
+#
+#   ---------------------------------------------------------------------------
+#    
+#   function render_charts(retail, keys, path, units=None, precision=1, gridsize=50, format='png'):
+#
+#       Renders retails distribution (price/units dependency if units are given) of every group of long-format data into files with non-interactive backend.
+#       Groups are split by one stable sort, one Agg figure (not attached to pyplot) is reused for all charts, nothing is shown.
+#
+#       Arguments:
+#
+#           retail - list, ndarray or pd.Series with retails of all groups in int or float format
+#           keys - list, ndarray or pd.Series with group key (e.g. category) of every retail
+#           path - directory for charts, file of every group is named after its key (characters other than letters, digits, '.', '-' are replaced with '_'
+#                  and a short hash of the key is added then or if the name is taken by another key, so distinct keys never share a file)
+#           units - list, ndarray or pd.Series with units of every retail in int or float format (if None then retails distribution is rendered)
+#           precision - scalar value with the size of bin of retails distribution
+#           gridsize - scalar value with the number of hexagons along the x axis of hexbin density
+#           format - file format supported by matplotlib: 'png', 'svg', 'pdf'
+#
+#       Returns:
+#
+#           list of file names in the order of sorted unique keys
+#
+#       Samples:
+#
+#           >>> render_charts(df['retail'], df['category'], 'charts')
+#           out: ['charts/bakery.png', 'charts/dairy.png', 'charts/produce.png']
+#
+#   ---------------------------------------------------------------------------
+#   
+#   function smart_round(retail, temp='*.**', align='fair'):
+#
+#       Smart rounding: number of decimals, ending digits.
+#
+#       Arguments:
+#
+#           retail - list, ndarray, pd.Series or pd.DataFrame with retails in int or float format
+#           temp - template that describes amount of decimals and ending digits, '(..)' holds comma separated options of ending digits (e.g. '*.(49,99)')
+#           align - general approach to the alignment in case of ending digits, options available: 'down' (closest allowed retail below), 'fair' (closest allowed retail), 'up' (closest allowed retail above)
+#
+#       Returns:
+#
+#           ndarray with rounded retails (int64 prices if enable_cents is switched on)
+#
+#       Samples:
+#
+#           >>> smart_round([12.567, 3.421])
+#           out: array([ 12.57,   3.42])
+#
+#           >>> smart_round([12.456], temp='*.*9')
+#           out: array([ 12.49])
+#
+#           >>> smart_round([12.567, 3.40], temp='*.95', align='down')
+#           out: array([ 11.95,   2.95])
+#
+#           >>> smart_round([12.567, 3.40], temp='*.95', align='up')
+#           out: array([ 12.95,   3.95])
+#
+#           >>> smart_round([12.41, 12.80], temp='*.(49,99)')
+#           out: array([ 12.49,  12.99])
+#
+#   ---------------------------------------------------------------------------
+
+import bisect
+import collections
+import functools
+import hashlib
+import itertools
+import os
+import pickle
+import re
+import sys
+import threading
+import time
+
+import numpy as np
+
+# matplotlib and sklearn are imported on first use by the functions that need them, pandas is optional
+
+# checks if object is pd.Series or pd.DataFrame without importing pandas (nothing can be a pandas object before pandas is imported)
+def _is_pd(t_obj):
+    'Checks if object is pd.Series or pd.DataFrame.'
+    t_pd = sys.modules.get('pandas')
+    return t_pd is not None and isinstance(t_obj, (t_pd.Series, t_pd.DataFrame))
+
+# checks if object is pyarrow Array or ChunkedArray without importing pyarrow
+def _is_pa(t_obj):
+    'Checks if object is pyarrow Array or ChunkedArray.'
+    t_pa = sys.modules.get('pyarrow')
+    return t_pa is not None and isinstance(t_obj, (t_pa.Array, t_pa.ChunkedArray))
+
+# checks if object is polars Series without importing polars
+def _is_pl(t_obj):
+    'Checks if object is polars Series.'
+    t_pl = sys.modules.get('polars')
+    return t_pl is not None and isinstance(t_obj, t_pl.Series)
+
+# finds chunks of pyarrow ChunkedArray to be calculated one by one instead of concatenating them
+def _pa_chunks(t_obj):
+    'Returns list of (offset, length) of chunks if object is pyarrow ChunkedArray of more than one chunk, otherwise None.'
+    if not _is_pa(t_obj) or not isinstance(t_obj, sys.modules['pyarrow'].ChunkedArray) or t_obj.num_chunks < 2:
+        return None
+    t_lengths = [len(i) for i in t_obj.chunks]
+    return list(zip(itertools.accumulate([0] + t_lengths[:-1]), t_lengths))
+
+# ranks containers of formula arguments: result is returned in the container with the highest rank
+def _container_rank(t_obj):
+    'Ranks container of formula argument: 0 - scalar, 1 - list, tuple, 2 - pyarrow array, polars Series, 3 - ndarray, 4 - pd.Series, 5 - pd.DataFrame.'
+    if type(t_obj) in (float, int) or isinstance(t_obj, np.number): return 0
+    if type(t_obj) in (list, tuple): return 1
+    if isinstance(t_obj, np.ndarray): return 3 if t_obj.ndim > 0 else 0
+    if _is_pd(t_obj): return 5 if t_obj.ndim == 2 else 4
+    if _is_pa(t_obj) or _is_pl(t_obj): return 2
+    return 1
+
+# returns ndarray result of formula in the container of the input
+def _wrap(t_res, t_like):
+    'Returns ndarray result of formula in the container of the input.'
+    if isinstance(t_like, np.ndarray):
+        return t_res
+    if _is_pd(t_like):
+        t_pd = sys.modules['pandas']
+        if t_res.shape[:1] != (len(t_like),):
+            return t_res
+        if t_like.ndim == 2:
+            return t_pd.DataFrame(t_res, index=t_like.index, columns=t_like.columns if t_res.shape[1:] == (t_like.shape[1],) else None)
+        return t_pd.Series(t_res, index=t_like.index, name=t_like.name)
+    if _is_pa(t_like):
+        t_pa = sys.modules['pyarrow']
+        return t_pa.chunked_array([t_res]) if isinstance(t_like, t_pa.ChunkedArray) else t_pa.array(t_res)
+    if _is_pl(t_like):
+        return sys.modules['polars'].Series(t_like.name, t_res) if t_res.shape == (len(t_like),) else t_res
+    if isinstance(t_like, tuple):
+        return tuple(t_res.tolist())
+    return t_res.tolist()
+
+# aligns pandas arguments on their indexes
+def _align_pd(t_args):
+    'Aligns rows of pd.Series and pd.DataFrame arguments on the union of their indexes as pandas arithmetic does, other arguments are kept.'
+    t_pds = [i for i in t_args if _is_pd(i)]
+    if len(t_pds) < 2 or all(i.index.equals(t_pds[0].index) for i in t_pds[1:]):
+        return t_args
+    if not all(i.index.is_unique for i in t_pds):
+        raise ValueError('Pandas arguments with different indexes should have unique labels to be aligned, reset_index() matches them by positions.')
+    t_index = functools.reduce(lambda t_left, t_right: t_left.union(t_right), [i.index for i in t_pds])
+    return tuple(i.reindex(t_index) if _is_pd(i) else i for i in t_args)
+
+# types formulas take as they are: arithmetic of scalars and ndarrays already returns the right container
+_NATIVE_TYPES = frozenset([float, int, np.float64, np.float32, np.int64, np.int32, np.ndarray])
+
+# lists and tuples up to this length are calculated element by element, faster than converting them into ndarrays
+_SMALL_LIST = 32
+
+# converts argument of formula into ndarray
+def _as_array(t_obj):
+    'Converts argument of formula into ndarray, without copying for ndarrays, pd.Series, pd.DataFrames, pyarrow arrays and polars Series of one chunk without nulls.'
+    if type(t_obj) in (list, tuple):
+        try:
+            return np.fromiter(t_obj, dtype=float, count=len(t_obj))
+        except (TypeError, ValueError):
+            return np.asarray(t_obj)
+    if _is_pl(t_obj):
+        return t_obj.to_numpy()
+    return np.asarray(t_obj)
+
+# applies elementwise formula to scalars, lists, tuples, ndarrays, pd.Series, pd.DataFrames or pyarrow arrays
+def _elementwise(t_formula, *t_args):
+    'Applies elementwise formula to scalars, lists, tuples, ndarrays, pd.Series, pd.DataFrames or pyarrow arrays, returns result in the container of the input.'
+    if _NATIVE_TYPES.issuperset(map(type, t_args)):
+        if _METRICS is not None: _tag(t_args)
+        return t_formula(*t_args)
+
+    t_types = set(map(type, t_args))
+    if (t_types == {list} or t_types == {tuple}) and len(t_args[0]) <= _SMALL_LIST and len(set(map(len, t_args))) == 1:
+        if _METRICS is not None: _tag(t_args, 'small_list')
+        t_res = list(map(t_formula, *t_args))
+        return t_res if t_types == {list} else tuple(t_res)
+
+    # pandas arguments with different indexes are aligned by labels, not by positions
+    t_args = _align_pd(t_args)
+    if _METRICS is not None: _tag(t_args)
+    t_like = None
+    t_rank = 0
+    for t_arg in t_args:
+        t_arg_rank = _container_rank(t_arg)
+        if t_arg_rank > t_rank:
+            t_like, t_rank = t_arg, t_arg_rank
+
+    if t_like is None:
+        return t_formula(*t_args)
+
+    t_chunks = _pa_chunks(t_like) if t_rank == 2 else None
+    if t_chunks is not None:
+        return _elementwise_chunked(t_formula, t_args, t_like, t_chunks)
+
+    t_arrays = [_as_array(i) for i in t_args]
+    if t_rank == 5:
+        # 1-D arguments are applied to every column of pd.DataFrame
+        t_arrays = [i.reshape(-1, 1) if i.ndim == 1 else i for i in t_arrays]
+
+    return _wrap(t_formula(*t_arrays), t_like)
+
+# applies elementwise formula to every chunk of pyarrow ChunkedArray
+def _elementwise_chunked(t_formula, t_args, t_like, t_chunks):
+    'Applies elementwise formula chunk by chunk of pyarrow ChunkedArray viewing chunks of pyarrow arguments without copying, result keeps the chunks.'
+    t_pa = sys.modules['pyarrow']
+    t_arrays = [i if _is_pa(i) or _container_rank(i) == 0 else _as_array(i) for i in t_args]
+    if any(not _is_pa(i) and np.ndim(i) > 0 and np.shape(i) != (len(t_like),) or _is_pa(i) and len(i) != len(t_like) for i in t_arrays):
+        # arguments which do not match chunks get broadcasting error of ndarrays
+        return _wrap(t_formula(*[_as_array(i) for i in t_args]), t_like)
+    t_res = []
+    for t_offset, t_length in t_chunks:
+        t_values = [_as_array(i.slice(t_offset, t_length)) if _is_pa(i) else i if np.ndim(i) == 0 else i[t_offset:t_offset + t_length] for i in t_arrays]
+        t_res.append(t_pa.array(t_formula(*t_values)))
+    return t_pa.chunked_array(t_res)
+
+# calculates sums of units * values for weighted metrics
+def _weighted_sums(units, *values):
+    'Calculates sums of units * values for weighted metrics, e.g. sum(units * retail), pyarrow ChunkedArrays are summed chunk by chunk.'
+    if _METRICS is not None: _tag(values + (units,), t_suffix='/weighted')
+    if _is_pd(units) or any(_is_pd(i) for i in values):
+        # pandas objects are aligned by labels and NaN products are skipped as pd.Series.sum() does
+        units, *values = _align_pd((units,) + values)
+        t_units = _as_array(units).ravel()
+        t_sums = []
+        for t_values in values:
+            t_values = _as_array(t_values).ravel()
+            if t_values.size != t_units.size:
+                raise ValueError('Values and units should have the same length.')
+            t_sums.append(float(np.nansum(t_units * t_values)))
+        return t_sums
+    t_chunks = _pa_chunks(units)
+    if t_chunks is None:
+        t_chunks = [(0, None)]
+        t_units = _as_array(units).ravel()
+    else:
+        t_units = units
+    t_sums = []
+    for t_values in values:
+        t_values = t_values if _is_pa(t_values) else _as_array(t_values).ravel()
+        if len(t_values) != len(t_units):
+            raise ValueError('Values and units should have the same length.')
+        t_sum = 0.0
+        for t_offset, t_length in t_chunks:
+            if t_length is None:
+                t_sum += float(np.dot(t_units, _as_array(t_values).ravel()))
+            else:
+                t_sum += float(np.dot(_as_array(t_units.slice(t_offset, t_length)), _as_array(t_values.slice(t_offset, t_length)) if _is_pa(t_values) else t_values[t_offset:t_offset + t_length]))
+        t_sums.append(t_sum)
+    return t_sums
+
+# factorizes group keys
+def _group_codes(by):
+    'Factorizes array of group keys or tuple of arrays of group keys, returns sorted unique keys and group code of every row.'
+    if isinstance(by, tuple):
+        t_uniques, t_codes = zip(*[np.unique(np.asarray(i).ravel(), return_inverse=True) for i in by])
+        t_dims = [i.size for i in t_uniques]
+        t_groups, t_group = np.unique(np.ravel_multi_index(t_codes, t_dims), return_inverse=True)
+        return tuple(t_unique[t_code] for t_unique, t_code in zip(t_uniques, np.unravel_index(t_groups, t_dims))), t_group
+    return np.unique(np.asarray(by).ravel(), return_inverse=True)
+
+# calculates sums of units * values for every group of weighted metrics
+def _weighted_sums_by(by, units, *values):
+    'Calculates sums of units * values for every group of weighted metrics, units are 1 if not given.'
+    if _METRICS is not None: _tag(values + (units,), t_suffix='/by')
+    t_groups, t_group = _group_codes(by)
+    t_n_groups = len(t_groups[0]) if isinstance(t_groups, tuple) else t_groups.size
+    t_units = np.asarray(units, dtype=float).ravel() if len(units) != 0 else None
+    t_sums = []
+    for t_values in values:
+        t_values = np.asarray(t_values, dtype=float).ravel()
+        if t_values.size != t_group.size or t_units is not None and t_units.size != t_group.size:
+            raise ValueError('Values, units and group keys should have the same length.')
+        t_sums.append(np.bincount(t_group, weights=t_values if t_units is None else t_units * t_values, minlength=t_n_groups))
+    return t_groups, t_sums
+
+# returns weighted metric of every group as pd.Series if input is pandas object, otherwise as tuple of keys and values
+def _wrap_groups(t_groups, t_res, t_name, *t_args):
+    'Returns weighted metric of every group as pd.Series if any input is pandas object, otherwise as tuple of sorted unique keys and ndarray of values.'
+    # group keys (the last argument) can be a tuple of arrays
+    t_by = t_args[-1] if isinstance(t_args[-1], tuple) else (t_args[-1],)
+    if any(_is_pd(i) for i in t_args[:-1] + t_by):
+        t_pd = sys.modules['pandas']
+        t_names = [getattr(i, 'name', None) for i in t_by]
+        t_index = t_pd.MultiIndex.from_arrays(t_groups, names=t_names) if isinstance(t_groups, tuple) else t_pd.Index(t_groups, name=t_names[0])
+        return t_pd.Series(t_res, index=t_index, name=t_name)
+    return t_groups, t_res
+
+# LRU cache of fit results keyed by content hash of inputs
+class FitCache:
+    'LRU cache of elast, elast_group and opt_retail_batch results keyed by content hash of inputs, limited by memory budget and optionally persisted to a directory.'
+
+    def __init__(self, max_bytes=256 * 2 ** 20, path=None):
+        self.max_bytes = max_bytes
+        self.path = path
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = collections.OrderedDict()
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    def __repr__(self):
+        return 'FitCache(items=%d, nbytes=%d, hits=%d, misses=%d)' % (len(self._items), self.nbytes, self.hits, self.misses)
+
+    def key(self, name, args, kwargs):
+        'Calculates content hash of function name and arguments: bytes, dtype and shape of arrays, values of scalars.'
+        t_hash = hashlib.blake2b(name.encode(), digest_size=16)
+
+        def update(t_arg):
+            if _container_rank(t_arg) == 0 and not isinstance(t_arg, np.ndarray):
+                t_hash.update(repr(t_arg).encode())
+                return
+            t_array = np.ascontiguousarray(np.asarray(t_arg))
+            t_hash.update(('%s%s' % (t_array.dtype.str, t_array.shape)).encode())
+            t_hash.update(t_array.view(np.uint8).ravel() if t_array.dtype != object else pickle.dumps(t_array.tolist()))
+
+        for t_arg in args:
+            update(t_arg)
+        for t_name in sorted(kwargs):
+            t_hash.update(t_name.encode())
+            update(kwargs[t_name])
+        return t_hash.hexdigest()
+
+    def get(self, key):
+        'Returns cached result (arrays are copies) or None, looks into the directory if result is not in memory.'
+        if key in self._items:
+            self._items.move_to_end(key)
+            t_res = self._items[key][0]
+        elif self.path is not None and os.path.exists(os.path.join(self.path, key + '.pkl')):
+            with open(os.path.join(self.path, key + '.pkl'), 'rb') as t_file:
+                t_res = pickle.load(t_file)
+            self._store(key, t_res)
+        else:
+            return None
+        return tuple(np.array(i) if isinstance(i, np.ndarray) else i for i in t_res) if isinstance(t_res, tuple) else np.array(t_res)
+
+    def put(self, key, result):
+        'Stores copy of result in memory and in the directory.'
+        t_res = tuple(np.array(i) if isinstance(i, np.ndarray) else i for i in result) if isinstance(result, tuple) else np.array(result)
+        self._store(key, t_res)
+        if self.path is not None:
+            import tempfile
+
+            # every writer (e.g. forked workers of the same key) has its own temporary file, the complete file replaces the result at once
+            with tempfile.NamedTemporaryFile(dir=self.path, prefix=key, suffix='.tmp', delete=False) as t_file:
+                try:
+                    pickle.dump(t_res, t_file, protocol=pickle.HIGHEST_PROTOCOL)
+                except BaseException:
+                    t_file.close()
+                    os.remove(t_file.name)
+                    raise
+            os.replace(t_file.name, os.path.join(self.path, key + '.pkl'))
+
+    def _store(self, key, t_res):
+        'Stores result in memory, evicts least recently used results above memory budget.'
+        t_nbytes = sum(i.nbytes if isinstance(i, np.ndarray) else sys.getsizeof(i) for i in (t_res if isinstance(t_res, tuple) else (t_res,)))
+        if key in self._items:
+            self.nbytes -= self._items.pop(key)[1]
+        self._items[key] = (t_res, t_nbytes)
+        self.nbytes += t_nbytes
+        while self.nbytes > self.max_bytes and self._items:
+            self.nbytes -= self._items.popitem(last=False)[1][1]
+
+    def call(self, func, args, kwargs, signature=None):
+        'Returns cached result of function or calculates and stores it, signature of function is found if not given.'
+        if signature is None:
+            import inspect
+
+            signature = inspect.signature(func)
+
+        # arguments are bound to parameter names, so positional and keyword calls (and defaults given explicitly) share one key,
+        # arguments changing only how the result is calculated are not part of it
+        t_bound = signature.bind(*args, **kwargs)
+        t_bound.apply_defaults()
+        t_arguments = {i: t_bound.arguments[i] for i in t_bound.arguments if i not in _EXECUTION_ARGS}
+        # fixed-point mode changes results of the same arguments
+        t_key = self.key(func.__name__ if _CENTS is None else '%s/%d' % (func.__name__, _CENTS), (), t_arguments)
+        t_res = self.get(t_key)
+        if t_res is not None:
+            self.hits += 1
+            return t_res
+        self.misses += 1
+        t_res = func(*args, **kwargs)
+        self.put(t_key, t_res)
+        return t_res
+
+    def clear(self):
+        'Removes results from memory (files in the directory are kept).'
+        self._items.clear()
+        self.nbytes = 0
+
+# cache used by elast, elast_group and opt_retail_batch, None if switched off
+_CACHE = None
+
+# switches on cache of fit results
+def enable_cache(max_bytes=256 * 2 ** 20, path=None):
+    'Switches on cache of elast, elast_group and opt_retail_batch results, returns FitCache.'
+    global _CACHE
+    _CACHE = FitCache(max_bytes, path)
+    return _CACHE
+
+# switches off cache of fit results
+def disable_cache():
+    'Switches off cache of elast, elast_group and opt_retail_batch results.'
+    global _CACHE
+    _CACHE = None
+
+# arguments of cached functions which do not change their results
+_EXECUTION_ARGS = frozenset(['chunk_size'])
+
+# makes function use cache of fit results when it is switched on
+def _memoized(t_func):
+    'Makes function use cache of fit results when it is switched on, signature of function is found once on the first cached call.'
+    t_signature = []
+
+    @functools.wraps(t_func)
+    def t_wrapper(*args, **kwargs):
+        if _CACHE is None:
+            return t_func(*args, **kwargs)
+        if not t_signature:
+            import inspect
+
+            t_signature.append(inspect.signature(t_func))
+        return _CACHE.call(t_func, args, kwargs, t_signature[0])
+    return t_wrapper
+
+# names of input type paths by container rank
+_PATH_NAMES = ('scalar', 'list', 'pyarrow', 'ndarray', 'Series', 'DataFrame')
+
+# functions instrumented by enable_metrics
+_INSTRUMENTED = ['margin', 'markup', 'newret_mrgn', 'newret_mkup', 'cost_mrgn', 'cost_mkup', 'change_newret', 'newret_change', 'priceindex',
+                 'retail_units_corr', 'elast_arc', 'elast_pt', 'elast', 'elast_group', 'elast_breaks', 'opt_retail', 'opt_retail_batch', 'opt_portfolio',
+                 'breakeven_ret', 'breakeven_mkup', 'breakeven_mrgn', 'scenario_grid', 'evaluate', 'elast_parallel', 'opt_retail_parallel',
+                 'stream_weighted', 'retail_hist', 'depend_grid', 'retail_distr', 'show_depend', 'render_charts', 'smart_round']
+
+# call counts, latency histograms and element counts of instrumented functions
+class Metrics:
+    'Call counts, errors, latency histograms and element counts of pyret functions per function and input type path.'
+
+    # upper bounds of latency buckets in seconds: 1, 2.5, 5 per decade from 1us to 10s
+    BUCKETS = tuple(float('%ge%d' % (m, e)) for e in range(-6, 1) for m in (1, 2.5, 5)) + (10.0,)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return 'Metrics(functions=%d, calls=%d)' % (len(set(i[0] for i in self._series)), sum(i[0] for i in self._series.values()))
+
+    def observe(self, function, path, seconds, elements=0, error=False):
+        'Records one call of function with input type path, its latency in seconds and the number of input elements.'
+        t_bucket = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            t_series = self._series.get((function, path))
+            if t_series is None:
+                t_series = self._series[(function, path)] = [0, 0, 0.0, 0, [0] * (len(self.buckets) + 1)]
+            t_series[0] += 1
+            t_series[1] += error
+            t_series[2] += seconds
+            t_series[3] += elements
+            t_series[4][t_bucket] += 1
+
+    def to_dict(self):
+        'Returns metrics as dict: function -> path -> calls, errors, seconds, elements and histogram (upper bound -> calls in the bucket).'
+        t_res = {}
+        with self._lock:
+            for (t_function, t_path), (t_calls, t_errors, t_seconds, t_elements, t_counts) in sorted(self._series.items()):
+                t_res.setdefault(t_function, {})[t_path] = {'calls': t_calls, 'errors': t_errors, 'seconds': t_seconds, 'elements': t_elements,
+                                                            'histogram': dict(zip(self.buckets + (float('inf'),), t_counts))}
+        return t_res
+
+    def to_prometheus(self, prefix='pyret'):
+        'Returns metrics in Prometheus text exposition format.'
+        t_dict = self.to_dict()
+        t_series = [('{function="%s",path="%s"' % (t_function, t_path), t_metrics) for t_function in t_dict for t_path, t_metrics in t_dict[t_function].items()]
+        t_lines = []
+        for t_name, t_key, t_help in (('calls_total', 'calls', 'Calls of pyret functions.'), ('errors_total', 'errors', 'Calls of pyret functions that raised an exception.'),
+                                      ('elements_total', 'elements', 'Input elements processed by pyret functions.')):
+            t_lines += ['# HELP %s_%s %s' % (prefix, t_name, t_help), '# TYPE %s_%s counter' % (prefix, t_name)]
+            t_lines += ['%s_%s%s} %d' % (prefix, t_name, t_labels, t_metrics[t_key]) for t_labels, t_metrics in t_series]
+        t_lines += ['# HELP %s_call_seconds Latency of pyret functions.' % prefix, '# TYPE %s_call_seconds histogram' % prefix]
+        for t_labels, t_metrics in t_series:
+            t_total = 0
+            for t_bound, t_count in t_metrics['histogram'].items():
+                t_total += t_count
+                t_lines.append('%s_call_seconds_bucket%s,le="%s"} %d' % (prefix, t_labels, '+Inf' if t_bound == float('inf') else repr(t_bound), t_total))
+            t_lines.append('%s_call_seconds_sum%s} %r' % (prefix, t_labels, t_metrics['seconds']))
+            t_lines.append('%s_call_seconds_count%s} %d' % (prefix, t_labels, t_metrics['calls']))
+        return '\n'.join(t_lines) + '\n'
+
+    def clear(self):
+        'Removes all recorded metrics.'
+        with self._lock:
+            self._series.clear()
+
+# metrics recorded by instrumented functions, None if switched off
+_METRICS = None
+
+# original functions replaced by instrumented ones while metrics are switched on
+_ORIGINALS = {}
+
+# input type path and number of input elements of the outermost instrumented call of every thread (path is '' outside of calls)
+_DISPATCH = threading.local()
+
+# records input type path of the branch taken by the call
+def _tag(t_args, t_path=None, t_suffix=''):
+    'Records input type path of the branch taken by the outermost instrumented call (container of the highest rank unless t_path is given) and the number of input elements, the first branch reached is kept.'
+    if getattr(_DISPATCH, 'path', '') is not None:
+        return
+    t_like = max(t_args, key=_container_rank, default=0)
+    t_rank = _container_rank(t_like)
+    _DISPATCH.elements = 1 if t_rank == 0 else np.size(t_like) if t_rank > 2 else len(t_like)
+    _DISPATCH.path = (t_path or ('polars' if _is_pl(t_like) else _PATH_NAMES[t_rank])) + t_suffix
+
+# wraps function to record its calls into metrics
+def _instrument(t_name, t_func):
+    'Wraps function to record its calls, latency, input type path and number of input elements into metrics.'
+    @functools.wraps(t_func)
+    def t_wrapper(*args, **kwargs):
+        # calls made by other instrumented functions (e.g. opt_retail calls opt_retail_batch) are counted only in the outermost one
+        if getattr(_DISPATCH, 'path', '') != '':
+            return t_func(*args, **kwargs)
+        _DISPATCH.path = None
+        _DISPATCH.elements = 0
+        t_start = time.perf_counter()
+        t_error = True
+        try:
+            t_res = t_func(*args, **kwargs)
+            t_error = False
+            return t_res
+        finally:
+            t_seconds = time.perf_counter() - t_start
+            if _DISPATCH.path is None:
+                # functions which do not dispatch on containers (elast, opt_retail, smart_round, ...) are tagged by their array inputs
+                t_args = [i for i in itertools.chain(args, kwargs.values()) if isinstance(i, (int, float, list, tuple, np.ndarray, np.number)) or _is_pd(i) or _is_pa(i) or _is_pl(i)]
+                if t_args:
+                    _tag(t_args)
+            t_path = _DISPATCH.path
+            _DISPATCH.path = ''
+            t_metrics = _METRICS
+            if t_metrics is not None:
+                t_metrics.observe(t_name, t_path or 'other', t_seconds, _DISPATCH.elements, t_error)
+    return t_wrapper
+
+# switches on metrics of pyret functions
+def enable_metrics(buckets=Metrics.BUCKETS):
+    'Switches on call counts, latency histograms and element counts of pyret functions, returns Metrics.'
+    global _METRICS
+    _METRICS = Metrics(buckets)
+    for t_name in _INSTRUMENTED:
+        if t_name not in _ORIGINALS:
+            _ORIGINALS[t_name] = globals()[t_name]
+            globals()[t_name] = _instrument(t_name, _ORIGINALS[t_name])
+    return _METRICS
+
+# switches off metrics of pyret functions
+def disable_metrics():
+    'Switches off metrics of pyret functions, original functions are restored.'
+    global _METRICS
+    _METRICS = None
+    for t_name in list(_ORIGINALS):
+        globals()[t_name] = _ORIGINALS.pop(t_name)
+
+# fixed-point scale of prices (e.g. 100 for int64 cents), None if prices are floats
+_CENTS = None
+
+# formulas calculating retails or costs, rounded to int64 in fixed-point mode
+_PRICE_FORMULAS = frozenset(['newret_mrgn', 'newret_mkup', 'cost_mrgn', 'cost_mkup', 'newret_change'])
+
+# rounds result of formula in fixed-point mode
+def _round_cents(t_name, t_res):
+    'Rounds retails or costs calculated by formula half up to int64 in fixed-point mode, other results are returned as they are.'
+    if _CENTS is None or t_name not in _PRICE_FORMULAS:
+        return t_res
+    t_res = np.floor(np.add(t_res, 0.5))
+    _check_cents(t_name, t_res)
+    return t_res.astype(np.int64)
+
+# checks that rounded retails or costs fit into int64
+def _check_cents(t_name, t_res):
+    'Raises ValueError if retails or costs calculated by formula are nan or infinite, they have no int64 price.'
+    if not np.all(np.isfinite(t_res)):
+        raise ValueError('%s gives nan or infinite prices (e.g. margin of 1 or zero retail), they cannot be fixed-point prices.' % t_name)
+
+# switches on fixed-point prices
+def enable_cents(scale=100):
+    'Switches on fixed-point prices: retails and costs are int64 numbers of 1/scale (cents), calculated retails and costs are rounded to int64, smart_round works in integers.'
+    global _CENTS
+    if not isinstance(scale, (int, np.integer)) or scale < 1 or 10 ** (len(str(int(scale))) - 1) != scale:
+        raise ValueError('Scale should be a power of 10 (e.g. 100 for cents), got %r.' % (scale,))
+    _CENTS = int(scale)
+    return _CENTS
+
+# switches off fixed-point prices
+def disable_cents():
+    'Switches off fixed-point prices, retails and costs are floats.'
+    global _CENTS
+    _CENTS = None
+
+# elementwise formulas, the same for scalars and ndarrays
+_FORMULAS = {
+    'margin': lambda cost, retail: (retail - cost) / retail,
+    'markup': lambda cost, retail: (retail - cost) / cost,
+    'newret_mrgn': lambda cost, margin: cost / (1 - margin),
+    'newret_mkup': lambda cost, markup: cost * (1 + markup),
+    'cost_mrgn': lambda retail, margin: retail * (1 - margin),
+    'cost_mkup': lambda retail, markup: retail / (1 + markup),
+    'change_newret': lambda old_retail, new_retail: (new_retail - old_retail) / old_retail,
+    'newret_change': lambda retail, change: retail * (1 + change),
+    'priceindex': lambda base_retail, retail: retail / base_retail,
+    'elast_arc': lambda old_volume, new_volume, old_retail, new_retail: ((new_volume - old_volume) / (new_retail - old_retail)) * (((new_retail + old_retail) / 2) / ((new_volume + old_volume) / 2)),
+    'elast_pt': lambda old_volume, new_volume, old_retail, new_retail: ((new_volume - old_volume) * old_retail) / ((new_retail - old_retail) * old_volume),
+    'breakeven_ret': lambda cost, retail, discount: (retail - cost) / (retail * (1 - discount) - cost) - 1,
+    'breakeven_mkup': lambda markup, discount: markup / ((1 + markup) * (1 - discount) - 1),
+    'breakeven_mrgn': lambda margin, discount: 1 / (1 - discount / margin) - 1,
+}
+
+# symbolic argument of elementwise formula, arithmetic on it records ufunc calls of the formula
+class _Traced:
+    'Node of expression tree of elementwise formula: ufunc with tuple of two operands, or None with position of formula argument.'
+    __slots__ = ('ufunc', 'args')
+
+    def __init__(self, ufunc, args):
+        self.ufunc = ufunc
+        self.args = args
+
+    def _op(t_ufunc, t_reflected=False):
+        return lambda self, other: _Traced(t_ufunc, (other, self) if t_reflected else (self, other))
+
+    __add__, __radd__ = _op(np.add), _op(np.add, True)
+    __sub__, __rsub__ = _op(np.subtract), _op(np.subtract, True)
+    __mul__, __rmul__ = _op(np.multiply), _op(np.multiply, True)
+    __truediv__, __rtruediv__ = _op(np.divide), _op(np.divide, True)
+    del _op
+
+# builds ufunc kernel writing into out from elementwise formula
+def _kernel(t_formula):
+    'Builds kernel (o, t, u, *args) of elementwise formula: the same ufuncs in the same order as the formula, written into o with t and u as scratch arrays.'
+    t_steps = []
+
+    # operand of a step: ('arg', position), ('buf', index) or ('const', value)
+    def compile_node(t_node, t_buf):
+        if not isinstance(t_node, _Traced):
+            return ('const', t_node)
+        if t_node.ufunc is None:
+            return ('arg', t_node.args)
+        t_left, t_right = t_node.args
+        t_left_leaf = not isinstance(t_left, _Traced) or t_left.ufunc is None
+        t_right_leaf = not isinstance(t_right, _Traced) or t_right.ufunc is None
+        if t_left_leaf:
+            t_operands = (compile_node(t_left, t_buf), compile_node(t_right, t_buf))
+        else:
+            # the right subtree is calculated into the next buffer while the left one is kept in t_buf
+            t_operands = (compile_node(t_left, t_buf), compile_node(t_right, t_buf if t_right_leaf else t_buf + 1))
+        if t_buf > 2:
+            raise ValueError('Formula needs more than 3 buffers.')
+        t_steps.append((t_node.ufunc, t_operands, t_buf))
+        return ('buf', t_buf)
+
+    t_count = t_formula.__code__.co_argcount
+    t_result = compile_node(t_formula(*[_Traced(None, i) for i in range(t_count)]), 0)
+    if t_result[0] != 'buf':
+        raise ValueError('Formula should calculate at least one operation.')
+
+    # steps are written as source of the kernel, it runs as fast as ufunc calls written by hand
+    t_names = {'arg': ['a%d' % i for i in range(t_count)], 'buf': ['o', 't', 'u']}
+    t_source = 'def kernel(o, t, u, %s):\n' % ', '.join(t_names['arg'])
+    for t_ufunc, t_operands, t_buf in t_steps:
+        t_source += '    np.%s(%s, out=%s)\n' % (t_ufunc.__name__, ', '.join(repr(t_value) if t_kind == 'const' else t_names[t_kind][t_value] for t_kind, t_value in t_operands), t_names['buf'][t_buf])
+    t_namespace = {'np': np}
+    exec(t_source + '    return o\n', t_namespace)
+    return t_namespace['kernel']
+
+# elementwise formulas writing into out with ufuncs, t and u are scratch arrays of the same shape, built from _FORMULAS
+_KERNELS = {t_name: _kernel(t_formula) for t_name, t_formula in _FORMULAS.items()}
+
+# rows of the result calculated at once by _elementwise_into
+_INTO_CHUNK_SIZE = 16384
+
+# fewer chunks per thread are calculated in the calling thread: handing them over costs more than it saves
+_THREAD_MIN_CHUNKS = 4
+
+# thread pool of _elementwise_into with a thread for every CPU, created once on first use
+_THREAD_POOL = None
+_THREAD_POOL_LOCK = threading.Lock()
+
+# returns shared thread pool
+def _thread_pool():
+    'Returns shared thread pool with a thread for every CPU, numpy ufuncs release GIL so chunks are calculated in parallel.'
+    global _THREAD_POOL
+    with _THREAD_POOL_LOCK:
+        if _THREAD_POOL is None:
+            import concurrent.futures
+
+            _THREAD_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix='pyret')
+    return _THREAD_POOL
+
+# applies elementwise formula chunk by chunk writing into preallocated result
+def _elementwise_into(t_name, t_args, out=None, dtype=None, threads=None):
+    'Applies elementwise formula chunk by chunk writing into out or new ndarray of dtype, temporaries are limited to a few chunks per thread.'
+    t_args = _align_pd(t_args)
+    if _METRICS is not None: _tag(t_args, t_suffix='/into')
+    t_like = None
+    t_rank = 0
+    for t_arg in t_args:
+        t_arg_rank = _container_rank(t_arg)
+        if t_arg_rank > t_rank:
+            t_like, t_rank = t_arg, t_arg_rank
+
+    t_arrays = [_as_array(i) for i in t_args]
+    if t_rank == 5:
+        # 1-D arguments are applied to every column of pd.DataFrame
+        t_arrays = [i.reshape(-1, 1) if i.ndim == 1 else i for i in t_arrays]
+    t_shape = np.broadcast_shapes(*[i.shape for i in t_arrays])
+
+    # in fixed-point mode retails and costs are calculated in float chunks and rounded half up into int64
+    t_round = _CENTS is not None and t_name in _PRICE_FORMULAS
+    if out is None:
+        t_res = np.empty(t_shape, dtype=(np.int64 if t_round else float) if dtype is None else dtype)
+    elif not isinstance(out, np.ndarray) or out.shape != t_shape:
+        raise ValueError('out should be ndarray of shape %s.' % (t_shape,))
+    elif dtype is not None and np.dtype(dtype) != out.dtype:
+        raise ValueError('dtype should be the same as dtype of out.')
+    else:
+        t_res = out
+    if threads is not None and int(threads) < 0:
+        raise ValueError('threads should be 0 (all CPUs) or a positive number.')
+
+    # the result overwriting one of the inputs row for row is calculated into scratch array first, every chunk is read before it is written,
+    # the result overlapping an input otherwise (e.g. a shifted view of the same buffer) is calculated into a temporary array copied into out
+    t_overlaps = [i for i in t_arrays if np.may_share_memory(t_res, i)]
+    t_inplace = len(t_overlaps) > 0
+    t_out = t_res
+    if any(i.__array_interface__['data'][0] != t_res.__array_interface__['data'][0] or i.dtype != t_res.dtype or i.shape != t_res.shape
+           or i.strides != t_res.strides for i in t_overlaps):
+        t_res = np.empty_like(t_res)
+        t_inplace = False
+    t_rows = t_shape[0] if t_shape else 1
+    t_chunk_size = min(_INTO_CHUNK_SIZE, t_rows)
+    t_begins = range(0, t_rows, t_chunk_size or 1)
+
+    # every thread calculates a block of consecutive chunks with its own scratch arrays
+    def calculate(t_block):
+        t_scratch = [np.empty((t_chunk_size,) + t_shape[1:] if t_shape else (), dtype=float if t_round else t_res.dtype) for i in range(3 if t_inplace or t_round else 2)]
+        for t_begin in t_block:
+            t_chunk = slice(t_begin, t_begin + t_chunk_size) if t_shape else Ellipsis
+            t_values = [i[t_chunk] if i.ndim == len(t_shape) and i.ndim and i.shape[0] == t_rows else i for i in t_arrays]
+            t_buffers = [i[:t_res[t_chunk].shape[0]] if t_shape else i for i in t_scratch]
+            if t_inplace or t_round:
+                _KERNELS[t_name](t_buffers[2], t_buffers[0], t_buffers[1], *t_values)
+                if t_round:
+                    np.floor(np.add(t_buffers[2], 0.5, out=t_buffers[2]), out=t_buffers[2])
+                    _check_cents(t_name, t_buffers[2])
+                t_res[t_chunk] = t_buffers[2]
+            else:
+                _KERNELS[t_name](t_res[t_chunk], t_buffers[0], t_buffers[1], *t_values)
+
+    t_cpus = os.cpu_count() or 1
+    t_threads = min(t_cpus if threads == 0 else int(threads or 1), t_cpus, len(t_begins) // _THREAD_MIN_CHUNKS)
+    if t_threads > 1:
+        # blocks of chunks are split evenly between threads, list() waits for all of them and raises exception of any of them
+        t_blocks = [t_begins[i * len(t_begins) // t_threads:(i + 1) * len(t_begins) // t_threads] for i in range(t_threads)]
+        list(_thread_pool().map(calculate, t_blocks))
+    else:
+        calculate(t_begins)
+
+    if t_res is not t_out:
+        t_out[...] = t_res
+        t_res = t_out
+    if out is not None:
+        return out
+    return t_res[()] if t_like is None else _wrap(t_res, t_like)
+
+# calculates % margin based on cost and retail
+def margin(cost, retail, units=[], by=None, out=None, dtype=None, threads=None):
+    'Calculates % margin based on cost and retail. Calculares weighted % margin based on cost, retail, unit sales.'
+    if by is not None:
+        t_groups, (t_sales, t_cost) = _weighted_sums_by(by, units, retail, cost)
+        return _wrap_groups(t_groups, (t_sales - t_cost) / t_sales, 'margin', cost, retail, units, by)
+    if len(units) != 0 and (_container_rank(cost) or _container_rank(retail)):
+        t_sales, t_cost = _weighted_sums(units, retail, cost)
+        return (t_sales - t_cost) / t_sales
+    if out is not None or dtype is not None or threads is not None:
+        return _elementwise_into('margin', (cost, retail), out, dtype, threads)
+    return _elementwise(_FORMULAS['margin'], cost, retail)
+
+# calculates % markup based on cost and retail
+def markup(cost, retail, units=[], by=None, out=None, dtype=None, threads=None):
+    'Calculates % markup based on cost and retail. Calculares weighted % markup based on cost, retail, unit sales.'
+    if by is not None:
+        t_groups, (t_sales, t_cost) = _weighted_sums_by(by, units, retail, cost)
+        return _wrap_groups(t_groups, (t_sales - t_cost) / t_cost, 'markup', cost, retail, units, by)
+    if len(units) != 0 and (_container_rank(cost) or _container_rank(retail)):
+        t_sales, t_cost = _weighted_sums(units, retail, cost)
+        return (t_sales - t_cost) / t_cost
+    if out is not None or dtype is not None or threads is not None:
+        return _elementwise_into('markup', (cost, retail), out, dtype, threads)
+    return _elementwise(_FORMULAS['markup'], cost, retail)
+
+# calculates new retail based on target % margin
+def newret_mrgn(cost, margin, out=None, dtype=None, threads=None):
+    'Calculates new retail based on cost and target % margin.'
+    if out is not None or dtype is not None or threads is not None or _CENTS is not None:
+        return _elementwise_into('newret_mrgn', (cost, margin), out, dtype, threads)
+    return _elementwise(_FORMULAS['newret_mrgn'], cost, margin)
+    
+# calculates new retail based on cost and target % markup
+def newret_mkup(cost, markup, out=None, dtype=None, threads=None):
+    'Calculates new retail based on cost and target % markup.'
+    if out is not None or dtype is not None or threads is not None or _CENTS is not None:
+        return _elementwise_into('newret_mkup', (cost, markup), out, dtype, threads)
+    return _elementwise(_FORMULAS['newret_mkup'], cost, markup)
+    
+# Calculates cost based on retail and % margin.
+def cost_mrgn(retail, margin, out=None, dtype=None, threads=None):
+    'Calculates cost based on retail and % margin.'
+    if out is not None or dtype is not None or threads is not None or _CENTS is not None:
+        return _elementwise_into('cost_mrgn', (retail, margin), out, dtype, threads)
+    return _elementwise(_FORMULAS['cost_mrgn'], retail, margin)
+        
+# Calculates cost based on retail and % markup.
+def cost_mkup(retail, markup, out=None, dtype=None, threads=None):
+    'Calculates cost based on retail and % markup.'
+    if out is not None or dtype is not None or threads is not None or _CENTS is not None:
+        return _elementwise_into('cost_mkup', (retail, markup), out, dtype, threads)
+    return _elementwise(_FORMULAS['cost_mkup'], retail, markup)
+    
+# calculates % change based on current retail and target (new) retail
+def change_newret(old_retail, new_retail, out=None, dtype=None, threads=None):
+    'Calculates retail % change based on current retail and target (new) retail.'
+    if out is not None or dtype is not None or threads is not None:
+        return _elementwise_into('change_newret', (old_retail, new_retail), out, dtype, threads)
+    return _elementwise(_FORMULAS['change_newret'], old_retail, new_retail)
+    
+# calculates new retail based on current retail and % change
+def newret_change(retail, change, out=None, dtype=None, threads=None):
+    'Calculates new retail based on current retail and % change.'
+    if out is not None or dtype is not None or threads is not None or _CENTS is not None:
+        return _elementwise_into('newret_change', (retail, change), out, dtype, threads)
+    return _elementwise(_FORMULAS['newret_change'], retail, change)
+
+# calculates price index and weighted price index
+def priceindex(base_retail, retail, units=[], by=None, out=None, dtype=None, threads=None):
+    'Calculates Price Index for retail versus base_retail. Calculates weighted Price Index for retails versus base_retails based on unit sales.'
+    if by is not None:
+        t_groups, (t_sales, t_base_sales) = _weighted_sums_by(by, units, retail, base_retail)
+        return _wrap_groups(t_groups, t_sales / t_base_sales, 'priceindex', base_retail, retail, units, by)
+    if len(units) != 0 and (_container_rank(base_retail) or _container_rank(retail)):
+        t_sales, t_base_sales = _weighted_sums(units, retail, base_retail)
+        return t_sales / t_base_sales
+    if out is not None or dtype is not None or threads is not None:
+        return _elementwise_into('priceindex', (base_retail, retail), out, dtype, threads)
+    return _elementwise(_FORMULAS['priceindex'], base_retail, retail)
+    
+# calculates correlation between price and unit sold
+def retail_units_corr(retail, units, by=None):
+    'Calculates correlation coefficient between price and unit sold. Calculates correlation coefficients for every group.'
+    if _METRICS is not None: _tag((retail, units), t_suffix='' if by is None else '/by')
+    t_retail = np.asarray(retail, dtype=float).ravel()
+    t_units = np.asarray(units, dtype=float).ravel()
+    if t_retail.size != t_units.size:
+        raise ValueError('Retail and units should have the same length.')
+
+    if by is None:
+        t_retail_dev = t_retail - t_retail.mean()
+        t_units_dev = t_units - t_units.mean()
+        return float(np.clip(np.dot(t_retail_dev, t_units_dev) / np.sqrt(np.dot(t_retail_dev, t_retail_dev) * np.dot(t_units_dev, t_units_dev)), -1, 1))
+
+    t_groups, t_group = _group_codes(by)
+    if t_group.size != t_retail.size:
+        raise ValueError('Retail, units and group keys should have the same length.')
+    t_n_groups = len(t_groups[0]) if isinstance(t_groups, tuple) else t_groups.size
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_n = np.bincount(t_group, minlength=t_n_groups)
+        t_retail_dev = t_retail - (np.bincount(t_group, weights=t_retail, minlength=t_n_groups) / t_n)[t_group]
+        t_units_dev = t_units - (np.bincount(t_group, weights=t_units, minlength=t_n_groups) / t_n)[t_group]
+        t_sxy = np.bincount(t_group, weights=t_retail_dev * t_units_dev, minlength=t_n_groups)
+        t_sxx = np.bincount(t_group, weights=t_retail_dev * t_retail_dev, minlength=t_n_groups)
+        t_syy = np.bincount(t_group, weights=t_units_dev * t_units_dev, minlength=t_n_groups)
+        t_corr = np.clip(t_sxy / np.sqrt(t_sxx * t_syy), -1, 1)
+    return _wrap_groups(t_groups, t_corr, 'retail_units_corr', retail, units, by)
+
+# streaming correlation between price and unit sold
+class CorrStats:
+    'Count, means and centered sums of squares and products of retail and units (Welford), updated chunk by chunk and merged.'
+
+    def __init__(self):
+        self.n = 0
+        self.retail_mean = 0.0
+        self.units_mean = 0.0
+        self.sxx = 0.0
+        self.syy = 0.0
+        self.sxy = 0.0
+
+    def __repr__(self):
+        return 'CorrStats(n=%d, corr=%r)' % (self.n, self.corr())
+
+    def update(self, retail, units):
+        'Adds chunk of retails and unit sales.'
+        t_retail = np.asarray(retail, dtype=float).ravel()
+        t_units = np.asarray(units, dtype=float).ravel()
+        if t_retail.size != t_units.size:
+            raise ValueError('Retail and units should have the same length.')
+        if t_retail.size == 0:
+            return self
+
+        t_chunk = CorrStats()
+        t_chunk.n = t_retail.size
+        t_chunk.retail_mean = float(t_retail.mean())
+        t_chunk.units_mean = float(t_units.mean())
+        t_retail_dev = t_retail - t_chunk.retail_mean
+        t_units_dev = t_units - t_chunk.units_mean
+        t_chunk.sxx = float(np.dot(t_retail_dev, t_retail_dev))
+        t_chunk.syy = float(np.dot(t_units_dev, t_units_dev))
+        t_chunk.sxy = float(np.dot(t_retail_dev, t_units_dev))
+        return self.merge(t_chunk)
+
+    def merge(self, other):
+        'Adds statistics of other CorrStats (e.g. calculated for another file or in another process).'
+        t_n = self.n + other.n
+        if other.n == 0:
+            return self
+        t_retail_delta = other.retail_mean - self.retail_mean
+        t_units_delta = other.units_mean - self.units_mean
+        t_weight = self.n * other.n / t_n
+        self.sxx += other.sxx + t_retail_delta * t_retail_delta * t_weight
+        self.syy += other.syy + t_units_delta * t_units_delta * t_weight
+        self.sxy += other.sxy + t_retail_delta * t_units_delta * t_weight
+        self.retail_mean += t_retail_delta * other.n / t_n
+        self.units_mean += t_units_delta * other.n / t_n
+        self.n = t_n
+        return self
+
+    def corr(self):
+        'Calculates correlation coefficient between price and unit sold.'
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return float(np.clip(np.float64(self.sxy) / np.sqrt(self.sxx * self.syy), -1, 1))
+
+# calculates arc price elasticity of demand based on old volume, new volume, old retail, new retail
+def elast_arc(old_volume, new_volume, old_retail, new_retail, out=None, dtype=None, threads=None):
+    'Calculates arc price elasticity of demand based on old volume, new volume, old retail, new retail.'
+    if out is not None or dtype is not None or threads is not None:
+        return _elementwise_into('elast_arc', (old_volume, new_volume, old_retail, new_retail), out, dtype, threads)
+    return _elementwise(_FORMULAS['elast_arc'], old_volume, new_volume, old_retail, new_retail)
+
+# calculates point price elasticity of demand based on old volume, new volume, old retail, new retail
+def elast_pt(old_volume, new_volume, old_retail, new_retail, out=None, dtype=None, threads=None):
+    'Calculates point price elasticity of demand based on old volume, new volume, old retail, new retail.'
+    if out is not None or dtype is not None or threads is not None:
+        return _elementwise_into('elast_pt', (old_volume, new_volume, old_retail, new_retail), out, dtype, threads)
+    return _elementwise(_FORMULAS['elast_pt'], old_volume, new_volume, old_retail, new_retail)
+
+# linear regression in the segment
+@_memoized
+def elast(retail, units, segment_begin=0, segment_end=0):
+    'Calculates coefficient and intercept for linear regression model in the segment.'
+
+    def F_test(r_sq, obs_num, param_num):
+        return (r_sq / (1 - r_sq)) * ((obs_num - param_num - 1) / param_num)
+    
+    def Durbin_Watson_stat(t_resid):
+        t_len = t_resid.size
+        t_sum = 0
+        t_et = 0
+        for i in range(t_len):
+            if i > 0: t_sum = t_sum + (t_resid[i] - t_resid[i - 1])**2
+            t_et = t_et + t_resid[i]**2
+        # return test value
+        return t_sum / t_et
+
+    t_retail = np.array(retail)
+    t_units = np.array(units)
+
+    if segment_begin == 0: segment_begin = t_retail.min()
+    if segment_end == 0: segment_end = t_retail.max()
+    
+    t_units = t_units[(t_retail >= segment_begin)&(t_retail <= segment_end)]
     t_retail = t_retail[(t_retail >= segment_begin)&(t_retail <= segment_end)]
     
     t_retail = t_retail.reshape(-1, 1)
     t_units = t_units.flatten()
     
+    from sklearn import linear_model
+
     t_clf = linear_model.LinearRegression()
     t_clf.fit(t_retail, t_units)
     
@@ -781,151 +2367,1318 @@ def elast(retail, units, segment_begin=0, segment_end=0):
     
     return (t_clf.coef_[0], t_clf.intercept_, t_r_sq, t_F_test, t_DW_test)
 
+# linear regression from sums of observations
+def _fit_from_sums(n, sx, sy, sxy, sxx, syy, x0=0, y0=0):
+    'Calculates coefficient, intercept, R^2, F-statistic and sum of squared residuals of linear regression from n and sums of x - x0, y - y0, xy, x^2, y^2.'
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_cxx = sxx - sx * sx / n
+        t_cxy = sxy - sx * sy / n
+        t_cyy = syy - sy * sy / n
+        t_coef = t_cxy / t_cxx
+        t_intercept = y0 + sy / n - t_coef * (x0 + sx / n)
+        # residuals of constant retail are deviations of units from their mean
+        t_ss_res = np.maximum(np.where(t_cxx > 0, t_cyy - t_cxy * t_cxy / np.where(t_cxx > 0, t_cxx, 1), t_cyy), 0)
+        # R^2 of constant units is 1 for a perfect fit and 0 otherwise, as sklearn scores it
+        t_r_sq = np.where(t_cyy != 0, 1 - t_ss_res / t_cyy, np.where(t_ss_res == 0, 1.0, 0.0))
+        # a line through 1 or 2 observations fits them exactly, R^2 and F-statistic have no degrees of freedom
+        t_r_sq = np.where(n > 2, t_r_sq, np.nan)
+        t_F_test = (t_r_sq / (1 - t_r_sq)) * (n - 2)
+    return t_coef, t_intercept, t_r_sq, t_F_test, t_ss_res
+
+# linear regression in the segment for every group at once
+@_memoized
+def elast_group(retail, units, keys, segment_begin=0, segment_end=0):
+    'Calculates coefficient and intercept for linear regression model in the segment for every group of long-format data at once.'
+
+    t_retail = np.asarray(retail, dtype=float).ravel()
+    t_units = np.asarray(units, dtype=float).ravel()
+    t_groups, t_group = np.unique(np.asarray(keys).ravel(), return_inverse=True)
+    t_n_groups = t_groups.size
+
+    # stable sort keeps the order of observations within a group (DW-statistic depends on it)
+    t_order = np.argsort(t_group, kind='stable')
+    t_retail = t_retail[t_order]
+    t_units = t_units[t_order]
+    t_group = t_group[t_order]
+
+    t_segment_begin = np.broadcast_to(np.asarray(segment_begin, dtype=float), (t_n_groups,))
+    t_segment_end = np.broadcast_to(np.asarray(segment_end, dtype=float), (t_n_groups,))
+    if t_retail.size > 0:
+        t_starts = np.flatnonzero(np.r_[True, t_group[1:] != t_group[:-1]])
+        t_segment_begin = np.where(t_segment_begin == 0, np.minimum.reduceat(t_retail, t_starts), t_segment_begin)
+        t_segment_end = np.where(t_segment_end == 0, np.maximum.reduceat(t_retail, t_starts), t_segment_end)
+
+    t_mask = (t_retail >= t_segment_begin[t_group]) & (t_retail <= t_segment_end[t_group])
+    t_retail = t_retail[t_mask]
+    t_units = t_units[t_mask]
+    t_group = t_group[t_mask]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_n = np.bincount(t_group, minlength=t_n_groups).astype(float)
+        t_retail_mean = np.bincount(t_group, weights=t_retail, minlength=t_n_groups) / t_n
+        t_units_mean = np.bincount(t_group, weights=t_units, minlength=t_n_groups) / t_n
+
+        # deviations from the means of the group sum to zero
+        t_retail_dev = t_retail - t_retail_mean[t_group]
+        t_units_dev = t_units - t_units_mean[t_group]
+        t_sxx = np.bincount(t_group, weights=t_retail_dev * t_retail_dev, minlength=t_n_groups)
+        t_sxy = np.bincount(t_group, weights=t_retail_dev * t_units_dev, minlength=t_n_groups)
+        t_syy = np.bincount(t_group, weights=t_units_dev * t_units_dev, minlength=t_n_groups)
+        t_coef, t_intercept, t_r_sq, t_F_test, t_ss_res = _fit_from_sums(t_n, 0, 0, t_sxy, t_sxx, t_syy, t_retail_mean, t_units_mean)
+
+        t_residuals = t_units_dev - t_coef[t_group] * t_retail_dev
+        t_same = t_group[1:] == t_group[:-1]
+        t_diff = (t_residuals[1:] - t_residuals[:-1])[t_same]
+        t_DW_test = np.bincount(t_group[1:][t_same], weights=t_diff * t_diff, minlength=t_n_groups) / t_ss_res
+
+    return (t_groups, t_coef, t_intercept, t_r_sq, t_F_test, t_DW_test)
+
+# finds breakpoints of piecewise linear regression by retail
+def elast_breaks(retail, units, breakpoints=1, candidates=100, min_size=5):
+    'Finds retail breakpoints of piecewise linear regression (1, 2 or the best by BIC) scoring every candidate in O(1) from prefix sums, returns segments with elast statistics.'
+    t_retail = np.asarray(retail, dtype=float).ravel()
+    t_units = np.asarray(units, dtype=float).ravel()
+    if t_retail.size != t_units.size:
+        raise ValueError('Retail and units should have the same length.')
+    if breakpoints not in (1, 2, 'auto'):
+        raise ValueError("Unsupported breakpoints %r, options available: 1, 2, 'auto'." % (breakpoints,))
+    t_n = t_retail.size
+    t_min_size = max(int(min_size), 2)
+
+    # one sort by retail, prefix sums of 1, x, y, x^2, xy, y^2 of centered values give regression of any run of sorted rows
+    t_order = np.argsort(t_retail, kind='stable')
+    t_x = t_retail[t_order]
+    t_x_dev = t_x - t_x.mean() if t_n else t_x
+    t_y_dev = t_units[t_order] - t_units.mean() if t_n else t_x
+    t_sums = np.zeros((6, t_n + 1))
+    np.cumsum(np.stack([np.ones(t_n), t_x_dev, t_y_dev, t_x_dev * t_x_dev, t_x_dev * t_y_dev, t_y_dev * t_y_dev]), axis=1, out=t_sums[:, 1:])
+
+    # sum of squared residuals of regression of sorted rows from begin to end (not included)
+    def ss_res(t_begin, t_end):
+        t_begin, t_end = np.broadcast_arrays(t_begin, t_end)
+        t_count, t_sx, t_sy, t_sxx, t_sxy, t_syy = t_sums[:, t_end] - t_sums[:, t_begin]
+        return _fit_from_sums(t_count, t_sx, t_sy, t_sxy, t_sxx, t_syy)[4]
+
+    # candidates are boundaries between different retails leaving min_size rows in every segment, evenly spaced by rows if there are too many
+    t_pos = np.flatnonzero(t_x[1:] != t_x[:-1]) + 1
+    t_pos = t_pos[(t_pos >= t_min_size) & (t_pos <= t_n - t_min_size)]
+    if candidates is not None and t_pos.size > candidates:
+        t_pos = t_pos[np.unique(np.linspace(0, t_pos.size - 1, int(candidates)).round().astype(np.int64))]
+
+    t_models = {}
+    if t_n >= t_min_size and breakpoints == 'auto':
+        t_models[0] = (ss_res(0, t_n), ())
+    if t_pos.size and breakpoints in (1, 'auto'):
+        t_ss = ss_res(0, t_pos) + ss_res(t_pos, t_n)
+        t_best = np.argmin(t_ss)
+        t_models[1] = (t_ss[t_best], (t_pos[t_best],))
+    if t_pos.size and breakpoints in (2, 'auto'):
+        t_first, t_second = t_pos[:, None], t_pos[None, :]
+        t_ss = np.where(t_second - t_first >= t_min_size, ss_res(0, t_first) + ss_res(t_first, t_second) + ss_res(t_second, t_n), np.inf)
+        t_best = np.unravel_index(np.argmin(t_ss), t_ss.shape)
+        if np.isfinite(t_ss[t_best]):
+            t_models[2] = (t_ss[t_best], (t_pos[t_best[0]], t_pos[t_best[1]]))
+    if not t_models:
+        raise ValueError('Not enough distinct retails for %r breakpoints with min_size %d.' % (breakpoints, t_min_size))
+
+    # BIC: every segment has coefficient and intercept, every breakpoint is a parameter too
+    def bic(t_key):
+        return t_n * np.log(max(t_models[t_key][0], 1e-300) / t_n) + (3 * t_key + 2) * np.log(t_n)
+    t_breaks = t_models[min(t_models, key=bic)][1]
+
+    # statistics of the segments are calculated as elast calculates them, on rows of the segment in the input order
+    t_bounds = np.r_[0, t_breaks, t_n].astype(np.int64)
+    t_segment = np.empty(t_n, dtype=np.int64)
+    t_segment[t_order] = np.searchsorted(t_bounds[1:-1], np.arange(t_n), side='right')
+    t_segments = np.column_stack([t_x[t_bounds[:-1]], t_x[t_bounds[1:] - 1]])
+    return (t_segments,) + tuple(elast_group(t_retail, t_units, t_segment)[1:])
+
+# linear regression of every SKU updated week by week
+class RollingElast:
+    'Sums behind linear regression of units on retail for every SKU (n, sum(x), sum(y), sum(xy), sum(x^2), sum(y^2)), observations are added and dropped in O(1).'
+
+    # columns of sums
+    _N, _X, _Y, _XY, _XX, _YY = range(6)
+
+    def __init__(self):
+        self.keys = []
+        self.sums = np.zeros((0, 6))
+        self.shift = np.zeros((0, 2))
+        self._index = {}
+
+    def __repr__(self):
+        return 'RollingElast(skus=%d, observations=%d)' % (len(self.keys), self.sums[:, self._N].sum())
+
+    def _update(self, keys, retail, units, sign):
+        'Adds (sign=1) or drops (sign=-1) observations of SKUs.'
+        t_retail = np.asarray(retail, dtype=float).ravel()
+        t_units = np.asarray(units, dtype=float).ravel()
+        t_keys, t_first, t_codes = np.unique(np.asarray(keys).ravel(), return_index=True, return_inverse=True)
+        if t_retail.size != t_codes.size or t_units.size != t_codes.size:
+            raise ValueError('Keys, retail and units should have the same length.')
+        if sign < 0:
+            for t_key in t_keys.tolist():
+                if t_key not in self._index:
+                    raise KeyError(t_key)
+
+        # sums of values shifted by the first observation of the SKU keep precision of centered sums of squares at any price level
+        t_new = [i for i, t_key in enumerate(t_keys.tolist()) if t_key not in self._index]
+        for i in t_new:
+            self._index[t_keys[i].tolist()] = len(self.keys)
+            self.keys.append(t_keys[i].tolist())
+        if t_new:
+            self.sums = np.concatenate([self.sums, np.zeros((len(t_new), 6))])
+            self.shift = np.concatenate([self.shift, np.column_stack([t_retail[t_first[t_new]], t_units[t_first[t_new]]])])
+
+        t_rows = np.array([self._index[i] for i in t_keys.tolist()], dtype=np.intp)
+        t_retail = t_retail - self.shift[t_rows, 0][t_codes]
+        t_units = t_units - self.shift[t_rows, 1][t_codes]
+        for t_col, t_weights in ((self._N, None), (self._X, t_retail), (self._Y, t_units), (self._XY, t_retail * t_units),
+                                 (self._XX, t_retail * t_retail), (self._YY, t_units * t_units)):
+            self.sums[t_rows, t_col] += sign * np.bincount(t_codes, weights=t_weights, minlength=t_keys.size)
+        return self
+
+    def add(self, keys, retail, units):
+        'Adds observations (e.g. a new week) of SKUs.'
+        return self._update(keys, retail, units, 1)
+
+    def drop(self, keys, retail, units):
+        'Drops observations (e.g. the oldest week of the window) of SKUs, they should be added before (KeyError otherwise).'
+        return self._update(keys, retail, units, -1)
+
+    def fit(self):
+        'Calculates coefficient, intercept, R^2 and F-statistic of linear regression for every SKU, DW-statistic needs residuals and is nan.'
+        t_n, t_x, t_y, t_xy, t_xx, t_yy = self.sums.T
+        t_coef, t_intercept, t_r_sq, t_F_test = _fit_from_sums(t_n, t_x, t_y, t_xy, t_xx, t_yy, self.shift[:, 0], self.shift[:, 1])[:4]
+        return (np.array(self.keys), t_coef, t_intercept, t_r_sq, t_F_test, np.full(t_n.size, np.nan))
+
+    def save(self, path):
+        'Saves sums of every SKU to .npz file.'
+        np.savez(path, keys=np.array(self.keys), sums=self.sums, shift=self.shift)
+
+    @classmethod
+    def load(cls, path):
+        'Loads sums of every SKU saved by save().'
+        t_self = cls()
+        with np.load(path) as t_file:
+            t_self.keys = t_file['keys'].tolist()
+            t_self.sums = t_file['sums']
+            # files saved without shift hold sums of unshifted values
+            t_self.shift = t_file['shift'] if 'shift' in t_file.files else np.zeros((len(t_self.keys), 2))
+        t_self._index = {t_key: i for i, t_key in enumerate(t_self.keys)}
+        return t_self
+
+# price history of a SKU prepared for many segment queries
+class PriceSeries:
+    'Retails and unit sales sorted by retail once with prefix sums of n, x, y, xy, x^2, y^2, every segment query is answered in O(log n) by searchsorted.'
+
+    # rows of prefix sums
+    _N, _X, _Y, _XY, _XX, _YY = range(6)
+
+    def __init__(self, retail, units):
+        t_retail = np.asarray(retail, dtype=float).ravel()
+        t_units = np.asarray(units, dtype=float).ravel()
+        if t_retail.size != t_units.size:
+            raise ValueError('Retail and units should have the same length.')
+        self.order = np.argsort(t_retail, kind='stable')
+        self.retail = t_retail[self.order]
+        self.units = t_units[self.order]
+
+        # sums of values centered by the means keep precision of centered sums of squares of any segment
+        self._retail_mean = float(t_retail.mean()) if t_retail.size else 0.0
+        self._units_mean = float(t_units.mean()) if t_units.size else 0.0
+        t_x = self.retail - self._retail_mean
+        t_y = self.units - self._units_mean
+        self.sums = np.zeros((6, t_retail.size + 1))
+        np.cumsum(np.stack([np.ones(t_retail.size), t_x, t_y, t_x * t_y, t_x * t_x, t_y * t_y]), axis=1, out=self.sums[:, 1:])
+
+    def __repr__(self):
+        return 'PriceSeries(observations=%d)' % len(self)
+
+    def __len__(self):
+        return self.retail.size
+
+    def _segment(self, segment_begin, segment_end):
+        'Finds first and last (not included) sorted rows with segment_begin <= retail <= segment_end, 0 means min or max retail as in elast.'
+        t_begin = np.asarray(segment_begin, dtype=float)
+        t_end = np.asarray(segment_end, dtype=float)
+        t_first = np.where(t_begin == 0, 0, np.searchsorted(self.retail, t_begin, side='left'))
+        t_last = np.where(t_end == 0, self.retail.size, np.searchsorted(self.retail, t_end, side='right'))
+        return np.broadcast_arrays(t_first, np.maximum(t_last, t_first))
+
+    def _sums(self, segment_begin, segment_end):
+        'Sums of centered values in the segment(s), one row per kind of sum.'
+        t_first, t_last = self._segment(segment_begin, segment_end)
+        return self.sums[:, t_last] - self.sums[:, t_first]
+
+    def count(self, segment_begin=0, segment_end=0):
+        'Calculates number of observations in the segment(s).'
+        return self._sums(segment_begin, segment_end)[self._N].round().astype(np.int64)
+
+    def total_units(self, segment_begin=0, segment_end=0):
+        'Calculates unit sales in the segment(s).'
+        t_sums = self._sums(segment_begin, segment_end)
+        return t_sums[self._Y] + t_sums[self._N] * self._units_mean
+
+    def avg_retail(self, segment_begin=0, segment_end=0):
+        'Calculates average retail weighted by unit sales in the segment(s).'
+        t_n, t_x, t_y, t_xy = self._sums(segment_begin, segment_end)[:4]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self._retail_mean + (t_xy + t_x * self._units_mean) / (t_y + t_n * self._units_mean)
+
+    def elast(self, segment_begin=0, segment_end=0, durbin_watson=False):
+        'Calculates coefficient, intercept, R^2, F-statistic of linear regression in the segment(s) as elast does, DW-statistic needs residuals of the segment and is nan unless durbin_watson.'
+        t_n, t_x, t_y, t_xy, t_xx, t_yy = self._sums(segment_begin, segment_end)
+        t_coef, t_intercept, t_r_sq, t_F_test = _fit_from_sums(t_n, t_x, t_y, t_xy, t_xx, t_yy, self._retail_mean, self._units_mean)[:4]
+        t_DW_test = np.full(t_n.shape, np.nan)
+        if durbin_watson:
+            # residuals of the segment in the input order, O(segment) for every segment
+            t_first, t_last = self._segment(segment_begin, segment_end)
+            for i in np.ndindex(t_n.shape):
+                t_rank = np.argsort(self.order[t_first[i]:t_last[i]], kind='stable')
+                t_resid = self.units[t_first[i]:t_last[i]][t_rank] - (t_coef[i] * self.retail[t_first[i]:t_last[i]][t_rank] + t_intercept[i])
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    t_DW_test[i] = np.sum(np.diff(t_resid) ** 2) / np.sum(t_resid * t_resid)
+        if t_n.ndim == 0:
+            return (float(t_coef), float(t_intercept), float(t_r_sq), float(t_F_test), float(t_DW_test))
+        return (t_coef, t_intercept, t_r_sq, t_F_test, t_DW_test)
+
 # calculates optimal retails
 def opt_retail(retail, units, elast_coef, range=0.1):
     'Calculates opimal retails (max dollar sales) based on current retails, unit sales, elastisity.'
-    
-    t_retail = np.array(retail)
-    t_units = np.array(units)
-    t_elast_coef = np.array(elast_coef)
-    
-    t_opt_retails = []
-    
-    t_min_ret = t_retail * (1 - range)
-    t_max_ret = t_retail * (1 + range)
-    
-    for i in np.arange(t_retail.size):
-        t_max_mar = 0
-        t_opt_retail = 0
-        for j in np.arange(t_min_ret[i], t_max_ret[i], 0.01):
-            if t_max_mar < j * (t_units[i] + t_units[i] * (t_elast_coef[i] * (j / t_retail[i] - 1))):
-                t_max_mar = j * (t_units[i] + t_units[i] * (t_elast_coef[i] * (j / t_retail[i] - 1)))
-                t_opt_retail = j
-        t_opt_retails.append(t_opt_retail)
-        
-    return np.array(t_opt_retails)
+    return opt_retail_batch(retail, units, elast_coef, range=range)[0]
+
+# calculates optimal retails and $ sales for all SKUs at once
+@_memoized
+def opt_retail_batch(retail, units, elast_coef, range=0.1, chunk_size=1000000):
+    'Calculates opimal retails (max dollar sales) and $ sales at these retails for all SKUs at once based on current retails, unit sales, elastisity.'
+
+    # retail grid of SKU is np.arange(min_ret, max_ret, 0.01), np.arange fills it as min_ret + k * ((min_ret + 0.01) - min_ret),
+    # in fixed-point mode the grid steps by a cent in price units from the whole price unit at or above min_ret
+    t_unit = 0.01 if _CENTS is None else 0.01 * _CENTS
+    def grid_retail(t_k, t_min_ret, t_step):
+        return np.where(t_k == 0, t_min_ret, np.where(t_k == 1, t_min_ret + t_unit, t_min_ret + t_k * t_step))
+
+    t_retail, t_units, t_elast_coef, t_range = np.broadcast_arrays(
+        np.asarray(retail, dtype=float).ravel(), np.asarray(units, dtype=float).ravel(),
+        np.asarray(elast_coef, dtype=float).ravel(), np.asarray(range, dtype=float).ravel())
+
+    t_opt_retails = np.zeros(t_retail.size)
+    t_opt_sales = np.zeros(t_retail.size)
+    t_chunk_size = max(int(chunk_size), 1)
+
+    for t_begin in np.arange(0, t_retail.size, t_chunk_size):
+        t_chunk = slice(t_begin, t_begin + t_chunk_size)
+        c_retail = t_retail[t_chunk, None]
+        c_units = t_units[t_chunk, None]
+        c_elast_coef = t_elast_coef[t_chunk, None]
+
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            c_min_ret = c_retail * (1 - t_range[t_chunk, None])
+            if _CENTS is not None:
+                c_min_ret = np.ceil(c_min_ret)
+            c_max_ret = c_retail * (1 + t_range[t_chunk, None])
+            c_step = (c_min_ret + t_unit) - c_min_ret
+            c_len = np.ceil((c_max_ret - c_min_ret) / t_unit)
+            c_len = np.where(np.isfinite(c_len) & (c_len > 0), c_len, 0)
+
+            # $ sales are quadratic along the grid, so the maximum is at one of its ends or next to the vertex
+            c_vertex = np.floor((c_retail * (c_elast_coef - 1) / (2 * c_elast_coef) - c_min_ret) / c_step)
+            c_vertex = np.where(np.isfinite(c_vertex), c_vertex, 0)
+            c_k = np.concatenate([np.zeros_like(c_len), c_len - 1, c_vertex + np.arange(-1, 3)], axis=1)
+            c_k = np.clip(c_k, 0, np.maximum(c_len - 1, 0))
+
+            c_grid = grid_retail(c_k, c_min_ret, c_step)
+            c_sales = c_grid * (c_units + c_units * (c_elast_coef * (c_grid / c_retail - 1)))
+            c_sales = np.where((c_sales > 0) & (c_len > 0), c_sales, 0)
+
+            # as in the sequential scan the lowest retail wins on ties and no retail is found if $ sales are never positive
+            c_best = c_sales.max(axis=1, keepdims=True)
+            c_k = np.where(c_sales == c_best, c_k, np.inf).min(axis=1, keepdims=True)
+            c_found = c_best > 0
+
+            t_opt_retails[t_chunk] = np.where(c_found, grid_retail(c_k, c_min_ret, c_step), 0)[:, 0]
+            t_opt_sales[t_chunk] = c_best[:, 0]
+
+    if _CENTS is not None:
+        return t_opt_retails.astype(np.int64), t_opt_sales
+    return t_opt_retails, t_opt_sales
+
+# optimizes retails of the assortment for max margin dollars under price bounds, minimum margin and price index constraints
+def opt_portfolio(retail, cost, units, elast_coef, lower=None, upper=None, range=0.1, min_margin=None, base_retail=None, max_index=None, temp=None, iterations=100):
+    'Calculates retails of all SKUs that deliver max margin dollars of the assortment within price bounds, minimum % margin and max weighted Price Index.'
+
+    t_retail, t_cost, t_units, t_elast_coef, t_range = np.broadcast_arrays(*[np.asarray(i, dtype=float).ravel() for i in (retail, cost, units, elast_coef, range)])
+    t_lower = t_retail * (1 - t_range) if lower is None else np.broadcast_to(np.asarray(lower, dtype=float).ravel(), t_retail.shape)
+    t_upper = t_retail * (1 + t_range) if upper is None else np.broadcast_to(np.asarray(upper, dtype=float).ravel(), t_retail.shape)
+    if min_margin is not None:
+        # minimum margin is a lower bound of retail and wins over the upper bound
+        t_lower = np.maximum(t_lower, t_cost / (1 - np.asarray(min_margin, dtype=float).ravel()))
+        t_upper = np.maximum(t_upper, t_lower)
+    if np.any(t_lower > t_upper):
+        raise ValueError('Lower bounds of retails should not be above upper bounds.')
+
+    # linear demand as in opt_retail: units * (1 + elast_coef * (new_retail / retail - 1))
+    def margin_dollars(t_new_retail):
+        return (t_new_retail - t_cost) * t_units * (1 + t_elast_coef * (t_new_retail / t_retail - 1))
+
+    # Price Index is sum(units * retail) / sum(units * base_retail), its constraint is a budget of sum(units * retail)
+    if max_index is not None:
+        if base_retail is None:
+            raise ValueError('base_retail should be given with max_index.')
+        t_budget = float(max_index) * _weighted_sums(t_units, np.broadcast_to(np.asarray(base_retail, dtype=float).ravel(), t_retail.shape))[0]
+        if np.dot(t_units, t_lower) > t_budget:
+            raise ValueError('Price Index %r cannot be met within price bounds.' % max_index)
+
+    # retails maximizing margin dollars - penalty * units * retail: the vertex of the parabola if it is concave, otherwise the better bound
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_vertex = (t_cost + t_retail * (t_elast_coef - 1) / t_elast_coef) / 2
+        t_vertex_shift = t_retail / (2 * t_elast_coef)
+    t_concave = (t_units * t_elast_coef < 0) & np.isfinite(t_vertex)
+    t_vertex = np.where(t_concave, t_vertex, 0)
+    t_vertex_shift = np.where(t_concave, t_vertex_shift, 0)
+    t_bounds_gain = margin_dollars(t_upper) - margin_dollars(t_lower)
+    t_bounds_cost = t_units * (t_upper - t_lower)
+
+    def solve(t_penalty):
+        return np.where(t_concave, np.clip(t_vertex + t_penalty * t_vertex_shift, t_lower, t_upper),
+                        np.where(t_bounds_gain > t_penalty * t_bounds_cost, t_upper, t_lower))
+
+    # Lagrange multiplier of the Price Index constraint is found by bisection (units * retail decreases with penalty)
+    t_penalty = 0.0
+    t_new_retail = solve(t_penalty)
+    if max_index is not None and np.dot(t_units, t_new_retail) > t_budget:
+        t_low, t_high = 0.0, 1.0
+        while np.dot(t_units, solve(t_high)) > t_budget and t_high < 1e300:
+            t_low, t_high = t_high, t_high * 2
+        for i in np.arange(iterations):
+            t_mid = (t_low + t_high) / 2
+            if t_high - t_low <= 1e-12 * t_high:
+                break
+            if np.dot(t_units, solve(t_mid)) > t_budget:
+                t_low = t_mid
+            else:
+                t_high = t_mid
+        t_penalty = t_high
+        t_new_retail = solve(t_penalty)
+
+    if temp is None and _CENTS is not None:
+        # fixed-point retails are snapped to whole price units as to a template of every ending
+        temp = '*.' + '*' * (len(str(_CENTS)) - 1)
+    if temp is not None:
+        # the better allowed retail below or above within bounds, SKUs without allowed retail within bounds keep the retail
+        t_down = smart_round(t_new_retail, temp, 'down')
+        t_up = smart_round(t_new_retail, temp, 'up')
+        t_down_ok = (t_down >= t_lower) & (t_down <= t_upper)
+        t_up_ok = (t_up >= t_lower) & (t_up <= t_upper)
+        t_up_better = margin_dollars(t_up) - t_penalty * t_units * t_up > margin_dollars(t_down) - t_penalty * t_units * t_down
+        t_new_retail = np.where(t_up_ok & (t_up_better | ~t_down_ok), t_up, np.where(t_down_ok, t_down, t_new_retail))
+
+        # rounding up can break Price Index: SKUs losing the least margin dollars per unit of the index are rounded down
+        if max_index is not None and np.dot(t_units, t_new_retail) > t_budget:
+            t_switch = np.flatnonzero((t_new_retail == t_up) & t_down_ok & (t_up > t_down) & (t_units > 0))
+            t_delta = t_units[t_switch] * (t_up[t_switch] - t_down[t_switch])
+            t_loss = margin_dollars(t_up)[t_switch] - margin_dollars(t_down)[t_switch]
+            t_order = np.argsort(t_loss / t_delta, kind='stable')
+            t_count = np.searchsorted(np.cumsum(t_delta[t_order]), np.dot(t_units, t_new_retail) - t_budget) + 1
+            t_switch = t_switch[t_order[:t_count]]
+            t_new_retail[t_switch] = t_down[t_switch]
+            # rounding down every switchable SKU is not always enough: SKUs without allowed retail below keep the rounded up one
+            if np.dot(t_units, t_new_retail) > t_budget:
+                raise ValueError('Price Index %r cannot be met with retails of template %r within price bounds.' % (max_index, temp))
+
+    if _CENTS is not None:
+        # SKUs without a whole price unit within bounds get the closest one
+        t_new_retail = np.floor(t_new_retail + 0.5).astype(np.int64)
+    t_index = np.dot(t_units, t_new_retail) / np.dot(t_units, np.broadcast_to(np.asarray(base_retail, dtype=float).ravel(), t_retail.shape)) if base_retail is not None else np.nan
+    return t_new_retail, margin_dollars(t_new_retail), t_index
 
 # calculates % break even based on cost, retail and % discount
-def breakeven_ret(cost, retail, discount):
+def breakeven_ret(cost, retail, discount, out=None, dtype=None, threads=None):
     'Calculates % break even based on cost, retail and % discount.'
-    if type(cost) == list and type(retail) == list and type(discount) == list:
-        t_list = [(retail[i] - cost[i]) / (retail[i] * (1 - discount[i]) - cost[i]) - 1 for i in range(len(cost))]
-        return t_list
-    else:
-        t_var = (retail - cost) / (retail * (1 - discount) - cost) - 1
-        return t_var
+    if out is not None or dtype is not None or threads is not None:
+        return _elementwise_into('breakeven_ret', (cost, retail, discount), out, dtype, threads)
+    return _elementwise(_FORMULAS['breakeven_ret'], cost, retail, discount)
 
 # calculates % break even based on % markup and % discount
-def breakeven_mkup(markup, discount):
+def breakeven_mkup(markup, discount, out=None, dtype=None, threads=None):
     'Calculates % break even based on % markup and % discount.'
-    if type(markup) == list and type(discount) == list:
-        t_list = [markup[i] / ((1 + markup[i]) * (1 - discount[i]) - 1) for i in range(len(markup))]  
-        return t_list  
-    else:
-        t_var = markup / ((1 + markup) * (1 - discount) - 1)
-        return t_var
-    
+    if out is not None or dtype is not None or threads is not None:
+        return _elementwise_into('breakeven_mkup', (markup, discount), out, dtype, threads)
+    return _elementwise(_FORMULAS['breakeven_mkup'], markup, discount)
+
 # calculates % break even based on % margin and % discount
-def breakeven_mrgn(margin, discount):
+def breakeven_mrgn(margin, discount, out=None, dtype=None, threads=None):
     'Calculates % break even based on % margin and % discount.'
-    if type(margin) == list and type(discount) == list:
-        t_list = [1 / (1 - discount[i] / margin[i]) - 1 for i in range(len(margin))] 
-        return t_list  
+    if out is not None or dtype is not None or threads is not None:
+        return _elementwise_into('breakeven_mrgn', (margin, discount), out, dtype, threads)
+    return _elementwise(_FORMULAS['breakeven_mrgn'], margin, discount)
+
+# reductions of scenario_grid over SKUs
+_GRID_REDUCE = (None, 'min', 'max', 'mean', 'smallest', 'largest')
+
+# calculates elementwise formula for every SKU under every scenario in tiles of bounded memory
+def scenario_grid(formula, skus, scenarios, reduce=None, k=10, dtype=None, max_bytes=64 * 2 ** 20):
+    'Calculates elementwise formula for every SKU (rows) under every scenario of its last argument (columns) in tiles of bounded memory, optionally reduced over SKUs on the fly.'
+    t_name = formula if isinstance(formula, str) else getattr(formula, '__name__', None)
+    if t_name not in _KERNELS:
+        raise ValueError('Unsupported formula %r, options available: %s.' % (formula, ', '.join(_KERNELS)))
+    if len(skus) + 1 != _FORMULAS[t_name].__code__.co_argcount:
+        raise ValueError('Formula %s takes %d SKU arguments and scenarios.' % (t_name, _FORMULAS[t_name].__code__.co_argcount - 1))
+    if reduce not in _GRID_REDUCE:
+        raise ValueError('Unsupported reduce %r, options available: %s.' % (reduce, ', '.join(map(str, _GRID_REDUCE))))
+
+    # SKU arguments are columns, scenarios are a row: formula broadcasts them into the matrix, pandas SKU arguments are aligned by labels
+    skus = _align_pd(tuple(skus))
+    t_skus = [np.asarray(i, dtype=float).reshape(-1, 1) if _container_rank(i) else i for i in skus]
+    t_scenarios = np.asarray(scenarios, dtype=float).reshape(1, -1)
+    t_rows = np.broadcast_shapes(*[np.shape(i) for i in t_skus] + [(1, 1)])[0]
+    t_cols = t_scenarios.shape[1]
+
+    # in fixed-point mode tiles of retails and costs are calculated in float and rounded half up (into int64 matrix by default)
+    t_round = _CENTS is not None and t_name in _PRICE_FORMULAS
+    t_dtype = np.dtype((np.int64 if t_round else float) if dtype is None else dtype)
+    t_work_dtype = np.dtype(float) if t_round else t_dtype
+    t_direct = reduce is None and not t_round
+
+    # rows of the tile: scratch arrays of the kernel, the tile itself when the matrix is reduced or rounded and temporaries of the reduction fit into max_bytes
+    t_tiles = {None: 2 if t_direct else 3, 'min': 3, 'max': 3, 'mean': 4}.get(reduce, 5)
+    t_tile_rows = max(1, min(t_rows, int(max_bytes // (t_tiles * max(t_cols, 1) * max(t_dtype.itemsize, t_work_dtype.itemsize)))))
+    t_scratch = [np.empty((t_tile_rows, t_cols), dtype=t_work_dtype) for i in range(2 if t_direct else 3)]
+    t_res = np.empty((t_rows, t_cols), dtype=t_dtype) if reduce is None else None
+
+    t_k = min(k, t_rows)
+    t_keys = t_index = t_values = None
+    t_acc = np.full(t_cols, np.nan if reduce in ('min', 'max') else 0.0)
+    t_count = np.zeros(t_cols)
+
+    for t_begin in np.arange(0, t_rows, t_tile_rows):
+        t_end = min(t_begin + t_tile_rows, t_rows)
+        t_args = [i[t_begin:t_end] if np.ndim(i) and i.shape[0] == t_rows > 1 else i for i in t_skus]
+        t_buffers = [i[:t_end - t_begin] for i in t_scratch]
+        t_tile = t_res[t_begin:t_end] if t_direct else t_buffers[2]
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            _KERNELS[t_name](t_tile, t_buffers[0], t_buffers[1], *t_args, t_scenarios)
+        if t_round:
+            np.floor(np.add(t_tile, 0.5, out=t_tile), out=t_tile)
+            _check_cents(t_name, t_tile)
+            if reduce is None:
+                t_res[t_begin:t_end] = t_tile
+
+        if reduce == 'min':
+            t_acc = np.fmin(t_acc, np.fmin.reduce(t_tile, axis=0))
+        elif reduce == 'max':
+            t_acc = np.fmax(t_acc, np.fmax.reduce(t_tile, axis=0))
+        elif reduce == 'mean':
+            t_acc += np.nansum(t_tile, axis=0)
+            t_count += np.count_nonzero(~np.isnan(t_tile), axis=0)
+        elif reduce in ('smallest', 'largest'):
+            # k best rows of the tile are merged with k best rows so far, NaN never wins
+            t_tile_keys = np.where(np.isnan(t_tile), np.inf, t_tile if reduce == 'smallest' else -t_tile)
+            t_best = _k_best(t_tile_keys, t_k)
+            t_tile_keys, t_tile_values, t_tile_index = np.take_along_axis(t_tile_keys, t_best, axis=0), np.take_along_axis(t_tile, t_best, axis=0), t_best + t_begin
+            if t_keys is not None:
+                t_tile_keys, t_tile_values, t_tile_index = [np.concatenate(i) for i in ((t_keys, t_tile_keys), (t_values, t_tile_values), (t_index, t_tile_index))]
+                t_best = _k_best(t_tile_keys, t_k)
+                t_tile_keys, t_tile_values, t_tile_index = [np.take_along_axis(i, t_best, axis=0) for i in (t_tile_keys, t_tile_values, t_tile_index)]
+            t_keys, t_values, t_index = t_tile_keys, t_tile_values, t_tile_index
+
+    if reduce is None:
+        return _wrap_grid(t_res, skus, scenarios)
+    if reduce in ('min', 'max'):
+        return t_acc
+    if reduce == 'mean':
+        with np.errstate(invalid='ignore'):
+            return t_acc / t_count
+    if t_keys is None:
+        return np.zeros((0, t_cols), dtype=np.int64), np.zeros((0, t_cols), dtype=t_dtype)
+    # the best first, ties go to the lower row
+    t_order = np.lexsort((t_index, t_keys), axis=0)
+    return np.take_along_axis(t_index, t_order, axis=0), np.take_along_axis(t_values, t_order, axis=0)
+
+# finds rows of k smallest keys in every column
+def _k_best(t_keys, t_k):
+    'Finds rows of k smallest keys in every column (in no particular order).'
+    if t_keys.shape[0] <= t_k:
+        return np.broadcast_to(np.arange(t_keys.shape[0])[:, None], t_keys.shape)
+    return np.argpartition(t_keys, t_k - 1, axis=0)[:t_k]
+
+# returns matrix of scenario_grid as pd.DataFrame if SKU arguments are pandas objects
+def _wrap_grid(t_res, skus, scenarios):
+    'Returns matrix of scenario_grid as pd.DataFrame with index of SKU argument and scenarios as columns if any SKU argument is pd.Series, otherwise as ndarray.'
+    for t_arg in skus:
+        if _is_pd(t_arg) and t_arg.ndim == 1 and len(t_arg) == t_res.shape[0]:
+            return sys.modules['pandas'].DataFrame(t_res, index=t_arg.index, columns=np.asarray(scenarios).ravel())
+    return t_res
+
+# rows calculated together by evaluate(), temporaries of a chunk stay in CPU cache
+_CHUNK_SIZE = 16384
+
+# deferred call of elementwise formula
+class Expr:
+    'Deferred call of elementwise formula, built by lazy() and calculated by evaluate().'
+    __slots__ = ('formula', 'args')
+
+    def __init__(self, formula, args):
+        self.formula = formula
+        self.args = args
+
+    def __repr__(self):
+        return '%s(%s)' % (self.formula, ', '.join(repr(i) if isinstance(i, Expr) or _container_rank(i) == 0 else type(i).__name__ for i in self.args))
+
+# builds deferred call of elementwise formula
+def lazy(formula, *args):
+    'Builds deferred call of elementwise formula (function or its name) on scalars, arrays or other deferred calls.'
+    t_name = formula if isinstance(formula, str) else getattr(formula, '__name__', None)
+    if t_name not in _FORMULAS:
+        raise ValueError('Unsupported formula %r, options available: %s.' % (formula, ', '.join(_FORMULAS)))
+    return Expr(t_name, args)
+
+# calculates deferred calls of elementwise formulas chunk by chunk
+def evaluate(*exprs, chunk_size=_CHUNK_SIZE):
+    'Calculates deferred calls of elementwise formulas chunk by chunk, only final results are materialized.'
+
+    # pandas inputs of all calls are aligned by labels on the union of their indexes as eager calls align them
+    def leaves(t_obj):
+        if isinstance(t_obj, Expr):
+            for i in t_obj.args:
+                yield from leaves(i)
+        elif _is_pd(t_obj):
+            yield t_obj
+    t_pds = list({id(i): i for t_expr in exprs for i in leaves(t_expr)}.values())
+    t_aligned = {id(t_pd): t_new for t_pd, t_new in zip(t_pds, _align_pd(tuple(t_pds)))}
+
+    # graph of unique nodes in calculation order: (formula, indices of argument nodes) or (None, input)
+    t_nodes = []
+    t_keys = {}
+    t_inputs = []
+
+    def add_node(t_obj):
+        if isinstance(t_obj, Expr):
+            t_node = (t_obj.formula, tuple(add_node(i) for i in t_obj.args))
+            t_key = t_node
+        elif type(t_obj) in (float, int):
+            t_node = t_key = (None, t_obj)
+        else:
+            # the same input object is one node, inputs are kept alive so their ids are not reused
+            t_key = (None, id(t_obj))
+            t_obj = t_aligned.get(id(t_obj), t_obj)
+            t_inputs.append(t_obj)
+            t_node = (None, t_obj if _container_rank(t_obj) == 0 else _as_array(t_obj))
+        # equal calls on the same inputs are calculated once
+        if t_key not in t_keys:
+            t_keys[t_key] = len(t_nodes)
+            t_nodes.append(t_node)
+        return t_keys[t_key]
+
+    t_roots = [add_node(i) for i in exprs]
+
+    t_like = None
+    t_rank = 0
+    for t_obj in t_inputs:
+        if _container_rank(t_obj) > t_rank:
+            t_like, t_rank = t_obj, _container_rank(t_obj)
+
+    if t_like is None:
+        t_values = []
+        for t_formula, t_value in t_nodes:
+            t_values.append(_round_cents(t_formula, _FORMULAS[t_formula](*[t_values[i] for i in t_value])) if t_formula is not None else t_value)
+        t_results = [t_values[i] for i in t_roots]
+        return t_results[0] if len(t_results) == 1 else tuple(t_results)
+
+    if t_rank == 5:
+        # 1-D arguments are applied to every column of pd.DataFrame
+        t_nodes = [(None, t_value.reshape(-1, 1)) if t_formula is None and np.ndim(t_value) == 1 else (t_formula, t_value) for t_formula, t_value in t_nodes]
+    t_shape = np.broadcast_shapes(*[np.shape(t_value) for t_formula, t_value in t_nodes if t_formula is None])
+    t_chunk_size = max(int(chunk_size), 1)
+
+    t_results = [None] * len(t_roots)
+    for t_begin in range(0, max(t_shape[0], 1), t_chunk_size):
+        t_chunk = slice(t_begin, t_begin + t_chunk_size)
+        t_values = []
+        for t_formula, t_value in t_nodes:
+            if t_formula is not None:
+                t_values.append(_round_cents(t_formula, _FORMULAS[t_formula](*[t_values[i] for i in t_value])))
+            elif np.ndim(t_value) == len(t_shape) and t_value.shape[0] == t_shape[0]:
+                t_values.append(t_value[t_chunk])
+            else:
+                t_values.append(t_value)
+
+        for t_ind, t_root in enumerate(t_roots):
+            if t_results[t_ind] is None:
+                t_results[t_ind] = np.empty(t_shape, dtype=np.result_type(t_values[t_root]))
+            t_results[t_ind][t_chunk] = t_values[t_root]
+
+    t_results = [_wrap(i, t_like) for i in t_results]
+    return t_results[0] if len(t_results) == 1 else tuple(t_results)
+
+# attaches ndarrays placed in shared memory by _group_map
+def _attach_shared(t_specs):
+    'Attaches ndarrays placed in shared memory by _group_map, returns shared memory blocks and ndarrays.'
+    from multiprocessing import shared_memory
+
+    # workers of the pool share resource tracker with the parent process, which unlinks the memory
+    t_blocks = []
+    t_arrays = []
+    for t_name, t_shape, t_dtype in t_specs:
+        t_block = shared_memory.SharedMemory(name=t_name)
+        t_blocks.append(t_block)
+        t_arrays.append(np.ndarray(t_shape, dtype=t_dtype, buffer=t_block.buf))
+    return t_blocks, t_arrays
+
+# applies function to a block of groups in worker process
+def _group_task(t_func, t_specs, t_rows, t_group_args):
+    'Applies function to rows of a block of groups in worker process.'
+    t_blocks, t_arrays = _attach_shared(t_specs)
+    try:
+        t_res = t_func(*[i[t_rows[0]:t_rows[1]] for i in t_arrays], *t_group_args)
+        # results should not point into shared memory that is closed below
+        return tuple(np.array(i) for i in t_res)
+    finally:
+        del t_arrays
+        for t_block in t_blocks:
+            t_block.close()
+
+# applies function to blocks of groups in a process pool
+def _group_map(t_func, keys, arrays, group_args=(), workers=None, chunk_size=1000):
+    'Sorts arrays by group key, places them in shared memory and applies function to blocks of whole groups in a process pool.'
+    import concurrent.futures
+    from multiprocessing import shared_memory
+
+    t_groups, t_group = np.unique(np.asarray(keys).ravel(), return_inverse=True)
+    t_order = np.argsort(t_group, kind='stable')
+    t_starts = np.searchsorted(t_group[t_order], np.arange(t_groups.size + 1))
+    t_chunk_size = max(int(chunk_size), 1)
+    t_workers = workers or os.cpu_count() or 1
+
+    t_blocks = []
+    try:
+        t_specs = []
+        for t_array in [t_group] + [np.asarray(i).ravel() for i in arrays]:
+            if t_array.size != t_group.size:
+                raise ValueError('Keys and arrays should have the same length.')
+            t_block = shared_memory.SharedMemory(create=True, size=max(t_array.nbytes, 1))
+            t_blocks.append(t_block)
+            np.take(t_array, t_order, out=np.ndarray(t_array.shape, dtype=t_array.dtype, buffer=t_block.buf))
+            t_specs.append((t_block.name, t_array.shape, t_array.dtype.str))
+
+        t_tasks = [(t_func, t_specs, (t_starts[i], t_starts[min(i + t_chunk_size, t_groups.size)]), [j[i:i + t_chunk_size] for j in group_args])
+                   for i in range(0, t_groups.size, t_chunk_size)]
+
+        if t_workers == 1 or len(t_tasks) <= 1:
+            t_arrays = [np.ndarray(i[1], dtype=i[2], buffer=t_block.buf) for i, t_block in zip(t_specs, t_blocks)]
+            t_results = [tuple(np.array(j) for j in t_func(*[a[t_rows[0]:t_rows[1]] for a in t_arrays], *t_args)) for _, _, t_rows, t_args in t_tasks]
+            del t_arrays
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=t_workers) as t_pool:
+                t_results = list(t_pool.map(_group_task, *zip(*t_tasks)))
+    finally:
+        for t_block in t_blocks:
+            t_block.close()
+            t_block.unlink()
+
+    return t_groups, t_order, t_results
+
+# elast_group of a block of groups, group keys are replaced by their codes
+def _elast_block(group, retail, units, segment_begin, segment_end):
+    'Calculates elast_group statistics of a block of groups.'
+    return elast_group(retail, units, group, segment_begin, segment_end)[1:]
+
+# opt_retail_batch of a block of groups
+def _opt_retail_block(group, retail, units, elast_coef, range):
+    'Calculates opt_retail_batch of a block of groups.'
+    return opt_retail_batch(retail, units, elast_coef, range)
+
+# linear regression in the segment for every group in a process pool
+def elast_parallel(retail, units, keys, segment_begin=0, segment_end=0, workers=None, chunk_size=1000):
+    'Calculates coefficient and intercept for linear regression model in the segment for every group in a process pool.'
+    t_n_groups = np.unique(np.asarray(keys).ravel()).size
+    t_group_args = [np.broadcast_to(np.asarray(i, dtype=float), (t_n_groups,)) for i in (segment_begin, segment_end)]
+    t_groups, t_order, t_results = _group_map(_elast_block, keys, [retail, units], t_group_args, workers, chunk_size)
+    return (t_groups,) + tuple(np.concatenate([t_res[i] for t_res in t_results]) if t_results else np.zeros(0) for i in range(5))
+
+# optimal retails for every group in a process pool
+def opt_retail_parallel(retail, units, elast_coef, keys, range=0.1, workers=None, chunk_size=1000):
+    'Calculates opimal retails (max dollar sales) and $ sales at these retails for blocks of groups in a process pool.'
+    t_retail = np.asarray(retail, dtype=float).ravel()
+    t_arrays = [np.broadcast_to(np.asarray(i, dtype=float).ravel(), t_retail.shape) for i in (t_retail, units, elast_coef, range)]
+    t_groups, t_order, t_results = _group_map(_opt_retail_block, keys, t_arrays, (), workers, chunk_size)
+
+    t_opt_retails = np.zeros(t_retail.size)
+    t_opt_sales = np.zeros(t_retail.size)
+    if t_results:
+        t_opt_retails[t_order] = np.concatenate([i[0] for i in t_results])
+        t_opt_sales[t_order] = np.concatenate([i[1] for i in t_results])
+    return t_opt_retails, t_opt_sales
+
+# running sums behind weighted metrics
+class WeightedSums:
+    'Running sums behind weighted metrics: sum(units * retail), sum(units * cost), sum(units * base_retail).'
+
+    def __init__(self):
+        self.rows = 0
+        self.units = 0.0
+        self.sales = 0.0
+        self.cost = 0.0
+        self.base_sales = 0.0
+
+    def __repr__(self):
+        return 'WeightedSums(rows=%d, units=%r, sales=%r, cost=%r, base_sales=%r)' % (self.rows, self.units, self.sales, self.cost, self.base_sales)
+
+    def update(self, units, retail=None, cost=None, base_retail=None):
+        'Adds chunk of unit sales with retails, costs and base retails (any of them can be skipped).'
+        t_units = np.asarray(units).ravel()
+        t_values = [i for i in (retail, cost, base_retail) if i is not None]
+        t_sums = iter(_weighted_sums(t_units, *t_values))
+        self.rows += t_units.size
+        self.units += float(t_units.sum())
+        if retail is not None: self.sales += next(t_sums)
+        if cost is not None: self.cost += next(t_sums)
+        if base_retail is not None: self.base_sales += next(t_sums)
+        return self
+
+    def merge(self, other):
+        'Adds running sums of other WeightedSums (e.g. calculated for another file or in another process).'
+        self.rows += other.rows
+        self.units += other.units
+        self.sales += other.sales
+        self.cost += other.cost
+        self.base_sales += other.base_sales
+        return self
+
+    def margin(self):
+        'Calculates weighted % margin.'
+        return (self.sales - self.cost) / self.sales
+
+    def markup(self):
+        'Calculates weighted % markup.'
+        return (self.sales - self.cost) / self.cost
+
+    def priceindex(self):
+        'Calculates weighted Price Index.'
+        return self.sales / self.base_sales
+
+# reads columns of CSV or Parquet file chunk by chunk
+def iter_chunks(path, columns, chunk_size=1000000):
+    'Reads columns of CSV or Parquet file chunk by chunk, yields dict of ndarrays.'
+    if str(path).lower().endswith(('.parquet', '.pq')):
+        import pyarrow.parquet as pq
+
+        for t_batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size, columns=columns):
+            yield {i: t_batch.column(i).to_numpy(zero_copy_only=False) for i in columns}
     else:
-        t_var = 1 / (1 - discount / margin) - 1
-        return t_var
+        import pandas as pd
 
-# creates and show retails distribution
-def retail_distr(retail, precision=1):
-    'Creates and show retails distribution.'
-    t_retail = np.array(retail).flatten()
+        for t_chunk in pd.read_csv(path, usecols=columns, chunksize=chunk_size):
+            yield {i: t_chunk[i].to_numpy() for i in columns}
+
+# calculates weighted metrics of transaction file chunk by chunk
+def iter_weighted(path, units='units', retail='retail', cost=None, base_retail=None, chunk_size=1000000):
+    'Calculates running sums behind weighted metrics of CSV or Parquet transaction file chunk by chunk, yields WeightedSums after every chunk.'
+    t_columns = [i for i in (units, retail, cost, base_retail) if i is not None]
+    t_sums = WeightedSums()
+    for t_chunk in iter_chunks(path, t_columns, chunk_size):
+        t_sums.update(t_chunk[units], *[t_chunk.get(i) for i in (retail, cost, base_retail)])
+        yield t_sums
+
+# calculates weighted metrics of transaction file
+def stream_weighted(path, units='units', retail='retail', cost=None, base_retail=None, chunk_size=1000000):
+    'Calculates running sums behind weighted metrics of CSV or Parquet transaction file holding one chunk in memory at a time.'
+    t_sums = WeightedSums()
+    for t_sums in iter_weighted(path, units, retail, cost, base_retail, chunk_size):
+        pass
+    return t_sums
+
+# first bytes of price book file: magic and version
+_BOOK_MAGIC = b'PYRETBK1'
+
+# columns of price book are aligned to this number of bytes
+_BOOK_ALIGN = 64
+
+# writes columnar price book
+def write_book(path, columns, group=None):
+    'Writes columns (dict of arrays or pd.DataFrame) into price book file: typed columns and header describing them, rows sorted by group column.'
+    import json
+
+    # object columns (e.g. strings of pandas) are stored as fixed-width unicode, where None and NaN would become keys 'None' and 'nan'
+    def to_column(t_name, t_column):
+        t_column = np.asarray(t_column).ravel()
+        if t_column.dtype != object:
+            return t_column
+        t_pd = sys.modules.get('pandas')
+        t_null = t_pd.isna(t_column) if t_pd is not None else np.array([i is None or i != i for i in t_column.tolist()], dtype=bool)
+        if t_null.any():
+            raise ValueError('Column %r has %d missing values, object columns should not have None or NaN.' % (t_name, t_null.sum()))
+        return t_column.astype(str)
+
+    t_columns = {str(i): to_column(str(i), columns[i]) for i in columns}
+    t_rows = set(i.size for i in t_columns.values())
+    if len(t_rows) > 1:
+        raise ValueError('Columns should have the same length.')
+    t_rows = t_rows.pop() if t_rows else 0
+
+    t_header = {'rows': t_rows, 'columns': {}, 'group': None}
+    if group is not None:
+        if group not in t_columns:
+            raise ValueError('Group column %r is not in columns.' % group)
+        # stable sort keeps the order of rows within a group, every group is a contiguous slice
+        t_order = np.argsort(t_columns[group], kind='stable')
+        t_columns = {i: t_columns[i][t_order] for i in t_columns}
+        t_keys, t_starts = np.unique(t_columns[group], return_index=True)
+        # keys of datetime64 and timedelta64 groups are int64 numbers of their unit
+        t_header['group'] = {'column': group, 'keys': (t_keys.view(np.int64) if t_keys.dtype.kind in 'mM' else t_keys).tolist(), 'starts': t_starts.tolist()}
+
+    t_offset = 0
+    for t_name, t_column in t_columns.items():
+        t_header['columns'][t_name] = {'dtype': t_column.dtype.str, 'offset': t_offset}
+        t_offset += -(-t_column.nbytes // _BOOK_ALIGN) * _BOOK_ALIGN
+    t_json = json.dumps(t_header).encode()
+    t_data_offset = -(-(len(_BOOK_MAGIC) + 8 + len(t_json)) // _BOOK_ALIGN) * _BOOK_ALIGN
+
+    with open(path, 'wb') as t_file:
+        t_file.write(_BOOK_MAGIC + np.uint64(len(t_json)).tobytes() + t_json)
+        for t_name, t_column in t_columns.items():
+            t_file.seek(t_data_offset + t_header['columns'][t_name]['offset'])
+            # datetime64 and timedelta64 have no buffer protocol, they are written as int64 and their dtype in the header keeps the unit
+            t_column = np.ascontiguousarray(t_column)
+            t_file.write(memoryview(t_column.view(np.int64) if t_column.dtype.kind in 'mM' else t_column).cast('B'))
+        t_file.truncate(t_data_offset + t_offset)
+    return path
+
+# memory-mapped columnar price book
+class PriceBook:
+    'Memory-mapped columnar price book written by write_book: columns are read-only ndarray views of the file, groups are contiguous slices.'
+
+    def __init__(self, path):
+        import json
+
+        self.path = path
+        with open(path, 'rb') as t_file:
+            if t_file.read(len(_BOOK_MAGIC)) != _BOOK_MAGIC:
+                raise ValueError('%s is not a price book.' % path)
+            t_length = int(np.frombuffer(t_file.read(8), dtype=np.uint64)[0])
+            t_header = json.loads(t_file.read(t_length))
+        t_data_offset = -(-(len(_BOOK_MAGIC) + 8 + t_length) // _BOOK_ALIGN) * _BOOK_ALIGN
+
+        self.rows = t_header['rows']
+        t_map = np.memmap(path, dtype=np.uint8, mode='r')
+        self._columns = {}
+        for t_name, t_spec in t_header['columns'].items():
+            t_dtype = np.dtype(t_spec['dtype'])
+            t_begin = t_data_offset + t_spec['offset']
+            self._columns[t_name] = t_map[t_begin:t_begin + self.rows * t_dtype.itemsize].view(t_dtype)
+
+        t_group = t_header['group']
+        self.group_column = t_group['column'] if t_group else None
+        self.group_keys = np.array(t_group['keys']) if t_group else None
+        if t_group and self._columns[self.group_column].dtype.kind in 'mM':
+            self.group_keys = self.group_keys.astype(np.int64).view(self._columns[self.group_column].dtype)
+        self._bounds = {t_key: (t_begin, t_end) for t_key, t_begin, t_end in zip(t_group['keys'], t_group['starts'], t_group['starts'][1:] + [self.rows])} if t_group else {}
+
+    def __repr__(self):
+        return 'PriceBook(%r, rows=%d, columns=[%s], groups=%s)' % (self.path, self.rows, ', '.join(self._columns), len(self._bounds) if self.group_column else None)
+
+    def __len__(self):
+        return self.rows
+
+    def __contains__(self, name):
+        return name in self._columns
+
+    def __getitem__(self, name):
+        'Returns column as read-only ndarray view of the file.'
+        return self._columns[name]
+
+    @property
+    def columns(self):
+        return list(self._columns)
+
+    def group(self, key):
+        'Returns columns of rows of the group as dict of read-only ndarray views of the file.'
+        t_key = key.item() if isinstance(key, np.generic) else key
+        if self.group_column is not None and self._columns[self.group_column].dtype.kind in 'mM':
+            # datetime64 and timedelta64 keys (or strings of them) are found as int64 numbers of the unit of the column
+            t_key = np.asarray(key).astype(self._columns[self.group_column].dtype).view(np.int64).item()
+        if t_key not in self._bounds:
+            raise KeyError(key)
+        t_begin, t_end = self._bounds[t_key]
+        return {i: self._columns[i][t_begin:t_end] for i in self._columns}
+
+# opens columnar price book
+def open_book(path):
+    'Opens price book file written by write_book with np.memmap: nothing is read until columns are used, processes share OS page cache.'
+    return PriceBook(path)
+
+# pricing server combining concurrent requests into vectorized batches
+class BatchServer:
+    'Asyncio server of elementwise formulas over TCP or Unix socket, concurrent scalar requests of the same formula are calculated as one vectorized batch.'
+
+    def __init__(self, max_delay=0.001, max_batch=4096, limit=2 ** 16):
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self.limit = limit
+        self.requests = 0
+        self.batches = 0
+        self._pending = {}
+        self._timers = {}
+
+    def __repr__(self):
+        return 'BatchServer(requests=%d, batches=%d)' % (self.requests, self.batches)
+
+    def submit(self, formula, args):
+        'Queues call of elementwise formula, returns future of its result (calls on scalars are batched, other calls are calculated at once).'
+        import asyncio
+
+        t_loop = asyncio.get_running_loop()
+        t_future = t_loop.create_future()
+        self.requests += 1
+        if formula not in _FORMULAS:
+            raise ValueError('Unsupported formula %r, options available: %s.' % (formula, ', '.join(_FORMULAS)))
+        if len(args) != _FORMULAS[formula].__code__.co_argcount:
+            raise ValueError('Formula %s takes %d arguments.' % (formula, _FORMULAS[formula].__code__.co_argcount))
+        if not all(type(i) in (int, float) for i in args):
+            with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+                t_res = _round_cents(formula, _elementwise(_FORMULAS[formula], *[np.asarray(i, dtype=float) if type(i) is list else i for i in args]))
+            t_future.set_result(t_res.tolist() if isinstance(t_res, (np.ndarray, np.generic)) else t_res)
+            return t_future
+
+        # ints out of float range (e.g. 10 ** 309) fail their own request, not the batch
+        t_pending = self._pending.setdefault(formula, [])
+        t_pending.append(([float(i) for i in args], t_future))
+        if len(t_pending) >= self.max_batch:
+            self._flush(formula)
+        elif len(t_pending) == 1:
+            self._timers[formula] = t_loop.call_later(self.max_delay, self._flush, formula)
+        return t_future
+
+    def _flush(self, formula):
+        'Calculates queued calls of formula as one vectorized call and resolves their futures.'
+        t_timer = self._timers.pop(formula, None)
+        if t_timer is not None:
+            t_timer.cancel()
+        t_pending = self._pending.pop(formula, [])
+        if not t_pending:
+            return
+        self.batches += 1
+
+        # results follow ndarray arithmetic: division by zero gives inf or nan, any other error is the error of every request of the batch
+        try:
+            with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+                t_res = _round_cents(formula, _FORMULAS[formula](*np.array([i[0] for i in t_pending], dtype=float).T)).tolist()
+        except Exception as t_error:
+            for t_args, t_future in t_pending:
+                if not t_future.done():
+                    t_future.set_exception(t_error)
+            return
+        for (t_args, t_future), t_value in zip(t_pending, t_res):
+            if not t_future.done():
+                t_future.set_result(t_value)
+
+    async def _handle(self, reader, writer):
+        'Serves connection: reads JSON request lines, writes JSON response lines in the order of requests.'
+        import asyncio
+        import json
+
+        t_loop = asyncio.get_running_loop()
+        t_queue = asyncio.Queue()
+
+        # nan and inf are not JSON numbers, they are sent as null
+        def finite(t_value):
+            if type(t_value) is float:
+                return t_value if np.isfinite(t_value) else None
+            if type(t_value) is list:
+                return [finite(i) for i in t_value]
+            return t_value
+
+        async def respond():
+            while True:
+                t_item = await t_queue.get()
+                if t_item is None:
+                    break
+                t_id, t_future = t_item
+                # results which are not JSON get an error response too
+                try:
+                    t_msg = {'result': finite(await t_future)}
+                    t_line = json.dumps(t_msg if t_id is None else dict(t_msg, id=t_id), allow_nan=False)
+                except Exception as t_error:
+                    t_msg = {'error': '%s: %s' % (type(t_error).__name__, t_error)}
+                    t_line = json.dumps(t_msg if t_id is None else dict(t_msg, id=t_id))
+                writer.write((t_line + '\n').encode())
+                # responses resolved by the same batch are written together
+                if t_queue.empty():
+                    await writer.drain()
+
+        t_responder = asyncio.ensure_future(respond())
+        try:
+            while True:
+                t_id = None
+                try:
+                    t_line = await reader.readline()
+                except ValueError:
+                    # the rest of the line over the limit of StreamReader can not be told from the next request, the connection is closed
+                    t_future = t_loop.create_future()
+                    t_future.set_exception(ValueError('Request line is longer than %d bytes.' % self.limit))
+                    t_queue.put_nowait((None, t_future))
+                    break
+                if not t_line:
+                    break
+                try:
+                    t_request = json.loads(t_line)
+                    t_id = t_request.get('id')
+                    t_future = self.submit(t_request['formula'], t_request.get('args', []))
+                except Exception as t_error:
+                    t_future = t_loop.create_future()
+                    t_future.set_exception(t_error)
+                t_queue.put_nowait((t_id, t_future))
+        except ConnectionError:
+            pass
+        finally:
+            t_queue.put_nowait(None)
+            try:
+                await t_responder
+            except ConnectionError:
+                pass
+            writer.close()
+
+    async def start(self, host='127.0.0.1', port=8765, path=None):
+        'Starts listening on TCP host:port or on Unix socket path, returns asyncio server.'
+        import asyncio
+
+        if path is not None:
+            return await asyncio.start_unix_server(self._handle, path=path, limit=self.limit)
+        return await asyncio.start_server(self._handle, host, port, limit=self.limit)
+
+# runs pricing server
+def serve(host='127.0.0.1', port=8765, path=None, max_delay=0.001, max_batch=4096, limit=2 ** 16):
+    'Runs asyncio pricing server of elementwise formulas over TCP or Unix socket until interrupted, concurrent requests are calculated in vectorized batches.'
+    import asyncio
+
+    async def run():
+        t_server = await BatchServer(max_delay, max_batch, limit).start(host, port, path)
+        async with t_server:
+            await t_server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+# calculates histogram of retails
+def retail_hist(retail, precision=1):
+    'Calculates histogram of retails: number of cases in every retail price segment of the size precision.'
+    t_retail = np.asarray(retail, dtype=float).ravel()
+    t_retail = t_retail[np.isfinite(t_retail)]
+    if t_retail.size == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(1)
     t_min = t_retail.min()
     t_max = t_retail.max()
-    
-    plt.title('Retails Distribution.')
-    plt.xlabel('retail price segment')
-    plt.ylabel('nunmber of cases')
-    plt.grid(True)
-    t_xticks = [i for i in np.arange(t_min - (t_min % precision), t_max + precision, precision)]
-    plt.xticks(t_xticks)
-    plt.hist(t_retail, bins=t_xticks, rwidth=0.8)
+
+    # the last bin includes its right edge, as in np.histogram
+    t_edges = np.arange(t_min - (t_min % precision), t_max + precision, precision)
+    if t_edges.size < 2 or t_edges[-1] < t_max:
+        t_edges = np.append(t_edges, t_edges[-1] + precision)
+    t_bins = np.clip(np.searchsorted(t_edges, t_retail, side='right') - 1, 0, t_edges.size - 2)
+    return np.bincount(t_bins, minlength=t_edges.size - 1), t_edges
+
+# calculates density grid of retails and units
+def depend_grid(retail, units, bins=100):
+    'Calculates 2D density grid of retails and units: number of cases in every cell of retail x units grid.'
+    t_retail = np.asarray(retail, dtype=float).ravel()
+    t_units = np.asarray(units, dtype=float).ravel()
+    if t_retail.size != t_units.size:
+        raise ValueError('Retail and units should have the same length.')
+    t_mask = np.isfinite(t_retail) & np.isfinite(t_units)
+    t_counts, t_retail_edges, t_units_edges = np.histogram2d(t_retail[t_mask], t_units[t_mask], bins=bins)
+    return t_counts.astype(np.int64), t_retail_edges, t_units_edges
+
+# number of points up to which show_depend draws scatter of the points themselves
+_SCATTER_MAX = 10000
+
+# draws histogram of retails on axes
+def _draw_distr(t_ax, t_counts, t_edges):
+    'Draws histogram of retails on axes from bin counts.'
+    t_ax.set_title('Retails Distribution.')
+    t_ax.set_xlabel('retail price segment')
+    t_ax.set_ylabel('nunmber of cases')
+    t_ax.grid(True)
+    if t_edges.size <= 50:
+        t_ax.set_xticks(t_edges)
+    if t_counts.size:
+        t_ax.hist(t_edges[:-1], bins=t_edges, weights=t_counts, rwidth=0.8)
+
+# draws price/units dependency on axes
+def _draw_depend(t_ax, retail, units, gridsize):
+    'Draws price/units scatter on axes for a few points, otherwise hexbin density from density grid.'
+    t_ax.set_title('Retails/Units Dependency.')
+    t_ax.set_xlabel('retail price')
+    t_ax.set_ylabel('units sold')
+    t_ax.grid(True)
+    if np.size(retail) <= _SCATTER_MAX:
+        t_ax.scatter(retail, units)
+        return
+
+    # grid 4 times finer than hexagons, hexbin sums counts of non-empty cells
+    t_counts, t_retail_edges, t_units_edges = depend_grid(retail, units, bins=4 * gridsize)
+    t_x, t_y = np.meshgrid((t_retail_edges[:-1] + t_retail_edges[1:]) / 2, (t_units_edges[:-1] + t_units_edges[1:]) / 2, indexing='ij')
+    t_mask = t_counts > 0
+    t_ax.hexbin(t_x[t_mask], t_y[t_mask], C=t_counts[t_mask], reduce_C_function=np.sum, gridsize=gridsize, bins='log', mincnt=1)
+
+# creates figure that is not attached to pyplot, rendered by non-interactive Agg backend
+def _agg_figure():
+    'Creates figure rendered by non-interactive Agg backend, not attached to pyplot (nothing is shown, nothing has to be closed).'
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    t_fig = Figure()
+    FigureCanvasAgg(t_fig)
+    return t_fig
+
+# creates and show retails distribution
+def retail_distr(retail, precision=1, path=None):
+    'Creates and show retails distribution.'
+    t_counts, t_edges = retail_hist(retail, precision)
+    if path is not None:
+        t_fig = _agg_figure()
+        _draw_distr(t_fig.add_subplot(), t_counts, t_edges)
+        t_fig.savefig(path)
+        return path
+
+    import matplotlib.pyplot as plt
+
+    _draw_distr(plt.gca(), t_counts, t_edges)
     plt.show()
 
 # creates and show price/units dependency scatter
-def show_depend(retail, units):
+def show_depend(retail, units, gridsize=50, path=None):
     'Creates and show price/units dependency scatter.'
-    plt.title('Retails/Units Dependency.')
-    plt.xlabel('retail price')
-    plt.ylabel('units sold')
-    plt.grid(True)
-    plt.scatter(retail, units)
+    if path is not None:
+        t_fig = _agg_figure()
+        _draw_depend(t_fig.add_subplot(), retail, units, gridsize)
+        t_fig.savefig(path)
+        return path
+
+    import matplotlib.pyplot as plt
+
+    _draw_depend(plt.gca(), retail, units, gridsize)
     plt.show()
 
+# renders charts of every group into files
+def render_charts(retail, keys, path, units=None, precision=1, gridsize=50, format='png'):
+    'Renders retails distribution (price/units dependency if units are given) of every group of long-format data into files with non-interactive backend.'
+    t_retail = np.asarray(retail, dtype=float).ravel()
+    t_units = np.asarray(units, dtype=float).ravel() if units is not None else None
+    t_groups, t_group = np.unique(np.asarray(keys).ravel(), return_inverse=True)
+    if t_group.size != t_retail.size or t_units is not None and t_units.size != t_retail.size:
+        raise ValueError('Retail, units and keys should have the same length.')
+    os.makedirs(path, exist_ok=True)
+
+    # one sort splits all groups, one figure is cleared and reused for every chart
+    t_order = np.argsort(t_group, kind='stable')
+    t_bounds = np.searchsorted(t_group[t_order], np.arange(t_groups.size + 1))
+    t_fig = _agg_figure()
+    t_files = []
+    t_names = set()
+    for t_ind, t_key in enumerate(t_groups):
+        t_rows = t_order[t_bounds[t_ind]:t_bounds[t_ind + 1]]
+        t_fig.clear()
+        if t_units is None:
+            _draw_distr(t_fig.add_subplot(), *retail_hist(t_retail[t_rows], precision))
+        else:
+            _draw_depend(t_fig.add_subplot(), t_retail[t_rows], t_units[t_rows], gridsize)
+        # keys changed by replacing characters or colliding with a name taken before (case-insensitive file systems too) get a short hash of the key
+        t_name = re.sub(r'[^\w.-]', '_', str(t_key))
+        if t_name != str(t_key) or not t_name or t_name.lower() in t_names:
+            t_name += '_' + hashlib.blake2b(str(t_key).encode(), digest_size=4).hexdigest()
+        t_names.add(t_name.lower())
+        t_files.append(os.path.join(path, '%s.%s' % (t_name, format)))
+        t_fig.savefig(t_files[-1])
+    return t_files
+
+# parses smart rounding template: number of decimals, ending digits
+@functools.lru_cache(maxsize=256)
+def _smart_round_temp(temp):
+    'Parses smart rounding template into number of decimals, modulus of ending digits and sorted ending digits.'
+
+    # '(..)' holds comma separated options, template expands into every combination of options
+    t_parts = re.split(r'\(([^()]*)\)', temp)
+    if any(i in ''.join(t_parts) for i in '()'):
+        raise ValueError('Unbalanced or nested parentheses in template %r.' % temp)
+    t_options = [[t_part] if t_ind % 2 == 0 else t_part.split(',') for t_ind, t_part in enumerate(t_parts)]
+
+    t_decs = set()
+    t_endings = []
+    for t_temp in itertools.product(*t_options):
+        t_temp = ''.join(t_temp).strip()
+        t_decs.add(len(t_temp) - 1 - t_temp.index('.') if '.' in t_temp else 0)
+        t_digits = t_temp.replace('.', '')
+        t_ending = t_digits[t_digits.rfind('*') + 1:]
+        if not t_ending.isdigit() and t_ending != '' or any(i.isdigit() for i in t_digits[:t_digits.rfind('*') + 1]):
+            raise ValueError('Ending digits should follow all * in template %r.' % temp)
+        t_endings.append(t_ending)
+
+    if len(t_decs) != 1:
+        raise ValueError('All options of template %r should have the same number of decimals.' % temp)
+    if '' in t_endings:
+        if any(t_endings):
+            raise ValueError('All options of template %r should have ending digits or none of them.' % temp)
+        return t_decs.pop(), 1, ()
+
+    # shorter endings repeat within the longest one, e.g. '*.(*9,95)' allows .09, .19, ..., .95, .99
+    t_width = max(len(i) for i in t_endings)
+    t_mod = 10 ** t_width
+    t_ladder = set()
+    for t_ending in t_endings:
+        t_ladder.update(range(int(t_ending), t_mod, 10 ** len(t_ending)))
+
+    return t_decs.pop(), t_mod, tuple(sorted(t_ladder))
+
 # smart rounding: number of decimals, ending digits
 def smart_round(retail, temp='*.**', align='fair'):
     'Smart rounding: number of decimals, ending digits.'
-    
-    # counts number of digits in a number 
-    def d_num(t_did):     
-        t_d_n = 1       
-        while t_did >= 10: 
-            t_did = t_did / 10
-            t_d_n = t_d_n + 1
-        return t_d_n
-    
-    t_retail = np.array(retail)
-    
-    try:
-        t_dot_ind = temp.index('.')
-    except:
-        t_dot_ind = -1
-    
-    t_case = 1
-    if any(i.isdigit() for i in temp): t_case = 2
-    if any(i == '(' or i == ')' for i in temp): t_case = 3
-    
-    if t_case == 1:
-        
-        if t_dot_ind != -1:
-            t_dec = (len(temp) - 1) - t_dot_ind
-        else:
-            t_dec = 0
-        
-        t_retail = t_retail * (10 ** t_dec) + 0.5
-        t_retail_int = t_retail.astype(int).copy()
-        t_retail = t_retail_int.astype(float).copy()
-        t_retail = t_retail / (10 ** t_dec)
-        
-        return t_retail
-        
-    elif t_case == 2:
-        
-        if t_dot_ind != -1:
-            t_dec = (len(temp) - 1) - t_dot_ind
-        else:
-            t_dec = 0
-            
-        t_retail = t_retail * (10 ** t_dec) + 0.5
-        t_retail_int = t_retail.astype(int).copy()
-        
-        d_temp = float(temp.replace('*','0')) * (10 ** t_dec)
-        
-        t_new_retail = np.array(0)
-        
-        for i in t_retail_int:
-            
-            t_low_bound = i - (i % 10 ** (d_num(d_temp))) - 10 ** d_num(d_temp) + d_temp
-            if t_low_bound <= 0: t_low_bound = t_low_bound + 10 ** d_num(d_temp)
-            t_upper_bound = i - (i % 10 ** (d_num(d_temp))) + d_temp
-            
-            if align == 'down': t_new_retail = np.append(t_new_retail, t_low_bound)                
-            elif align == 'up': t_new_retail = np.append(t_new_retail, t_upper_bound)
-            elif align == 'fair':
-                
-                if np.abs(i - t_low_bound) > np.abs(i - t_upper_bound): t_new_retail = np.append(t_new_retail, t_upper_bound) 
-                else: t_new_retail = np.append(t_new_retail, t_low_bound)             
-                     
-        t_retail = t_new_retail[1:].astype(float).copy()
-        t_retail = t_retail / (10 ** t_dec)
-        
-        return t_retail
\ No newline at end of file
+
+    t_dec, t_mod, t_endings = _smart_round_temp(temp)
+
+    if _CENTS is None:
+        t_retail_int = (np.array(retail, dtype=float) * (10 ** t_dec) + 0.5).astype(np.int64)
+    else:
+        # fixed-point retails are brought to the decimals of the template by integer division, endings are integer modulo arithmetic
+        if 10 ** t_dec > _CENTS:
+            raise ValueError('Template %r has more decimals than scale %d of prices.' % (temp, _CENTS))
+        t_step = _CENTS // 10 ** t_dec
+        t_retail_int = np.asarray(retail)
+        if t_retail_int.dtype.kind not in 'iu':
+            t_retail_int = np.floor(t_retail_int.astype(float) + 0.5)
+        t_retail_int = t_retail_int.astype(np.int64, copy=False)
+        if t_step > 1:
+            t_retail_int = (t_retail_int + t_step // 2) // t_step
+
+    if len(t_endings) == 0:
+        return t_retail_int / (10 ** t_dec) if _CENTS is None else t_retail_int * t_step
+
+    # allowed retails are base + ending, offsets of the closest ones below and above are found in the sorted endings
+    # for every remainder modulo t_mod once (or for every retail if there are less retails than remainders)
+    t_endings = np.array(t_endings, dtype=np.int64)
+    t_rem = t_retail_int % t_mod
+    t_keys = np.arange(t_mod) if t_mod <= t_rem.size else t_rem
+
+    t_ind = np.searchsorted(t_endings, t_keys, side='right') - 1
+    t_low_offset = np.where(t_ind >= 0, 0, -t_mod) + t_endings[t_ind] - t_keys
+
+    t_ind = np.searchsorted(t_endings, t_keys, side='left')
+    t_upper_offset = np.where(t_ind < t_endings.size, 0, t_mod) + t_endings[t_ind % t_endings.size] - t_keys
+
+    if align == 'down': t_offset = t_low_offset
+    elif align == 'up': t_offset = t_upper_offset
+    elif align == 'fair': t_offset = np.where(-t_low_offset > t_upper_offset, t_upper_offset, t_low_offset)
+    else: raise ValueError("Unsupported align %r, options available: 'down', 'fair', 'up'." % align)
+
+    if t_keys is not t_rem:
+        t_offset = t_offset[t_rem]
+        t_upper_offset = t_upper_offset[t_rem]
+    t_new_retail = t_retail_int + t_offset
+
+    # retails are not rounded down to zero or below
+    t_low_bound = t_new_retail <= 0
+    if np.any(t_low_bound):
+        t_new_retail = np.where(t_low_bound, t_retail_int + t_upper_offset, t_new_retail)
+
+    return t_new_retail / (10 ** t_dec) if _CENTS is None else t_new_retail * t_step